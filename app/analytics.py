@@ -0,0 +1,167 @@
+"""
+Per-banner drop analytics from hourly rollups.
+
+`record_rollups` runs in the same transaction as every pull batch and adds
+to one (banner, hour, item) counter row per key, so comparing observed
+drop rates with the configured ones never has to scan `pulls`.
+`rebuild_rollups` recomputes the table from history.
+"""
+from datetime import datetime, timezone
+from itertools import chain
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.catalog import BannerSnapshot
+from app.archive import iter_records
+from app.models import ArchivedPulls, BannerHourlyRollup, Item, PityState, Pull
+
+ROLLUP_COLUMNS = ("pulls", "pity_hits", "guarantee_hits")
+UPSERT_CHUNK = 300  # rows per multi-row upsert (6 parameters each)
+
+
+def to_utc(moment: datetime) -> datetime:
+    """Naive UTC, the way DateTime columns are stored."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def to_hour(moment: datetime) -> datetime:
+    """Naive UTC, truncated to the hour, like the rollup keys."""
+    return to_utc(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def upsert_rollups(db: Session, deltas: dict[tuple[int, datetime, int], list[int]]) -> None:
+    """Add (banner_id, hour, item_id) -> [pulls, pity_hits, guarantee_hits] to the rollups."""
+    entries = list(deltas.items())
+    for start in range(0, len(entries), UPSERT_CHUNK):
+        upsert = sqlite_insert(BannerHourlyRollup).values(
+            [
+                {"banner_id": banner_id, "hour": hour, "item_id": item_id, **dict(zip(ROLLUP_COLUMNS, values))}
+                for (banner_id, hour, item_id), values in entries[start:start + UPSERT_CHUNK]
+            ]
+        )
+        db.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[BannerHourlyRollup.banner_id, BannerHourlyRollup.hour, BannerHourlyRollup.item_id],
+                set_={c: getattr(BannerHourlyRollup, c) + upsert.excluded[c] for c in ROLLUP_COLUMNS},
+            )
+        )
+
+
+def record_rollups(db: Session, rows) -> None:
+    """Fold a batch of app.gacha.PullRow into the hourly rollups."""
+    deltas: dict[tuple[int, datetime, int], list[int]] = {}
+    for r in rows:
+        counts = deltas.setdefault((r.banner_id, to_hour(r.created_at), r.item_id), [0, 0, 0])
+        counts[0] += 1
+        counts[1] += r.pity
+        counts[2] += r.guaranteed
+    upsert_rollups(db, deltas)
+
+
+def rebuild_rollups(db: Session) -> int:
+    """
+    Recompute banner_hourly_rollup by replaying every user's history through
+    the pity rules, which recovers pity hits. Which pulls the 10-pull
+    guarantee upgraded is not recorded in history, so existing
+    guarantee_hits are carried over. Returns the number of rollup rows.
+    """
+    # app.gacha writes rollups through this module, so it can only be imported here
+    from app.gacha import advance_pity, forced_rarity
+
+    guarantees = {
+        (b, h, i): g
+        for b, h, i, g in db.execute(
+            select(
+                BannerHourlyRollup.banner_id, BannerHourlyRollup.hour,
+                BannerHourlyRollup.item_id, BannerHourlyRollup.guarantee_hits,
+            ).where(BannerHourlyRollup.guarantee_hits > 0)
+        )
+    }
+    db.query(BannerHourlyRollup).delete(synchronize_session=False)
+
+    rarity = {item_id: r for item_id, r in db.execute(select(Item.id, Item.rarity))}
+    archived = (
+        (uid, bid, n, item_id, datetime.fromtimestamp(epoch, timezone.utc))
+        for uid, upto in db.execute(select(ArchivedPulls.user_id, ArchivedPulls.last_pull_number)).all()
+        for n, bid, item_id, epoch in iter_records(uid, upto)
+    )
+    hot = db.execute(
+        select(Pull.user_id, Pull.banner_id, Pull.pull_number, Pull.item_id, Pull.created_at)
+        .order_by(Pull.user_id, Pull.pull_number)
+        .execution_options(yield_per=5000)
+    )
+
+    # Archived pulls are all older than the ones left in the table, so
+    # chaining them keeps each user's pulls in order
+    states: dict[tuple[int, int], PityState] = {}
+    deltas: dict[tuple[int, datetime, int], list[int]] = {}
+    for uid, bid, pull_number, item_id, created_at in chain(archived, hot):
+        state = states.get((uid, bid))
+        if state is None:
+            state = states[(uid, bid)] = PityState(since_epic=0, since_legendary=0)
+        counts = deltas.setdefault((bid, to_hour(created_at), item_id), [0, 0, 0])
+        counts[0] += 1
+        counts[1] += forced_rarity(state) is not None
+        advance_pity(state, rarity[item_id], pull_number)
+
+    for key, counts in deltas.items():
+        counts[2] = guarantees.get(key, 0)
+    upsert_rollups(db, deltas)
+    return len(deltas)
+
+
+def banner_analytics(db: Session, banner: BannerSnapshot, start: datetime, end: datetime) -> dict:
+    """Observed vs configured drop rates and hourly pity rates for [start, end)."""
+    rows = db.execute(
+        select(
+            BannerHourlyRollup.hour, BannerHourlyRollup.item_id,
+            *[getattr(BannerHourlyRollup, c) for c in ROLLUP_COLUMNS],
+        )
+        .where(
+            BannerHourlyRollup.banner_id == banner.id,
+            BannerHourlyRollup.hour >= to_hour(start),
+            BannerHourlyRollup.hour < to_utc(end),
+        )
+        .order_by(BannerHourlyRollup.hour)
+    ).all()
+
+    per_item: dict[int, list[int]] = {}
+    per_hour: dict[datetime, list[int]] = {}
+    for hour, item_id, *values in rows:
+        for totals in (per_item.setdefault(item_id, [0, 0, 0]), per_hour.setdefault(hour, [0, 0, 0])):
+            for n, value in enumerate(values):
+                totals[n] += value
+
+    total = sum(v[0] for v in per_item.values())
+    weight_total = sum(i.drop_rate for i in banner.items) or 1.0
+    return {
+        "banner_id": banner.id,
+        "start": start,
+        "end": end,
+        "total_pulls": total,
+        "pity_hits": sum(v[1] for v in per_item.values()),
+        "guarantee_hits": sum(v[2] for v in per_item.values()),
+        "items": [
+            {
+                "item_id": item.id,
+                "item_name": item.name,
+                "rarity": item.rarity,
+                "pulls": per_item.get(item.id, [0])[0],
+                "configured_rate": item.drop_rate / weight_total,
+                "observed_rate": per_item.get(item.id, [0])[0] / total if total else 0.0,
+            }
+            for item in banner.items
+        ],
+        "hours": [
+            {
+                "hour": hour,
+                "pulls": pulls,
+                "pity_hits": pity_hits,
+                "guarantee_hits": guarantee_hits,
+                "pity_rate": pity_hits / pulls if pulls else 0.0,
+            }
+            for hour, (pulls, pity_hits, guarantee_hits) in per_hour.items()
+        ],
+    }
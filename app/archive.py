@@ -0,0 +1,277 @@
+"""
+Cold storage for old pull history. Run with: python -m app.archive --older-than-days 90
+
+Pulls older than the cutoff are moved out of the `pulls` table into
+per-user segment files of packed (pull_number, banner_id, item_id, epoch
+seconds) records, read back through mmap. Each run appends one segment
+per user, always a prefix of that user's history, so segments sorted by
+name are sorted by pull_number.
+
+`archived_pulls` is the source of truth: a user's pulls up to its
+last_pull_number are in segments, everything after is in `pulls`. The
+segment is written and fsynced before the rows are deleted, and the delete
+and the archived_pulls update commit together, so a crash in between only
+leaves an orphan segment, which the next run removes.
+"""
+import argparse
+import bisect
+import mmap
+import os
+import struct
+from collections.abc import Iterator
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.catalog import Catalog, get_catalog
+from app.database import SessionLocal, engine, require_schema
+from app.models import ArchivedPulls, Pull
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "sakura_gacha_archive")
+RECORD = struct.Struct("<IIII")  # pull_number, banner_id, item_id, epoch seconds
+SEGMENT_SUFFIX = ".seg"
+
+
+class ArchivedRow(NamedTuple):
+    """An archived pull, shaped like a history_query row."""
+    pull_number: int
+    created_at: datetime
+    item_name: str
+    rarity: str
+    emoji: str
+    banner_name: str
+
+
+class Segment(NamedTuple):
+    path: str
+    first: int
+    last: int
+
+
+# ── Segment files ────────────────────────────────────────
+def _user_dir(user_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, str(user_id))
+
+
+def segments(user_id: int, upto: int) -> list[Segment]:
+    """The user's segments holding pulls up to `upto`, oldest first."""
+    try:
+        names = os.listdir(_user_dir(user_id))
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        if not name.endswith(SEGMENT_SUFFIX):
+            continue
+        first, last = (int(n) for n in name[:-len(SEGMENT_SUFFIX)].split("-"))
+        if last <= upto:
+            found.append(Segment(os.path.join(_user_dir(user_id), name), first, last))
+    return sorted(found, key=lambda s: s.first)
+
+
+def _write_segment(user_id: int, records: list[tuple[int, int, int, int]]) -> str:
+    directory = _user_dir(user_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{records[0][0]:010d}-{records[-1][0]:010d}{SEGMENT_SUFFIX}")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"".join(RECORD.pack(*r) for r in records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def _remove_orphans(user_id: int, upto: int) -> int:
+    """Delete segments (and temp files) past the committed archive point."""
+    removed = 0
+    try:
+        names = os.listdir(_user_dir(user_id))
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        orphan = name.endswith(".tmp") or (
+            name.endswith(SEGMENT_SUFFIX) and int(name[:-len(SEGMENT_SUFFIX)].split("-")[1]) > upto
+        )
+        if orphan:
+            os.remove(os.path.join(_user_dir(user_id), name))
+            removed += 1
+    return removed
+
+
+def _read(segment: Segment) -> tuple[mmap.mmap, int]:
+    with open(segment.path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, len(data) // RECORD.size
+
+
+class _PullNumbers:
+    """Sequence view of a segment's pull numbers, for bisect."""
+
+    def __init__(self, data: mmap.mmap, count: int):
+        self.data = data
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, n: int) -> int:
+        return RECORD.unpack_from(self.data, n * RECORD.size)[0]
+
+
+# ── Reading ──────────────────────────────────────────────
+def archived_upto(db: Session, user_id: int) -> int:
+    row = db.get(ArchivedPulls, user_id)
+    return row.last_pull_number if row else 0
+
+
+def iter_records(user_id: int, upto: int) -> Iterator[tuple[int, int, int, int]]:
+    """Raw (pull_number, banner_id, item_id, epoch) records, oldest first."""
+    for segment in segments(user_id, upto):
+        data, _ = _read(segment)
+        try:
+            yield from RECORD.iter_unpack(data)
+        finally:
+            data.close()
+
+
+def _to_row(record: tuple[int, int, int, int], catalog: Catalog) -> ArchivedRow:
+    pull_number, banner_id, item_id, epoch = record
+    item = catalog.item(item_id)
+    banner = catalog.banner(banner_id)
+    created_at = datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)  # naive UTC, like the pulls table
+    return ArchivedRow(pull_number, created_at, item.name, item.rarity, item.emoji, banner.name)
+
+
+def _matches(record: tuple, catalog: Catalog, banner_id: int | None, rarity: str | None) -> bool:
+    if banner_id is not None and record[1] != banner_id:
+        return False
+    return rarity is None or catalog.item(record[2]).rarity == rarity
+
+
+def archived_rows(
+    user_id: int, upto: int, banner_id: int | None = None, rarity: str | None = None
+) -> Iterator[ArchivedRow]:
+    """Archived history, oldest first, with the same filters as history_query."""
+    catalog = get_catalog()
+    for record in iter_records(user_id, upto):
+        if _matches(record, catalog, banner_id, rarity):
+            yield _to_row(record, catalog)
+
+
+def archived_page(
+    user_id: int,
+    upto: int,
+    limit: int,
+    before: int | None = None,
+    banner_id: int | None = None,
+    rarity: str | None = None,
+) -> list[ArchivedRow]:
+    """Newest first, like history_page; segments are bisected to the cursor."""
+    catalog = get_catalog()
+    rows = []
+    for segment in reversed(segments(user_id, upto)):
+        if before is not None and segment.first >= before:
+            continue
+        data, count = _read(segment)
+        try:
+            end = count if before is None else bisect.bisect_left(_PullNumbers(data, count), before)
+            for n in range(end - 1, -1, -1):
+                record = RECORD.unpack_from(data, n * RECORD.size)
+                if _matches(record, catalog, banner_id, rarity):
+                    rows.append(_to_row(record, catalog))
+                    if len(rows) == limit:
+                        return rows
+        finally:
+            data.close()
+    return rows
+
+
+def archived_pulls(db: Session, user_id: int | None = None) -> Iterator[tuple[int, int, int, str]]:
+    """
+    (user_id, banner_id, pull_number, rarity) for every archived pull, by
+    user then pull_number; for backfills that must see the whole history.
+    """
+    catalog = get_catalog()
+    query = select(ArchivedPulls.user_id, ArchivedPulls.last_pull_number).order_by(ArchivedPulls.user_id)
+    if user_id is not None:
+        query = query.where(ArchivedPulls.user_id == user_id)
+    for uid, upto in db.execute(query).all():
+        for pull_number, banner_id, item_id, _ in iter_records(uid, upto):
+            yield uid, banner_id, pull_number, catalog.item(item_id).rarity
+
+
+# ── Archiving ────────────────────────────────────────────
+def _epoch(created_at: datetime) -> int:
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return int(created_at.timestamp())
+
+
+def archive_user(db: Session, user_id: int, cutoff: datetime) -> int:
+    """Move one user's pulls older than `cutoff` into a new segment. Returns pulls moved."""
+    done = archived_upto(db, user_id)
+    _remove_orphans(user_id, done)
+
+    # Archive a prefix of the history: everything up to the newest old-enough pull
+    upto = db.scalar(
+        select(func.max(Pull.pull_number)).where(Pull.user_id == user_id, Pull.created_at < cutoff)
+    )
+    if upto is None or upto <= done:
+        return 0
+    rows = db.execute(
+        select(Pull.pull_number, Pull.banner_id, Pull.item_id, Pull.created_at)
+        .where(Pull.user_id == user_id, Pull.pull_number > done, Pull.pull_number <= upto)
+        .order_by(Pull.pull_number)
+    ).all()
+    _write_segment(user_id, [(n, b, i, _epoch(c)) for n, b, i, c in rows])
+
+    db.execute(delete(Pull).where(Pull.user_id == user_id, Pull.pull_number <= upto))
+    stmt = sqlite_insert(ArchivedPulls).values(user_id=user_id, last_pull_number=upto, pull_count=len(rows))
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ArchivedPulls.user_id],
+            set_={"last_pull_number": upto, "pull_count": ArchivedPulls.pull_count + len(rows)},
+        )
+    )
+    db.commit()
+    return len(rows)
+
+
+def archive(older_than: timedelta) -> tuple[int, int]:
+    """Archive every user's old pulls. Returns (users, pulls) archived."""
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - older_than
+    db = SessionLocal()
+    try:
+        user_ids = db.scalars(select(Pull.user_id).where(Pull.created_at < cutoff).distinct()).all()
+        users = pulls = 0
+        for user_id in user_ids:
+            moved = archive_user(db, user_id, cutoff)
+            if moved:
+                users += 1
+                pulls += moved
+        return users, pulls
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old pulls into compact segment files.")
+    parser.add_argument("--older-than-days", type=float, default=90)
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to shrink the database file")
+    args = parser.parse_args()
+
+    try:
+        require_schema()
+    except RuntimeError as exc:
+        raise SystemExit(str(exc))
+    users, pulls = archive(timedelta(days=args.older_than_days))
+    if args.vacuum:
+        with engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+    print(f"Archived {pulls} pulls for {users} users into {ARCHIVE_DIR}/.")
+
+
+if __name__ == "__main__":
+    main()
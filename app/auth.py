@@ -1,47 +1,211 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import User
+from app.database import get_read_session, run_sync
+from app.models import AuthInvalidation, User
 
 SECRET_KEY = "sakura-gacha-secret-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "300"))  # seconds
 
 security = HTTPBearer()
 
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated caller. Routes only need the id, so no ORM row is kept."""
+    id: int
+    username: str
 
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
+class PrincipalCache:
+    """
+    Bounded LRU of verified tokens -> Principal. An entry lives for at most
+    PRINCIPAL_CACHE_TTL seconds and never past the token's own expiry, so a
+    hot token skips both the signature check and the users lookup.
+    Revocations are keyed by token digest, the form they are shared in
+    between workers (see app.coherence).
+    """
 
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations_seen = 0  # highest auth_invalidations.id applied
+        # token -> (principal, expiry, digest)
+        self._entries: OrderedDict[str, tuple[Principal, float, str]] = OrderedDict()
+        self._revoked: dict[str, float] = {}  # token digest -> its expiry; pruned once expired
+        self._lock = threading.Lock()
 
+    def get(self, token: str) -> Principal | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token: str, principal: Principal, token_expires_at: float) -> None:
+        with self._lock:
+            self._entries[token] = (principal, min(time.time() + self.ttl, token_expires_at), token_digest(token))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def is_revoked(self, token: str) -> bool:
+        with self._lock:
+            return token_digest(token) in self._revoked
+
+    def revoke(self, digest: str, token_expires_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            for token in [t for t, (_, _, d) in self._entries.items() if d == digest]:
+                del self._entries[token]
+            self._revoked = {d: exp for d, exp in self._revoked.items() if exp > now}
+            self._revoked[digest] = token_expires_at
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in [t for t, (p, _, _) in self._entries.items() if p.id == user_id]:
+                del self._entries[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+
+# jose (and the cryptography backend it loads) is imported on first use
+# rather than with this module: it is a noticeable share of cold-start
+# import time, and most requests hit the principal cache without it.
+# Password hashing lives in app.passwords.
 def create_access_token(user_id: int) -> str:
+    from jose import jwt
+
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     payload = {"sub": str(user_id), "exp": expire}
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(
+def load_crypto() -> None:
+    """Import the JWT backend now, e.g. in the background once the server is up."""
+    from jose import jwt  # noqa: F401
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def revoke_token(db: Session, token: str) -> None:
+    """
+    Reject this token from now on, even though its signature is still valid.
+    Takes effect here immediately and in other workers within
+    CACHE_CHECK_INTERVAL, once the caller commits.
+    """
+    from jose import JWTError, jwt
+
+    try:
+        expires_at = float(jwt.get_unverified_claims(token)["exp"])
+    except (JWTError, KeyError, ValueError):
+        return
+    digest = token_digest(token)
+    db.add(AuthInvalidation(token_digest=digest, expires_at=expires_at))
+    principal_cache.revoke(digest, expires_at)
+
+
+def invalidate_user(db: Session, user_id: int) -> None:
+    """
+    Drop cached principals for a user, e.g. after the user row is deleted or
+    renamed, in every worker once the caller commits.
+    """
+    db.add(AuthInvalidation(user_id=user_id, expires_at=time.time() + principal_cache.ttl))
+    principal_cache.invalidate_user(user_id)
+
+
+def sync_invalidations(db: Session) -> int:
+    """Apply revocations and user invalidations committed since the last call. Returns rows applied."""
+    rows = db.execute(
+        select(
+            AuthInvalidation.id, AuthInvalidation.token_digest, AuthInvalidation.user_id, AuthInvalidation.expires_at
+        )
+        .where(AuthInvalidation.id > principal_cache.invalidations_seen, AuthInvalidation.expires_at > time.time())
+        .order_by(AuthInvalidation.id)
+    ).all()
+    for row_id, digest, user_id, expires_at in rows:
+        if digest is not None:
+            principal_cache.revoke(digest, expires_at)
+        if user_id is not None:
+            principal_cache.invalidate_user(user_id)
+        principal_cache.invalidations_seen = row_id
+    return len(rows)
+
+
+def prune_invalidations(db: Session) -> int:
+    """Delete rows that can no longer matter: their token, or every cache entry they target, has expired."""
+    return db.execute(delete(AuthInvalidation).where(AuthInvalidation.expires_at <= time.time())).rowcount
+
+
+def _lookup_principal(db: Session, user_id: int, digest: str) -> Principal | None:
+    user = db.get(User, user_id)
+    principal = Principal(id=user.id, username=user.username) if user else None
+    # Another worker may have revoked the token since this one last synced
+    if principal is not None and db.scalar(
+        select(AuthInvalidation.id).where(AuthInvalidation.token_digest == digest).limit(1)
+    ):
+        principal = None
+    # End the read so the connection goes back to the pool: pull routes may
+    # wait on a per-user lock before they touch the database again.
+    db.rollback()
+    return principal
+
+
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
-) -> User:
+    db: Session | AsyncSession = Depends(get_read_session),
+) -> Principal:
     token = credentials.credentials
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    if principal_cache.is_revoked(token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+    from jose import JWTError, jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = int(payload["sub"])
+        expires_at = float(payload["exp"])
     except (JWTError, KeyError, ValueError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
         )
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    principal = await run_sync(db, _lookup_principal, user_id, token_digest(token))
+    if principal is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found or token revoked")
+
+    principal_cache.put(token, principal, expires_at)
+    return principal
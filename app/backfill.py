@@ -0,0 +1,68 @@
+"""
+Rebuild derived pull state from the pulls table. Run with: python -m app.backfill
+
+Pass --check to only compare the stored counters against the pulls table
+and report mismatches (exits non-zero if any are found), or --rollups to
+rebuild the hourly banner analytics rollups.
+"""
+import sys
+from sqlalchemy import select
+from app.analytics import rebuild_rollups
+from app.concurrency import bump_pull_sequences
+from app.database import SessionLocal, require_schema
+from app.gacha import rebuild_pity_state
+from app.models import User
+from app.stats import COUNTER_COLUMNS, rebuild_pull_stats, reconcile_pull_stats
+
+
+def backfill():
+    db = SessionLocal()
+
+    pity_rows = rebuild_pity_state(db)
+    stats_rows = rebuild_pull_stats(db)
+    # /stats ETags must change for anyone whose counters were rewritten
+    bump_pull_sequences(db, db.scalars(select(User.id)))
+
+    db.commit()
+    db.close()
+    print(f"Rebuilt pity state for {pity_rows} and pull counters for {stats_rows} user/banner pairs!")
+
+
+def backfill_rollups():
+    db = SessionLocal()
+
+    rows = rebuild_rollups(db)
+
+    db.commit()
+    db.close()
+    print(f"Rebuilt {rows} hourly banner rollup rows!")
+
+
+def check() -> int:
+    db = SessionLocal()
+    mismatches = reconcile_pull_stats(db)
+    db.close()
+
+    for user_id, banner_id, expected, stored in mismatches:
+        diff = ", ".join(
+            f"{column} {have} != {want}"
+            for column, want, have in zip(COUNTER_COLUMNS, expected, stored)
+            if want != have
+        )
+        print(f"user {user_id} banner {banner_id}: {diff}")
+    print(f"{len(mismatches)} mismatched user/banner pairs.")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    # Like the server, refuse to run against a schema app.migrate hasn't brought up to date
+    try:
+        require_schema()
+    except RuntimeError as exc:
+        raise SystemExit(str(exc))
+    if "--check" in sys.argv[1:]:
+        sys.exit(check())
+    if "--rollups" in sys.argv[1:]:
+        backfill_rollups()
+    else:
+        backfill()
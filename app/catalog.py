@@ -0,0 +1,185 @@
+"""
+In-process cache of the banner/item catalog.
+
+The catalog only changes when it is reseeded or edited by an admin, so the
+pull path serves immutable snapshots from memory instead of querying
+`banners` and `items` on every request. Anything that changes the catalog
+must call `bump_catalog_version` in the same transaction and `invalidate`
+once it has committed; other worker processes notice the new version
+through app.coherence.
+"""
+import threading
+import json
+from dataclasses import dataclass, field
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from app.database import ReadSessionLocal
+from app.models import Banner, Item, CatalogVersion
+from app.sampler import AliasTable
+
+
+@dataclass(frozen=True)
+class ItemSnapshot:
+    id: int
+    name: str
+    rarity: str
+    drop_rate: float
+    emoji: str
+    banner_id: int
+    # This item as a PullResultResponse, pre-encoded, indexed by is_pity
+    pull_json: tuple[bytes, bytes] = field(default=(b"", b""), compare=False, repr=False)
+
+
+@dataclass(frozen=True)
+class BannerSnapshot:
+    id: int
+    name: str
+    description: str
+    is_active: bool
+    items: tuple[ItemSnapshot, ...]
+    by_rarity: dict[str, tuple[ItemSnapshot, ...]]
+    sampler: AliasTable | None
+    # Pity and guarantee pulls pick uniformly within the forced tier
+    rarity_samplers: dict[str, AliasTable]
+
+
+@dataclass(frozen=True)
+class Catalog:
+    version: int
+    banners: dict[int, BannerSnapshot]
+    items: dict[int, ItemSnapshot]
+
+    def active_banners(self) -> list[BannerSnapshot]:
+        return [b for b in self.banners.values() if b.is_active]
+
+    # Stored pulls can name items or banners newer than this snapshot: another
+    # worker may already serve a catalog change this one hasn't noticed yet.
+    def item(self, item_id: int) -> ItemSnapshot:
+        """items[item_id], reloading the catalog once if this snapshot predates the item."""
+        item = self.items.get(item_id)
+        return item if item is not None else _newer_than(self).items[item_id]
+
+    def banner(self, banner_id: int) -> BannerSnapshot:
+        """banners[banner_id], reloading the catalog once if this snapshot predates the banner."""
+        banner = self.banners.get(banner_id)
+        return banner if banner is not None else _newer_than(self).banners[banner_id]
+
+
+_catalog: Catalog | None = None
+_lock = threading.Lock()
+
+
+def encode_json(content) -> bytes:
+    """Encode exactly like FastAPI's default JSONResponse."""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _pull_json(item: Item) -> tuple[bytes, bytes]:
+    return tuple(
+        encode_json({"item_name": item.name, "rarity": item.rarity, "emoji": item.emoji, "is_pity": is_pity})
+        for is_pity in (False, True)
+    )
+
+
+def _snapshot_banner(banner: Banner, items: list[ItemSnapshot]) -> BannerSnapshot:
+    by_rarity: dict[str, list[ItemSnapshot]] = {}
+    for item in items:
+        by_rarity.setdefault(item.rarity, []).append(item)
+    return BannerSnapshot(
+        id=banner.id,
+        name=banner.name,
+        description=banner.description,
+        is_active=bool(banner.is_active),
+        items=tuple(items),
+        by_rarity={rarity: tuple(pool) for rarity, pool in by_rarity.items()},
+        sampler=AliasTable([i.drop_rate for i in items]) if items else None,
+        rarity_samplers={rarity: AliasTable([1.0] * len(pool)) for rarity, pool in by_rarity.items()},
+    )
+
+
+def load_catalog(db: Session) -> Catalog:
+    """Read the whole catalog in three queries."""
+    row = db.get(CatalogVersion, 1)
+    items: dict[int, ItemSnapshot] = {}
+    per_banner: dict[int, list[ItemSnapshot]] = {}
+    for i in db.query(Item).order_by(Item.id):
+        item = ItemSnapshot(
+            id=i.id, name=i.name, rarity=i.rarity, drop_rate=i.drop_rate, emoji=i.emoji, banner_id=i.banner_id,
+            pull_json=_pull_json(i),
+        )
+        items[item.id] = item
+        # Retired items stay resolvable for history and inventory, but leave the pool
+        if i.is_active is not False:
+            per_banner.setdefault(item.banner_id, []).append(item)
+
+    banners = {
+        b.id: _snapshot_banner(b, per_banner.get(b.id, []))
+        for b in db.query(Banner).order_by(Banner.id)
+    }
+    return Catalog(version=row.version if row else 0, banners=banners, items=items)
+
+
+def get_catalog() -> Catalog:
+    """Return the cached catalog, loading it on first use."""
+    catalog = _catalog
+    if catalog is not None:
+        return catalog
+    return _reload()
+
+
+async def get_catalog_async() -> Catalog:
+    """get_catalog for async routes: a cold load runs on the threadpool, not the event loop."""
+    catalog = _catalog
+    if catalog is not None:
+        return catalog
+    return await run_in_threadpool(_reload)
+
+
+def _reload() -> Catalog:
+    global _catalog
+    with _lock:
+        if _catalog is None:
+            db = ReadSessionLocal()
+            try:
+                _catalog = load_catalog(db)
+            finally:
+                db.close()
+        return _catalog
+
+
+def _newer_than(catalog: Catalog) -> Catalog:
+    """A snapshot loaded after `catalog`, reloading only if `catalog` is still the cached one."""
+    global _catalog
+    with _lock:
+        if _catalog is catalog:
+            _catalog = None
+    return get_catalog()
+
+
+async def newer_than_async(catalog: Catalog) -> Catalog:
+    """_newer_than for async routes: the reload runs on the threadpool, not the event loop."""
+    return await run_in_threadpool(_newer_than, catalog)
+
+
+def cached_version() -> int | None:
+    """Version of this process's cached catalog, or None if nothing is loaded."""
+    catalog = _catalog
+    return catalog.version if catalog is not None else None
+
+
+def invalidate() -> None:
+    """Drop this process's cached catalog; the next request reloads it."""
+    global _catalog
+    with _lock:
+        _catalog = None
+
+
+def bump_catalog_version(db: Session) -> int:
+    """Record a catalog change. Call in the same transaction as the change."""
+    row = db.get(CatalogVersion, 1)
+    if row is None:
+        row = CatalogVersion(id=1, version=0)
+        db.add(row)
+    row.version += 1
+    db.flush()
+    return row.version
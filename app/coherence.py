@@ -0,0 +1,68 @@
+"""
+Cross-process cache coherence for multi-worker deployments.
+
+Each worker keeps its own catalog snapshot and principal cache. A
+background task checks the shared state at most once per
+CACHE_CHECK_INTERVAL seconds: one primary-key read of `catalog_version`
+and one indexed range read of `auth_invalidations`. A reseed elsewhere
+reloads the catalog here, and a revoked token or invalidated user is
+dropped from the principal cache. A change made in another worker is
+visible here within one interval, without any per-request cost.
+"""
+import asyncio
+import logging
+import os
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from app import idempotency
+from app.auth import prune_invalidations, sync_invalidations
+from app.catalog import cached_version, get_catalog, invalidate
+from app.database import ReadSessionLocal, SessionLocal
+from app.models import CatalogVersion
+
+CACHE_CHECK_INTERVAL = float(os.getenv("CACHE_CHECK_INTERVAL", "1"))  # seconds; 0 disables the check
+PRUNE_EVERY = 3600  # checks between deletes of expired auth_invalidations and idempotency_keys rows
+
+logger = logging.getLogger(__name__)
+
+
+def check(prune: bool = False) -> None:
+    """Bring this process's caches up to date with what other processes committed."""
+    # A read-only connection: this runs every interval and mustn't take a writer from the pulls
+    db = ReadSessionLocal()
+    try:
+        version = db.scalar(select(CatalogVersion.version).where(CatalogVersion.id == 1)) or 0
+        cached = cached_version()
+        if cached is not None and cached != version:
+            logger.info("Catalog changed (version %s -> %s); reloading", cached, version)
+            invalidate()
+            get_catalog()
+        sync_invalidations(db)
+    finally:
+        db.close()
+    if prune:
+        db = SessionLocal()
+        try:
+            prune_invalidations(db)
+            idempotency.prune(db)
+            db.commit()
+        finally:
+            db.close()
+
+
+async def watch() -> None:
+    """Run check() every CACHE_CHECK_INTERVAL seconds until cancelled."""
+    checks = 0
+    while True:
+        await asyncio.sleep(CACHE_CHECK_INTERVAL)
+        checks += 1
+        try:
+            await run_in_threadpool(check, checks % PRUNE_EVERY == 0)
+        except Exception:
+            logger.exception("Cache coherence check failed")
+
+
+def start() -> asyncio.Task | None:
+    if CACHE_CHECK_INTERVAL <= 0:
+        return None
+    return asyncio.create_task(watch(), name="cache-coherence")
@@ -0,0 +1,90 @@
+"""
+Per-user serialization for the pull path.
+
+Within a process, pulls are serialized per user with a fixed set of
+asyncio locks striped by user id: one user's double-tap or client retry
+waits for the first pull to commit, while different users (almost always
+on different stripes) pull in parallel.
+
+Across processes (several uvicorn workers on one database) the stripes
+don't help, so every pull batch also claims the user's `pull_sequence`
+with a compare-and-swap UPDATE in its own transaction. A batch that read
+stale pity state loses the race, rolls back and is retried from fresh
+state (see app.gacha).
+
+pull_sequence doubles as the user's data version: /inventory and /stats
+use it in their ETags, so anything else that changes a user's pulls,
+inventory or counters calls bump_pull_sequences in the same transaction.
+"""
+import asyncio
+import os
+import random
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from app import metrics
+from app.models import User
+
+PULL_LOCK_STRIPES = int(os.getenv("PULL_LOCK_STRIPES", "256"))
+PULL_RETRIES = 5  # attempts per pull batch before giving up with PullConflict
+BUMP_CHUNK = 500  # user ids per UPDATE ... WHERE id IN (...)
+RETRY_BACKOFF = 0.005  # seconds; doubled per attempt, with full jitter
+
+
+class PullConflict(Exception):
+    """Another pull for the same user committed first; retry from fresh state."""
+
+
+class StripedLocks:
+    """A fixed pool of asyncio locks; a key always maps to the same one."""
+
+    def __init__(self, stripes: int):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+
+    def for_key(self, key: int) -> asyncio.Lock:
+        return self._locks[key % len(self._locks)]
+
+
+user_locks = StripedLocks(PULL_LOCK_STRIPES)
+
+
+def user_lock(user_id: int) -> asyncio.Lock:
+    """`async with user_lock(user_id):` around everything that must see one user's pulls in order."""
+    return user_locks.for_key(user_id)
+
+
+def read_pull_sequence(db: Session, user_id: int) -> int:
+    return db.scalar(select(User.pull_sequence).where(User.id == user_id)) or 0
+
+
+def claim_pull_sequence(db: Session, user_id: int, seen: int) -> None:
+    """
+    Advance the user's pull_sequence if nobody else has since `seen` was
+    read. Run before writing a pull batch: the UPDATE also takes SQLite's
+    write lock, so nothing can change the user's state until commit.
+    """
+    claimed = db.execute(
+        update(User)
+        .where(User.id == user_id, User.pull_sequence == seen)
+        .values(pull_sequence=seen + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed != 1:
+        metrics.PULL_CONFLICTS.inc()
+        raise PullConflict(f"pull_sequence for user {user_id} moved past {seen}")
+
+
+def bump_pull_sequences(db: Session, user_ids) -> None:
+    """Advance pull_sequence for users whose pulls or counters changed outside claim_pull_sequence."""
+    ids = sorted(set(user_ids))
+    for start in range(0, len(ids), BUMP_CHUNK):
+        db.execute(
+            update(User)
+            .where(User.id.in_(ids[start:start + BUMP_CHUNK]))
+            .values(pull_sequence=User.pull_sequence + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def retry_delay(attempt: int) -> float:
+    """Seconds to wait before retrying a lost race, so two workers don't collide again in lockstep."""
+    return random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
@@ -1,19 +1,184 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+import os
+from urllib.parse import quote
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+from app.metrics import instrument_engine
 
-DATABASE_URL = "sqlite:///sakura_gacha.db"
+try:
+    import fcntl
+except ImportError:  # no advisory locks (Windows): start workers one at a time
+    fcntl = None
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///sakura_gacha.db")
+# Writers (pulls, auth, background jobs) and GET routes use separate pools.
+# SQLite runs one write transaction at a time anyway, so a small writer pool
+# makes pulls queue for a connection instead of spinning on busy_timeout,
+# and a burst of pulls can't take the connections that reads need.
+WRITE_POOL_SIZE = int(os.getenv("WRITE_POOL_SIZE", "4"))
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "8"))
+
+# "sync": routes run database work on the threadpool with a sync Session.
+# "async": routes use an AsyncSession on the event loop (aiosqlite).
+DB_MODE = os.getenv("DB_MODE", "sync")
+if DB_MODE not in ("sync", "async"):
+    raise RuntimeError(f"DB_MODE must be 'sync' or 'async', not {DB_MODE!r}")
+
+# Applied to every new connection. WAL lets readers run alongside the writer,
+# and synchronous=NORMAL only fsyncs at checkpoints (still safe in WAL mode).
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # 64 MiB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+# Read-only connections can't switch the journal mode; the writers already have
+READ_PRAGMAS = tuple(p for p in SQLITE_PRAGMAS if "journal_mode" not in p)
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _apply_read_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in READ_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def read_only_url(url: str) -> URL | None:
+    """The same SQLite file opened with mode=ro, or None for in-memory and non-file databases."""
+    parsed = make_url(url)
+    database = parsed.database
+    if parsed.get_backend_name() != "sqlite" or not database or database == ":memory:" or database.startswith("file:"):
+        return None
+    return parsed.set(database=f"file:{quote(database)}", query={**parsed.query, "mode": "ro", "uri": "true"})
+
+
+engine = create_engine(
+    DATABASE_URL, connect_args={"check_same_thread": False}, pool_size=WRITE_POOL_SIZE, max_overflow=0,
+)
+event.listen(engine, "connect", _apply_pragmas)
+instrument_engine(engine)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# GET routes read through mode=ro connections: under WAL each read sees the
+# last committed snapshot and never waits on (or blocks) the pull writer.
+read_engine = engine
+if (_read_url := read_only_url(DATABASE_URL)) is not None:
+    read_engine = create_engine(_read_url, connect_args={"check_same_thread": False}, pool_size=READ_POOL_SIZE)
+    event.listen(read_engine, "connect", _apply_read_pragmas)
+    instrument_engine(read_engine)
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False)
+
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if DB_MODE == "async":
+    async_engine = create_async_engine(
+        DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1), pool_size=WRITE_POOL_SIZE, max_overflow=0,
+    )
+    event.listen(async_engine.sync_engine, "connect", _apply_pragmas)
+    instrument_engine(async_engine.sync_engine)
+    # Nothing may lazy-load on the event loop, so keep attributes after commit
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    async_read_engine = async_engine
+    if _read_url is not None:
+        async_read_engine = create_async_engine(_read_url.set(drivername="sqlite+aiosqlite"), pool_size=READ_POOL_SIZE)
+        event.listen(async_read_engine.sync_engine, "connect", _apply_read_pragmas)
+        instrument_engine(async_read_engine.sync_engine)
+    AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
+
 
 class Base(DeclarativeBase):
     pass
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def create_schema() -> None:
+    """
+    create_all, serialized across processes: uvicorn workers starting
+    together would otherwise race to create the same tables.
+    """
+    database = engine.url.database
+    if fcntl is None or not database or database == ":memory:":
+        Base.metadata.create_all(bind=engine)
+        return
+    with open(f"{database}.schema-lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            Base.metadata.create_all(bind=engine)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+SCHEMA_HINT = "The database schema is missing or out of date; run python -m app.migrate"
+
+
+def missing_schema() -> list[str]:
+    """Tables ("table") and columns ("table.column") the models define but the database lacks."""
+    missing = []
+    with engine.connect() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {row[1] for row in conn.execute(text(f'PRAGMA table_info("{table.name}")'))}
+            if not existing:
+                missing.append(table.name)
+                continue
+            missing += [f"{table.name}.{c.name}" for c in table.columns if c.name not in existing]
+    return missing
+
+
+def require_schema() -> None:
+    """
+    Raise RuntimeError with SCHEMA_HINT unless the database has every table
+    and column. The server and the CLIs check rather than create: schema
+    changes belong to `python -m app.migrate`.
+    """
+    missing = missing_schema()
+    if missing:
+        raise RuntimeError(f"{SCHEMA_HINT} (missing {', '.join(missing)})")
+
+
+async def get_session():
+    """Request-scoped session for the configured DB_MODE."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+
+async def get_read_session():
+    """Like get_session, but read-only: for GET routes and other lookups that never write."""
+    if AsyncReadSessionLocal is not None:
+        async with AsyncReadSessionLocal() as db:
+            yield db
+    else:
+        db = ReadSessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+
+async def run_sync(db: Session | AsyncSession, fn, *args, **kwargs):
+    """
+    Call fn(session, *args, **kwargs) without blocking the event loop.
+    Sync sessions run on the threadpool; async sessions hand fn their
+    underlying sync session, with I/O going through the async driver.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
@@ -1,157 +1,363 @@
-import random
+import asyncio
+from collections import Counter
+from itertools import chain
+from datetime import datetime, timezone
+from typing import NamedTuple
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.models import Item, Pull, Inventory
+from app import idempotency, metrics
+from app.analytics import record_rollups
+from app.archive import archived_pulls
+from app.catalog import BannerSnapshot, ItemSnapshot
+from app.concurrency import PULL_RETRIES, PullConflict, claim_pull_sequence, read_pull_sequence, retry_delay
+from app.database import run_sync
+from app.models import Item, Pull, Inventory, PityState
+from app.stats import rebuild_pull_stats, record_pulls
 
 EPIC_PITY_THRESHOLD = 50
 LEGENDARY_PITY_THRESHOLD = 90
+RARE_PLUS = ("Rare", "Epic", "Legendary")
+UPSERT_CHUNK = 500  # rows per multi-row upsert, well under SQLite's bound-parameter limit
 
+# The app.journal.PullJournal that pulls go through while write-behind mode is on
+_write_behind = None
 
-def _get_pity_counters(db: Session, user_id: int, banner_id: int) -> tuple[int, int]:
-    """Count pulls since last Epic and last Legendary for this user+banner."""
-    pulls = (
-        db.query(Pull)
-        .filter(Pull.user_id == user_id, Pull.banner_id == banner_id)
-        .order_by(Pull.pull_number.desc())
-        .all()
+
+def use_write_behind(journal) -> None:
+    """Send pulls through `journal` from now on, or straight to the database again with None."""
+    global _write_behind
+    _write_behind = journal
+
+
+def advance_pity(state: PityState, rarity: str, pull_number: int) -> None:
+    """Move a user+banner pity state forward by one pull of the given rarity."""
+    if rarity == "Legendary":
+        state.since_epic = 0
+        state.since_legendary = 0
+    elif rarity == "Epic":
+        state.since_epic = 0
+        state.since_legendary += 1
+    else:
+        state.since_epic += 1
+        state.since_legendary += 1
+    state.last_pull_number = pull_number
+
+
+def rebuild_pity_state(db: Session, user_id: int | None = None) -> int:
+    """
+    Recompute pity_state from the full history (archived pulls, then the
+    pulls table), for one user or everyone.
+    Returns the number of user+banner rows written.
+    """
+    history = (
+        db.query(Pull.user_id, Pull.banner_id, Pull.pull_number, Item.rarity)
+        .join(Item, Item.id == Pull.item_id)
+        .order_by(Pull.user_id, Pull.pull_number)
     )
+    stale = db.query(PityState)
+    if user_id is not None:
+        history = history.filter(Pull.user_id == user_id)
+        stale = stale.filter(PityState.user_id == user_id)
+    stale.delete(synchronize_session=False)
+
+    # Archived pulls are all older than the ones left in the table
+    states: dict[tuple[int, int], PityState] = {}
+    for uid, bid, pull_number, rarity in chain(archived_pulls(db, user_id), history.yield_per(5000)):
+        state = states.get((uid, bid))
+        if state is None:
+            state = PityState(
+                user_id=uid, banner_id=bid, since_epic=0, since_legendary=0, last_pull_number=0
+            )
+            states[(uid, bid)] = state
+        advance_pity(state, rarity, pull_number)
+
+    db.add_all(states.values())
+    db.flush()
+    return len(states)
+
+
+def load_user_pity(db: Session, user_id: int) -> list[PityState]:
+    """All of this user's pity rows, in one query."""
+    states = db.query(PityState).filter(PityState.user_id == user_id).all()
 
-    since_epic = 0
-    since_legendary = 0
-    found_epic = False
-    found_legendary = False
-
-    for p in pulls:
-        item = db.query(Item).filter(Item.id == p.item_id).first()
-        if not found_epic:
-            if item.rarity == "Epic" or item.rarity == "Legendary":
-                found_epic = True
-            else:
-                since_epic += 1
-        if not found_legendary:
-            if item.rarity == "Legendary":
-                found_legendary = True
-            else:
-                since_legendary += 1
-        if found_epic and found_legendary:
-            break
-
-    return since_epic, since_legendary
-
-
-def _pick_item(items: list[Item], force_rarity: str | None = None) -> Item:
-    """Weighted random pick from item pool, optionally forcing a rarity tier."""
+    # A user with no pity rows at all predates the pity_state table (or has
+    # never pulled); rebuild from history once so their pity and counters carry over.
+    if not states and rebuild_pity_state(db, user_id):
+        rebuild_pull_stats(db, user_id)
+        states = db.query(PityState).filter(PityState.user_id == user_id).all()
+    return states
+
+
+def _load_pity(db: Session, user_id: int, banner_id: int) -> tuple[PityState, int]:
+    """
+    Returns (state for this banner, user's last pull_number); the state is
+    created on first use.
+    """
+    states = load_user_pity(db, user_id)
+    last_pull_number = max((s.last_pull_number for s in states), default=0)
+    state = next((s for s in states if s.banner_id == banner_id), None)
+    if state is None:
+        state = PityState(
+            user_id=user_id, banner_id=banner_id, since_epic=0, since_legendary=0, last_pull_number=0
+        )
+        db.add(state)
+    return state, last_pull_number
+
+
+def get_pity_state(db: Session, user_id: int, banner_id: int | None = None) -> PityState | None:
+    """Pity state for a banner, or for the banner the user pulled most recently."""
+    query = db.query(PityState).filter(PityState.user_id == user_id)
+    if banner_id is not None:
+        query = query.filter(PityState.banner_id == banner_id)
+    return query.order_by(PityState.last_pull_number.desc()).first()
+
+
+def get_total_pulls(db: Session, user_id: int) -> int:
+    """Pull numbers are per user across all banners, so the highest one is the total."""
+    if _write_behind is not None:
+        return _write_behind.load_user(db, user_id).last_pull_number
+    last = (
+        db.query(func.max(PityState.last_pull_number))
+        .filter(PityState.user_id == user_id)
+        .scalar()
+    )
+    return last or 0
+
+
+def _pick_item(banner: BannerSnapshot, force_rarity: str | None = None) -> ItemSnapshot:
+    """Weighted random pick from the banner's pool, optionally forcing a rarity tier."""
     if force_rarity:
-        pool = [i for i in items if i.rarity == force_rarity]
+        pool = banner.by_rarity.get(force_rarity)
         if pool:
-            return random.choice(pool)
+            return pool[banner.rarity_samplers[force_rarity].draw()]
+
+    return banner.items[banner.sampler.draw()]
+
 
-    weights = [i.drop_rate for i in items]
-    return random.choices(items, weights=weights, k=1)[0]
+def forced_rarity(state: PityState) -> str | None:
+    """The rarity pity forces on a user+banner's next pull, if any."""
+    if state.since_legendary >= LEGENDARY_PITY_THRESHOLD - 1:
+        return "Legendary"
+    if state.since_epic >= EPIC_PITY_THRESHOLD - 1:
+        return "Epic"
+    return None
+
+
+class PullResult(NamedTuple):
+    item: ItemSnapshot
+    is_pity: bool  # forced by pity or by the 10-pull guarantee, as reported to clients
+    guaranteed: bool = False  # forced by the 10-pull guarantee
+
+
+def resolve_pulls(
+    state: PityState, banner: BannerSnapshot, count: int, first_pull_number: int
+) -> list[PullResult]:
+    """Decide `count` pulls in memory, advancing the pity state as we go."""
+    # Natural draws are independent of pity, so take them all in one call
+    natural = banner.sampler.sample(count)
+    results = []
+    for n in range(count):
+        forced = forced_rarity(state)
+        if forced:
+            item = _pick_item(banner, force_rarity=forced)
+        else:
+            item = banner.items[natural[n]]
+        is_pity = forced is not None
+        guaranteed = False
+
+        # 10-pull guarantee, for each complete block of 10: if no Rare or above,
+        # replace the block's last Common with a Rare
+        if n % 10 == 9:
+            if not any(r.item.rarity in RARE_PLUS for r in results[n - 9:]) and item.rarity not in RARE_PLUS:
+                item = _pick_item(banner, force_rarity="Rare")
+                is_pity = guaranteed = True
+
+        advance_pity(state, item.rarity, first_pull_number + n)
+        results.append(PullResult(item, is_pity, guaranteed))
+    return results
 
 
-def do_pull(
-    db: Session, user_id: int, banner_id: int, items: list[Item]
-) -> tuple[Item, bool]:
+def count_pulls(banner_id: int, results: list[PullResult]) -> None:
     """
-    Execute a single gacha pull with pity system.
-    Returns (item, was_pity).
+    Add a batch to the pull metrics. Call only once it is committed (or
+    journalled), so batches that roll back or are retried aren't counted.
     """
-    since_epic, since_legendary = _get_pity_counters(db, user_id, banner_id)
+    for item, is_pity, guaranteed in results:
+        metrics.PULLS.inc(banner_id, item.rarity)
+        # A guarantee upgrade is never also forced by pity: pity already gives Epic or better
+        if guaranteed:
+            metrics.GUARANTEE_FIXUPS.inc(banner_id)
+        elif is_pity:
+            metrics.PITY_TRIGGERS.inc(banner_id, item.rarity)
 
-    is_pity = False
-    forced_rarity = None
 
-    if since_legendary >= LEGENDARY_PITY_THRESHOLD - 1:
-        forced_rarity = "Legendary"
-        is_pity = True
-    elif since_epic >= EPIC_PITY_THRESHOLD - 1:
-        forced_rarity = "Epic"
-        is_pity = True
+class PullRow(NamedTuple):
+    """One resolved pull, as persisted by write_pulls."""
+    user_id: int
+    banner_id: int
+    pull_number: int
+    item_id: int
+    rarity: str
+    created_at: datetime
+    pity: bool = False  # forced by soft or hard pity
+    guaranteed: bool = False  # forced by the 10-pull guarantee
 
-    item = _pick_item(items, force_rarity=forced_rarity)
 
-    # Determine pull number
-    last_pull = (
-        db.query(Pull)
-        .filter(Pull.user_id == user_id)
-        .order_by(Pull.pull_number.desc())
-        .first()
-    )
-    pull_number = (last_pull.pull_number + 1) if last_pull else 1
-
-    # Record pull
-    pull = Pull(
-        user_id=user_id,
-        banner_id=banner_id,
-        item_id=item.id,
-        pull_number=pull_number,
+def write_pulls(db: Session, rows: list[PullRow]) -> None:
+    """
+    Persist resolved pulls for any number of users and banners: one bulk
+    insert into pulls, plus inventory, counter and hourly rollup deltas
+    aggregated per key. Pity state is not touched here.
+    """
+    db.execute(
+        insert(Pull),
+        [
+            {
+                "user_id": r.user_id,
+                "banner_id": r.banner_id,
+                "item_id": r.item_id,
+                "pull_number": r.pull_number,
+                "created_at": r.created_at,
+            }
+            for r in rows
+        ],
     )
-    db.add(pull)
 
-    # Update inventory
-    inv = (
-        db.query(Inventory)
-        .filter(Inventory.user_id == user_id, Inventory.item_id == item.id)
-        .first()
-    )
-    if inv:
-        inv.quantity += 1
-    else:
-        db.add(Inventory(user_id=user_id, item_id=item.id, quantity=1))
+    deltas = list(Counter((r.user_id, r.item_id) for r in rows).items())
+    for start in range(0, len(deltas), UPSERT_CHUNK):
+        upsert = sqlite_insert(Inventory).values(
+            [
+                {"user_id": user_id, "item_id": item_id, "quantity": n}
+                for (user_id, item_id), n in deltas[start:start + UPSERT_CHUNK]
+            ]
+        )
+        db.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[Inventory.user_id, Inventory.item_id],
+                set_={"quantity": Inventory.quantity + upsert.excluded.quantity},
+            )
+        )
 
-    db.flush()
-    return item, is_pity
+    rarities: dict[tuple[int, int], list[str]] = {}
+    for r in rows:
+        rarities.setdefault((r.user_id, r.banner_id), []).append(r.rarity)
+    for (user_id, banner_id), batch in rarities.items():
+        record_pulls(db, user_id, banner_id, batch)
+
+    record_rollups(db, rows)
+
+
+def do_pull(db: Session, user_id: int, banner: BannerSnapshot) -> PullResult:
+    """
+    Execute a single gacha pull with pity system.
+    Returns (item, was_pity, guaranteed).
+    """
+    return do_multi_pull(db, user_id, banner, count=1)[0]
 
 
 def do_multi_pull(
-    db: Session, user_id: int, banner_id: int, items: list[Item], count: int = 10
-) -> list[tuple[Item, bool]]:
+    db: Session, user_id: int, banner: BannerSnapshot, count: int = 10
+) -> list[PullResult]:
     """
-    Execute multiple pulls. Guarantees at least one Rare+ in a 10-pull.
+    Execute multiple pulls. Guarantees at least one Rare+ in every complete
+    block of 10.
+    Pity and inventory are read once, every pull is resolved in memory, and
+    the results are written with one bulk insert.
+    Raises PullConflict if another worker pulled for this user since the
+    state was read; roll back and call again.
     """
-    results = []
-    for _ in range(count):
-        item, is_pity = do_pull(db, user_id, banner_id, items)
-        results.append((item, is_pity))
-
-    # 10-pull guarantee: if no Rare or above, replace last Common with a Rare
-    if count == 10:
-        rarities = [r[0].rarity for r in results]
-        has_rare_plus = any(r in ("Rare", "Epic", "Legendary") for r in rarities)
-        if not has_rare_plus:
-            rare_item = _pick_item(items, force_rarity="Rare")
-            last_item, _ = results[-1]
-
-            # Fix inventory: undo the common, add the rare
-            inv_old = (
-                db.query(Inventory)
-                .filter(Inventory.user_id == user_id, Inventory.item_id == last_item.id)
-                .first()
-            )
-            if inv_old:
-                inv_old.quantity = max(0, inv_old.quantity - 1)
+    if _write_behind is not None:
+        return _write_behind.pull(_write_behind.load_user(db, user_id), banner, count)[0]
 
-            inv_new = (
-                db.query(Inventory)
-                .filter(Inventory.user_id == user_id, Inventory.item_id == rare_item.id)
-                .first()
+    seen = read_pull_sequence(db, user_id)
+    state, last_pull_number = _load_pity(db, user_id, banner.id)
+    claim_pull_sequence(db, user_id, seen)
+    results = resolve_pulls(state, banner, count, last_pull_number + 1)
+    now = datetime.now(timezone.utc)
+    write_pulls(
+        db,
+        [
+            PullRow(
+                user_id, banner.id, last_pull_number + 1 + n, r.item.id, r.item.rarity, now,
+                pity=r.is_pity and not r.guaranteed, guaranteed=r.guaranteed,
             )
-            if inv_new:
-                inv_new.quantity += 1
-            else:
-                db.add(Inventory(user_id=user_id, item_id=rare_item.id, quantity=1))
-
-            # Fix pull record
-            last_pull = (
-                db.query(Pull)
-                .filter(Pull.user_id == user_id)
-                .order_by(Pull.pull_number.desc())
-                .first()
-            )
-            if last_pull:
-                last_pull.item_id = rare_item.id
+            for n, r in enumerate(results)
+        ],
+    )
+    db.flush()
+    return results
 
-            results[-1] = (rare_item, True)
-            db.flush()
 
-    return results
+PullBatch = tuple[list[PullResult], idempotency.StoredResponse | None]
+
+
+def _pull_and_commit(
+    db: Session, user_id: int, banner: BannerSnapshot, count: int, keyed: idempotency.Pending | None = None
+) -> PullBatch:
+    # One hop for the whole write transaction, so SQLite's write lock is never
+    # held while the request waits on the event loop.
+    stored = None
+    try:
+        results = do_multi_pull(db, user_id, banner, count)
+        if keyed is not None:
+            stored = keyed.response(results, get_total_pulls(db, user_id))
+            idempotency.record(db, user_id, keyed.key, stored)
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+    count_pulls(banner.id, results)
+    if stored is not None:
+        idempotency.response_cache.put(user_id, keyed.key, stored)
+    return results, stored
+
+
+async def _pull_async(
+    db: Session | AsyncSession, user_id: int, banner: BannerSnapshot, count: int,
+    keyed: idempotency.Pending | None = None,
+) -> PullBatch:
+    journal = _write_behind
+    if journal is not None:
+        user = journal.loaded(user_id)
+        if user is None:
+            user = await run_sync(db, journal.load_user, user_id)
+        # The journal does its own I/O (including fsync); keep it off the event loop
+        return await run_in_threadpool(journal.pull, user, banner, count, keyed)
+    for attempt in range(PULL_RETRIES):
+        try:
+            return await run_sync(db, _pull_and_commit, user_id, banner, count, keyed)
+        except PullConflict:
+            if attempt == PULL_RETRIES - 1:
+                raise
+            await asyncio.sleep(retry_delay(attempt))
+
+
+async def do_pull_async(db: Session | AsyncSession, user_id: int, banner: BannerSnapshot) -> PullResult:
+    """do_pull for async routes, committed; works with either session type."""
+    return (await do_multi_pull_async(db, user_id, banner, count=1))[0]
+
+
+async def do_multi_pull_async(
+    db: Session | AsyncSession, user_id: int, banner: BannerSnapshot, count: int = 10
+) -> list[PullResult]:
+    """
+    do_multi_pull for async routes, committed (or journalled in write-behind
+    mode); works with either session type. Callers hold
+    app.concurrency.user_lock for the user.
+    """
+    return (await _pull_async(db, user_id, banner, count))[0]
+
+
+async def do_idempotent_pull_async(
+    db: Session | AsyncSession, user_id: int, banner: BannerSnapshot, count: int, keyed: idempotency.Pending
+) -> idempotency.StoredResponse:
+    """
+    do_multi_pull_async that also stores the response under keyed.key,
+    atomically with the pulls: in their transaction, or in their journal
+    record in write-behind mode. Raises IntegrityError if another worker
+    stored the key first (the pulls are rolled back).
+    """
+    return (await _pull_async(db, user_id, banner, count, keyed))[1]
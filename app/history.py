@@ -0,0 +1,135 @@
+"""
+Pull history reads.
+
+Pages are keyed on pull_number (strictly increasing per user), so any page
+costs the same no matter how deep it is, and the item and banner fields
+come from the same joined query. The export streams rows from the cursor
+instead of materialising the whole history. Pulls moved to cold storage
+by app.archive are older than anything left in `pulls`, so pages continue
+into the archive once the table runs out and the export reads it first.
+"""
+import json
+from collections.abc import AsyncIterator, Iterator
+from itertools import islice
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.archive import archived_page, archived_rows, archived_upto
+from app.database import AsyncReadSessionLocal, ReadSessionLocal
+from app.models import ArchivedPulls, Banner, Item, Pull
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def history_query(user_id: int, banner_id: int | None = None, rarity: str | None = None) -> Select:
+    query = (
+        select(
+            Pull.pull_number,
+            Pull.created_at,
+            Item.name.label("item_name"),
+            Item.rarity,
+            Item.emoji,
+            Banner.name.label("banner_name"),
+        )
+        .join(Item, Item.id == Pull.item_id)
+        .join(Banner, Banner.id == Pull.banner_id)
+        .where(Pull.user_id == user_id)
+    )
+    if banner_id is not None:
+        query = query.where(Pull.banner_id == banner_id)
+    if rarity is not None:
+        query = query.where(Item.rarity == rarity)
+    return query
+
+
+def _recent_page(
+    db: Session, user_id: int, limit: int, before: int | None, banner_id: int | None, rarity: str | None
+) -> tuple[list, int]:
+    """The page's rows from `pulls`, and how far the archive goes if they fall short."""
+    query = history_query(user_id, banner_id, rarity)
+    if before is not None:
+        query = query.where(Pull.pull_number < before)
+    rows = db.execute(query.order_by(Pull.pull_number.desc()).limit(limit)).all()
+    return rows, archived_upto(db, user_id) if len(rows) < limit else 0
+
+
+def history_page(
+    db: Session,
+    user_id: int,
+    limit: int,
+    before: int | None = None,
+    banner_id: int | None = None,
+    rarity: str | None = None,
+) -> list:
+    """Newest first; pass the last pull_number of a page as `before` to get the next one."""
+    rows, upto = _recent_page(db, user_id, limit, before, banner_id, rarity)
+    if upto:
+        rows += archived_page(user_id, upto, limit - len(rows), before, banner_id, rarity)
+    return rows
+
+
+async def history_page_async(
+    db: AsyncSession,
+    user_id: int,
+    limit: int,
+    before: int | None = None,
+    banner_id: int | None = None,
+    rarity: str | None = None,
+) -> list:
+    """Async-mode history_page: the query goes through the AsyncSession, segment reads to the threadpool."""
+    rows, upto = await db.run_sync(_recent_page, user_id, limit, before, banner_id, rarity)
+    if upto:
+        rows += await run_in_threadpool(archived_page, user_id, upto, limit - len(rows), before, banner_id, rarity)
+    return rows
+
+
+def _ndjson_line(row) -> str:
+    return json.dumps(
+        {
+            "pull_number": row.pull_number,
+            "item_name": row.item_name,
+            "rarity": row.rarity,
+            "emoji": row.emoji,
+            "banner_name": row.banner_name,
+            "pulled_at": row.created_at.isoformat(),
+        },
+        ensure_ascii=False,
+    ) + "\n"
+
+
+def _export_query(user_id: int, banner_id: int | None, rarity: str | None) -> Select:
+    query = history_query(user_id, banner_id, rarity).order_by(Pull.pull_number)
+    return query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def export_ndjson(user_id: int, banner_id: int | None = None, rarity: str | None = None) -> Iterator[str]:
+    """
+    Yield the user's full history, oldest first, one JSON object per line.
+    Uses its own (read-only) session because the response outlives the request's.
+    """
+    db = ReadSessionLocal()
+    try:
+        for row in archived_rows(user_id, archived_upto(db, user_id), banner_id, rarity):
+            yield _ndjson_line(row)
+        for row in db.execute(_export_query(user_id, banner_id, rarity)):
+            yield _ndjson_line(row)
+    finally:
+        db.close()
+
+
+async def export_ndjson_async(
+    user_id: int, banner_id: int | None = None, rarity: str | None = None
+) -> AsyncIterator[str]:
+    """Async-mode export: same rows, streamed through an AsyncSession."""
+    async with AsyncReadSessionLocal() as db:
+        archived = await db.get(ArchivedPulls, user_id)
+        if archived is not None:
+            # Segment reads are file I/O; take them off the event loop in batches
+            rows = archived_rows(user_id, archived.last_pull_number, banner_id, rarity)
+            while batch := await run_in_threadpool(lambda: list(islice(rows, EXPORT_BATCH_SIZE))):
+                for row in batch:
+                    yield _ndjson_line(row)
+        result = await db.stream(_export_query(user_id, banner_id, rarity))
+        async for row in result:
+            yield _ndjson_line(row)
@@ -0,0 +1,151 @@
+"""
+Idempotency keys for the pull routes.
+
+A client that sends `Idempotency-Key` with a pull and retries after a
+timeout gets the original response back instead of a second pull. The
+response body is written to `idempotency_keys` in the same transaction as
+the pulls, so it exists exactly when the pulls do, and is kept for
+IDEMPOTENCY_TTL seconds. In write-behind mode it goes into the pulls'
+journal record instead and is applied with them; until then it is pinned
+in memory. A bounded in-process LRU sits in front; entries never change
+once written, so workers need no coherence for it.
+
+Duplicates in flight wait rather than pull in parallel: in-process they
+queue on the user's pull lock (app.concurrency) and find the stored
+result; in another worker the pull_sequence check makes the late one
+retry, and its write of the same key then fails the primary key, so it
+rolls back and replays the winner's response.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import NamedTuple
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from app.models import IdempotencyKey
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds a key's response is kept
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+MAX_KEY_LENGTH = 255
+
+
+class StoredResponse(NamedTuple):
+    request: str
+    body: bytes
+    expires_at: float
+
+
+class Pending(NamedTuple):
+    """A key to store with a pull batch, and how to build that batch's response."""
+    key: str
+    request: str
+    encode: Callable[[list, int], bytes]  # (pull results, user's total pulls after them) -> body
+
+    def response(self, results: list, total_pulls: int) -> StoredResponse:
+        return StoredResponse(self.request, self.encode(results, total_pulls), time.time() + IDEMPOTENCY_TTL)
+
+
+class KeyReused(Exception):
+    """The key was first used for a different request (another banner or pull count)."""
+
+
+class ResponseCache:
+    """
+    Bounded LRU of (user id, key) -> StoredResponse; expired entries are
+    dropped on read. Pinned entries are responses not yet in the database,
+    so they stay outside the LRU until unpinned.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[tuple[int, str], StoredResponse] = OrderedDict()
+        self._pinned: dict[tuple[int, str], StoredResponse] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, key: str) -> StoredResponse | None:
+        with self._lock:
+            entry = self._pinned.get((user_id, key))
+            if entry is not None:
+                return entry
+            entry = self._entries.get((user_id, key))
+            if entry is None or entry.expires_at <= time.time():
+                self._entries.pop((user_id, key), None)
+                return None
+            self._entries.move_to_end((user_id, key))
+            return entry
+
+    def put(self, user_id: int, key: str, entry: StoredResponse) -> None:
+        with self._lock:
+            self._entries[(user_id, key)] = entry
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pin(self, user_id: int, key: str, entry: StoredResponse) -> None:
+        with self._lock:
+            self._pinned[(user_id, key)] = entry
+
+    def unpin(self, user_id: int, key: str) -> None:
+        """The entry is in the database now; let the LRU drop it like any other."""
+        with self._lock:
+            entry = self._pinned.pop((user_id, key), None)
+        if entry is not None:
+            self.put(user_id, key, entry)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+
+
+response_cache = ResponseCache(IDEMPOTENCY_CACHE_SIZE)
+
+
+def lookup(db: Session, user_id: int, key: str, request: str) -> bytes | None:
+    """
+    The stored response for this key, or None if it hasn't been used (or
+    has expired). Raises KeyReused if it was used for another request.
+    """
+    entry = response_cache.get(user_id, key)
+    if entry is None:
+        row = db.execute(
+            select(IdempotencyKey.request, IdempotencyKey.response, IdempotencyKey.expires_at)
+            .where(
+                IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.expires_at > time.time()
+            )
+        ).first()
+        # End the read: the pull that may follow starts its own transaction
+        db.rollback()
+        if row is None:
+            return None
+        entry = StoredResponse(*row)
+        response_cache.put(user_id, key, entry)
+    if entry.request != request:
+        raise KeyReused(f"Idempotency-Key {key!r} was used for {entry.request}, not {request}")
+    return entry.body
+
+
+def record(db: Session, user_id: int, key: str, entry: StoredResponse) -> None:
+    """
+    Store the response in the caller's transaction (IntegrityError if the key
+    is already taken). Put it in the cache only after commit.
+    """
+    # An expired row still holds the primary key until it is pruned
+    db.execute(
+        delete(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.expires_at <= time.time()
+        )
+    )
+    db.add(
+        IdempotencyKey(
+            user_id=user_id, key=key, request=entry.request, response=entry.body, expires_at=entry.expires_at
+        )
+    )
+    db.flush()
+
+
+def prune(db: Session) -> int:
+    """Delete expired responses. Does not commit."""
+    return db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= time.time())).rowcount
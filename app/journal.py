@@ -0,0 +1,342 @@
+"""
+Write-behind pull journal (WRITE_BEHIND=1).
+
+Pulls are resolved against in-memory per-user pity state and appended to a
+local append-only journal; a request returns once its record is fsynced.
+A background thread then applies journalled records to `pulls`,
+`inventory`, `pity_state`, `user_banner_stats` and, for pulls made with an
+Idempotency-Key, `idempotency_keys` in large batches, one
+transaction per batch, and records the last applied sequence number in
+`journal_checkpoint` in that same transaction. On startup any records
+past the checkpoint are replayed, so nothing is lost or applied twice.
+
+The in-memory state is authoritative for every user it has seen, so this
+mode needs a single worker process; a second process starting on the same
+journal refuses to start. Reads (/stats, /history, /inventory)
+lag pulls by at most one flush interval. A user's state is dropped from
+memory once everything they pulled is applied and they have been idle for
+JOURNAL_EVICT_AFTER seconds; their next pull loads it from the tables again.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app import gacha, idempotency
+from app.catalog import BannerSnapshot
+from app.concurrency import bump_pull_sequences
+from app.database import SessionLocal, fcntl
+from app.models import JournalCheckpoint, PityState
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND") == "1"
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "sakura_gacha.journal")
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "0.05"))  # seconds
+JOURNAL_EVICT_AFTER = float(os.getenv("JOURNAL_EVICT_AFTER", "60"))  # idle seconds before a user's state is dropped
+JOURNAL_BATCH_SIZE = 5000  # records per database transaction
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UserState:
+    user_id: int
+    last_pull_number: int
+    pity: dict[int, PityState] = field(default_factory=dict)
+    pending: int = 0  # journalled records not yet applied
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class PullJournal:
+    def __init__(self, path: str, flush_interval: float, evict_after: float = JOURNAL_EVICT_AFTER):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.evict_after = evict_after
+        self._users: OrderedDict[int, UserState] = OrderedDict()  # least recently pulled first
+        self._pending: list[tuple[int, dict]] = []  # (end offset in file, record), in seq order
+        self._seq = 0
+        self._written = 0  # file offset after the last write
+        self._synced = 0  # file offset known to be on disk
+        self._lock = threading.Lock()  # state, seq, file writes, pending
+        self._sync_lock = threading.Lock()  # one fsync at a time; later writers piggyback
+        self._apply_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._file = None
+        self._owner = None  # holds the journal's exclusive lock
+        self._thread = None
+
+    # ── Lifecycle ───────────────────────────────────────
+    def start(self) -> None:
+        if fcntl is not None:
+            self._owner = open(self.path + ".lock", "a")
+            try:
+                fcntl.flock(self._owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._owner.close()
+                raise RuntimeError(
+                    f"{self.path} is in use by another process; WRITE_BEHIND=1 needs a single worker"
+                ) from None
+        applied = self._replay()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._written = self._synced = self._file.tell()
+        self._seq = applied
+        self._thread = threading.Thread(target=self._run, name="pull-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+        if self._owner is not None:
+            self._owner.close()
+
+    # ── Pulling ─────────────────────────────────────────
+    def pull(
+        self, user: UserState, banner: BannerSnapshot, count: int, keyed: idempotency.Pending | None = None
+    ) -> gacha.PullBatch:
+        """
+        Resolve and journal a pull for a user returned by load_user. With
+        `keyed`, the response goes into the same record, so it is durable
+        exactly when the pulls are; it is served from memory until applied.
+        """
+        user_id = user.user_id
+        with self._lock:
+            # If the user was evicted since load_user, `user` still matches the
+            # tables (eviction waits until everything is applied); put it back
+            user = self._users.setdefault(user_id, user)
+            self._users.move_to_end(user_id)
+            user.last_used = time.monotonic()
+            state = user.pity.get(banner.id)
+            if state is None:
+                state = user.pity[banner.id] = PityState(
+                    user_id=user_id, banner_id=banner.id, since_epic=0, since_legendary=0, last_pull_number=0
+                )
+            first = user.last_pull_number + 1
+            results = gacha.resolve_pulls(state, banner, count, first)
+            user.last_pull_number += count
+
+            self._seq += 1
+            record = {
+                "seq": self._seq,
+                "user_id": user_id,
+                "banner_id": banner.id,
+                "first": first,
+                # [item_id, rarity, pity, guaranteed]; older records only have the first two
+                "items": [[r.item.id, r.item.rarity, r.is_pity and not r.guaranteed, r.guaranteed] for r in results],
+                "pity": [state.since_epic, state.since_legendary],
+                "ts": time.time(),
+            }
+            stored = None
+            if keyed is not None:
+                stored = keyed.response(results, user.last_pull_number)
+                record["idempotency"] = [keyed.key, stored.request, stored.body.decode("utf-8"), stored.expires_at]
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self._written = self._file.tell()
+            self._pending.append((self._written, record))
+            user.pending += 1
+            if stored is not None:
+                # Until the apply, retries with this key are answered from memory. Pinned
+                # under the lock, so it can't be applied (and unpinned) before this.
+                idempotency.response_cache.pin(user_id, keyed.key, stored)
+            offset = self._written
+            backlog = len(self._pending)
+
+        self._sync(offset)
+        gacha.count_pulls(banner.id, results)
+        if backlog >= JOURNAL_BATCH_SIZE:
+            self._wake.set()
+        return results, stored
+
+    def loaded(self, user_id: int) -> UserState | None:
+        return self._users.get(user_id)
+
+    def load_user(self, db: Session, user_id: int) -> UserState:
+        """
+        The user's in-memory state, read from the tables if it isn't loaded,
+        using the caller's session (a second session per request could
+        exhaust the connection pool).
+        """
+        user = self._users.get(user_id)
+        if user is not None:
+            return user
+
+        # Every record for this user so far has been applied (replay runs
+        # before serving, and eviction waits for the user's records), so the
+        # tables are current. Callers hold the user's pull lock, so no pull
+        # for them is journalled while we read.
+        # Keep detached copies: the session's own instances expire on commit
+        states = [
+            PityState(
+                user_id=s.user_id,
+                banner_id=s.banner_id,
+                since_epic=s.since_epic,
+                since_legendary=s.since_legendary,
+                last_pull_number=s.last_pull_number,
+            )
+            for s in gacha.load_user_pity(db, user_id)
+        ]
+        db.commit()
+        loaded = UserState(
+            user_id=user_id,
+            last_pull_number=max((s.last_pull_number for s in states), default=0),
+            pity={s.banner_id: s for s in states},
+        )
+        with self._lock:
+            return self._users.setdefault(user_id, loaded)
+
+    def _sync(self, offset: int) -> None:
+        """Group commit: one fsync covers every record written before it started."""
+        with self._sync_lock:
+            if self._synced >= offset:
+                return
+            target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    # ── Background writer ───────────────────────────────
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Pull journal flush failed; will retry")
+                time.sleep(self.flush_interval)
+
+    def flush(self) -> int:
+        """Apply every durable pending record to the database. Returns records applied."""
+        with self._apply_lock:
+            with self._lock:
+                synced = self._synced
+                ready = [r for end, r in self._pending[:JOURNAL_BATCH_SIZE] if end <= synced]
+            if not ready:
+                return 0
+
+            _apply(ready)
+            with self._lock:
+                del self._pending[:len(ready)]
+                for record in ready:
+                    self._users[record["user_id"]].pending -= 1
+                    if "idempotency" in record:
+                        idempotency.response_cache.unpin(record["user_id"], record["idempotency"][0])
+                self._evict_idle()
+                # Everything written is applied: start the journal over
+                if not self._pending and self._synced == self._written:
+                    self._file.truncate(0)
+                    self._file.seek(0)
+                    self._written = self._synced = 0
+            return len(ready)
+
+    def _evict_idle(self) -> None:
+        """Drop users idle for evict_after seconds with nothing left to apply. Call with _lock held."""
+        cutoff = time.monotonic() - self.evict_after
+        while self._users:
+            user = next(iter(self._users.values()))
+            if user.last_used > cutoff or user.pending:
+                break  # everyone after it pulled more recently
+            del self._users[user.user_id]
+
+    def _replay(self) -> int:
+        """Apply records past the checkpoint, then empty the journal. Returns the last seq."""
+        db = SessionLocal()
+        try:
+            checkpoint = db.get(JournalCheckpoint, 1)
+            applied = checkpoint.seq if checkpoint else 0
+        finally:
+            db.close()
+
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn final write from a crash; it was never acknowledged
+                    if record["seq"] > applied:
+                        records.append(record)
+
+        for start in range(0, len(records), JOURNAL_BATCH_SIZE):
+            _apply(records[start:start + JOURNAL_BATCH_SIZE])
+        if records:
+            logger.info("Replayed %d pull journal records", len(records))
+            applied = records[-1]["seq"]
+        open(self.path, "w").close()
+        return applied
+
+
+def _apply(records: list[dict]) -> None:
+    """Write a batch of journal records and advance the checkpoint in one transaction."""
+    rows = []
+    pity: dict[tuple[int, int], dict] = {}
+    for record in records:
+        created_at = datetime.fromtimestamp(record["ts"], timezone.utc)
+        user_id, banner_id, first = record["user_id"], record["banner_id"], record["first"]
+        for n, (item_id, rarity, *flags) in enumerate(record["items"]):
+            rows.append(gacha.PullRow(user_id, banner_id, first + n, item_id, rarity, created_at, *flags))
+        # Records are in seq order, so the last one per user+banner holds the final state
+        pity[(user_id, banner_id)] = {
+            "user_id": user_id,
+            "banner_id": banner_id,
+            "since_epic": record["pity"][0],
+            "since_legendary": record["pity"][1],
+            "last_pull_number": first + len(record["items"]) - 1,
+        }
+
+    db = SessionLocal()
+    try:
+        gacha.write_pulls(db, rows)
+        for record in records:
+            if "idempotency" in record:
+                key, request, body, expires_at = record["idempotency"]
+                stored = idempotency.StoredResponse(request, body.encode("utf-8"), expires_at)
+                idempotency.record(db, record["user_id"], key, stored)
+        bump_pull_sequences(db, (r.user_id for r in rows))
+        pity_rows = list(pity.values())
+        for start in range(0, len(pity_rows), gacha.UPSERT_CHUNK):
+            upsert = sqlite_insert(PityState).values(pity_rows[start:start + gacha.UPSERT_CHUNK])
+            db.execute(
+                upsert.on_conflict_do_update(
+                    index_elements=[PityState.user_id, PityState.banner_id],
+                    set_={c: upsert.excluded[c] for c in ("since_epic", "since_legendary", "last_pull_number")},
+                )
+            )
+        checkpoint = sqlite_insert(JournalCheckpoint).values(id=1, seq=records[-1]["seq"])
+        db.execute(
+            checkpoint.on_conflict_do_update(
+                index_elements=[JournalCheckpoint.id], set_={"seq": checkpoint.excluded.seq}
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+_journal: PullJournal | None = None
+
+
+def start_write_behind() -> PullJournal:
+    global _journal
+    _journal = PullJournal(JOURNAL_PATH, JOURNAL_FLUSH_INTERVAL)
+    _journal.start()
+    gacha.use_write_behind(_journal)
+    return _journal
+
+
+def stop_write_behind() -> None:
+    global _journal
+    journal, _journal = _journal, None
+    if journal is not None:
+        gacha.use_write_behind(None)
+        journal.stop()
@@ -1,28 +1,112 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import asyncio
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import engine, get_db, Base
-from app.models import User, Banner, Item, Pull, Inventory
+from app.database import SCHEMA_HINT, get_read_session, get_session, require_schema, run_sync, DB_MODE
+from app.models import User, Inventory
 from app.schemas import (
     UserCreate, UserResponse, Token,
-    BannerResponse, BannerDetailResponse,
+    BannerResponse, BannerDetailResponse, BannerAnalyticsResponse,
     PullResultResponse, MultiPullResponse,
     InventoryItemResponse, PullHistoryResponse, StatsResponse,
 )
-from app.auth import hash_password, verify_password, create_access_token, get_current_user
-from app.gacha import do_pull, do_multi_pull
+from app import coherence, idempotency, metrics
+from app.analytics import banner_analytics
+from app.auth import Principal, principal_cache, create_access_token, get_current_user, load_crypto
+from app.catalog import BannerSnapshot, Catalog, encode_json, get_catalog_async, newer_than_async
+from app.concurrency import PullConflict, read_pull_sequence, user_lock
+from app.gacha import (
+    PullResult, do_idempotent_pull_async, do_pull_async, do_multi_pull_async, get_pity_state, get_total_pulls,
+)
+from app.journal import WRITE_BEHIND, start_write_behind, stop_write_behind
+from app.passwords import RETRY_AFTER, PasswordBusy, check_password_async, hash_password_async, password_pool
+from app.history import export_ndjson, export_ndjson_async, history_page, history_page_async
+from app.stats import get_counts
+
+MAX_HISTORY_PAGE = 1000
+MAX_BULK_PULLS = 1000
+
+# Every route is async; database work goes through run_sync, which uses the
+# threadpool or the async driver depending on DB_MODE. GET routes take a
+# read-only session (get_read_session), everything else the writer pool.
+DbSession = Session | AsyncSession
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema changes belong to `python -m app.migrate`, run before the server
+    # starts, so workers never do DDL (or race each other doing it) here.
+    try:
+        await run_in_threadpool(require_schema)
+        await get_catalog_async()
+        # Picks up revocations other workers recorded before this one started
+        await run_in_threadpool(coherence.check)
+    except OperationalError as exc:
+        raise RuntimeError(SCHEMA_HINT) from exc
+    watcher = coherence.start()
+    if WRITE_BEHIND:
+        # Replays anything left in the journal before the first request is served
+        await run_in_threadpool(start_write_behind)
+    # Serving starts now; the JWT backend and the password workers come up alongside the first requests
+    crypto = asyncio.gather(run_in_threadpool(load_crypto), run_in_threadpool(password_pool.start))
+    yield
+    await crypto
+    if watcher is not None:
+        watcher.cancel()
+    await run_in_threadpool(stop_write_behind)
+    await run_in_threadpool(password_pool.shutdown)
 
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Sakura Gacha API",
     description="A gacha/loot-box pull simulator with pity system, inventory tracking, and pull statistics.",
     version="1.0.0",
 )
+app.middleware("http")(metrics.metrics_middleware)
+
+
+@app.exception_handler(PullConflict)
+async def pull_conflict(request, exc: PullConflict):
+    # Only after PULL_RETRIES lost races against other workers for the same user
+    return Response(
+        content=encode_json({"detail": "Too many concurrent pulls for this account, try again"}),
+        status_code=status.HTTP_409_CONFLICT,
+        media_type="application/json",
+    )
+
+
+@app.exception_handler(idempotency.KeyReused)
+async def idempotency_key_reused(request, exc: idempotency.KeyReused):
+    return Response(
+        content=encode_json({"detail": "This Idempotency-Key was already used for a different pull"}),
+        status_code=422,
+        media_type="application/json",
+    )
+
+
+@app.exception_handler(PasswordBusy)
+async def password_busy(request, exc: PasswordBusy):
+    # Logins are shed rather than queued behind a burst, so they can't starve the pull routes
+    return Response(
+        content=encode_json({"detail": "Too many sign-ins right now, try again shortly"}),
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(RETRY_AFTER)},
+        media_type="application/json",
+    )
 
 
 # ── Root ─────────────────────────────────────────────────
 @app.get("/", tags=["Root"])
-def root():
+async def root():
     return {
         "name": "Sakura Gacha API",
         "version": "1.0.0",
@@ -31,143 +115,381 @@ def root():
             "register": "POST /auth/register",
             "login": "POST /auth/login",
             "banners": "GET /banners",
+            "banner_analytics": "GET /banners/{id}/analytics",
             "pull": "POST /banners/{id}/pull",
             "pull_ten": "POST /banners/{id}/pull/ten",
+            "pull_bulk": "POST /banners/{id}/pull/bulk?count=N",
             "inventory": "GET /inventory",
             "history": "GET /history",
+            "history_export": "GET /history/export",
             "stats": "GET /stats",
+            "metrics": "GET /metrics",
         },
     }
 
 
 # ── Auth ─────────────────────────────────────────────────
-@app.post("/auth/register", response_model=UserResponse, status_code=201, tags=["Auth"])
-def register(body: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == body.username).first():
-        raise HTTPException(status_code=400, detail="Username already taken")
-    user = User(username=body.username, hashed_password=hash_password(body.password))
+def _find_credentials(db: Session, username: str) -> tuple[int, str] | None:
+    """(user id, password hash) for a username."""
+    row = db.execute(select(User.id, User.hashed_password).where(User.username == username)).first()
+    # End the read so the connection goes back to the pool while the password
+    # is hashed; otherwise a login burst would hold every pooled connection.
+    db.rollback()
+    return (row.id, row.hashed_password) if row else None
+
+
+def _create_user(db: Session, username: str, hashed_password: str) -> User:
+    user = User(username=username, hashed_password=hashed_password)
     db.add(user)
     db.commit()
     db.refresh(user)
     return user
 
 
+def _replace_hash(db: Session, user_id: int, old_hash: str, new_hash: str) -> None:
+    # Only if the password hasn't changed since it was verified
+    db.execute(
+        update(User)
+        .where(User.id == user_id, User.hashed_password == old_hash)
+        .values(hashed_password=new_hash)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+@app.post("/auth/register", response_model=UserResponse, status_code=201, tags=["Auth"])
+async def register(body: UserCreate, db: DbSession = Depends(get_session)):
+    if await run_sync(db, _find_credentials, body.username):
+        raise HTTPException(status_code=400, detail="Username already taken")
+    hashed = await hash_password_async(body.password)
+    return await run_sync(db, _create_user, body.username, hashed)
+
+
 @app.post("/auth/login", response_model=Token, tags=["Auth"])
-def login(body: UserCreate, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == body.username).first()
-    if not user or not verify_password(body.password, user.hashed_password):
+async def login(body: UserCreate, db: DbSession = Depends(get_session)):
+    credentials = await run_sync(db, _find_credentials, body.username)
+    if not credentials:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return Token(access_token=create_access_token(user.id))
+    user_id, hashed = credentials
+    valid, new_hash = await check_password_async(body.password, hashed)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash is not None:
+        # Stored with a different BCRYPT_ROUNDS; upgrade it now that we have the password
+        await run_sync(db, _replace_hash, user_id, hashed, new_hash)
+    return Token(access_token=create_access_token(user_id))
+
+
+# ── Conditional GET ──────────────────────────────────────
+# Banner responses only change with the catalog version. Inventory and stats
+# only change when the user's pull_sequence moves (every pull batch bumps
+# it), so a poll with a matching If-None-Match costs one primary-key read.
+def _catalog_etag(catalog: Catalog) -> str:
+    return f'"c{catalog.version}"'
+
+
+def _user_etag(user_id: int, version: int, catalog: Catalog) -> str:
+    return f'"u{user_id}-{version}-c{catalog.version}"'
+
+
+def _not_modified(request: Request, response: Response, etag: str, cache_control: str) -> Response | None:
+    """Set the validators on `response`; return a 304 instead if the client already has this version."""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return None
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+async def _user_not_modified(request: Request, response: Response, db: DbSession, user_id: int) -> Response | None:
+    version = await run_sync(db, read_pull_sequence, user_id)
+    etag = _user_etag(user_id, version, await get_catalog_async())
+    return _not_modified(request, response, etag, "private, no-cache")
 
 
 # ── Banners ──────────────────────────────────────────────
 @app.get("/banners", response_model=list[BannerResponse], tags=["Banners"])
-def list_banners(db: Session = Depends(get_db)):
-    return db.query(Banner).filter(Banner.is_active == True).all()
+async def list_banners(request: Request, response: Response):
+    catalog = await get_catalog_async()
+    not_modified = _not_modified(request, response, _catalog_etag(catalog), "no-cache")
+    if not_modified:
+        return not_modified
+    return catalog.active_banners()
 
 
 @app.get("/banners/{banner_id}", response_model=BannerDetailResponse, tags=["Banners"])
-def get_banner(banner_id: int, db: Session = Depends(get_db)):
-    banner = db.query(Banner).filter(Banner.id == banner_id).first()
+async def get_banner(banner_id: int, request: Request, response: Response):
+    catalog = await get_catalog_async()
+    banner = catalog.banners.get(banner_id)
     if not banner:
         raise HTTPException(status_code=404, detail="Banner not found")
+    not_modified = _not_modified(request, response, _catalog_etag(catalog), "no-cache")
+    if not_modified:
+        return not_modified
     return banner
 
 
-# ── Pulling ──────────────────────────────────────────────
-@app.post("/banners/{banner_id}/pull", response_model=PullResultResponse, tags=["Gacha"])
-def pull_one(banner_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    banner = db.query(Banner).filter(Banner.id == banner_id, Banner.is_active == True).first()
+@app.get("/banners/{banner_id}/analytics", response_model=BannerAnalyticsResponse, tags=["Banners"])
+async def get_banner_analytics(
+    banner_id: int,
+    start: datetime | None = Query(None, alias="from", description="Defaults to 24 hours before `to`"),
+    end: datetime | None = Query(None, alias="to", description="Defaults to now"),
+    db: DbSession = Depends(get_read_session),
+):
+    banner = (await get_catalog_async()).banners.get(banner_id)
     if not banner:
+        raise HTTPException(status_code=404, detail="Banner not found")
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=24)
+    return await run_sync(db, banner_analytics, banner, start, end)
+
+
+# ── Pulling ──────────────────────────────────────────────
+async def _pullable_banner(banner_id: int) -> BannerSnapshot:
+    banner = (await get_catalog_async()).banners.get(banner_id)
+    if not banner or not banner.is_active:
         raise HTTPException(status_code=404, detail="Banner not found or inactive")
-    items = db.query(Item).filter(Item.banner_id == banner_id).all()
-    if not items:
+    if not banner.items:
         raise HTTPException(status_code=404, detail="No items in this banner")
+    return banner
 
-    item, is_pity = do_pull(db, user.id, banner_id, items)
-    db.commit()
-    return PullResultResponse(item_name=item.name, rarity=item.rarity, emoji=item.emoji, is_pity=is_pity)
+
+# Pull responses are put together from JSON fragments pre-encoded per item in
+# the catalog; only is_pity varies. response_model still documents the shape.
+def _json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+IdempotencyKeyHeader = Header(
+    None, alias="Idempotency-Key", min_length=1, max_length=idempotency.MAX_KEY_LENGTH,
+    description="Retries with the same key get the first response back instead of pulling again",
+)
+
+
+@app.post("/banners/{banner_id}/pull", response_model=PullResultResponse, tags=["Gacha"])
+async def pull_one(
+    banner_id: int,
+    db: DbSession = Depends(get_session),
+    user: Principal = Depends(get_current_user),
+    idempotency_key: str | None = IdempotencyKeyHeader,
+):
+    banner = await _pullable_banner(banner_id)
+    user_id = user.id
+    if idempotency_key is not None:
+        return await _idempotent_pull(db, user_id, banner, 1, idempotency_key, _pull_one_body)
+
+    async with user_lock(user_id):
+        item, is_pity, _ = await do_pull_async(db, user_id, banner)
+    return _json_response(item.pull_json[is_pity])
 
 
 @app.post("/banners/{banner_id}/pull/ten", response_model=MultiPullResponse, tags=["Gacha"])
-def pull_ten(banner_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    banner = db.query(Banner).filter(Banner.id == banner_id, Banner.is_active == True).first()
-    if not banner:
-        raise HTTPException(status_code=404, detail="Banner not found or inactive")
-    items = db.query(Item).filter(Item.banner_id == banner_id).all()
-    if not items:
-        raise HTTPException(status_code=404, detail="No items in this banner")
+async def pull_ten(
+    banner_id: int,
+    db: DbSession = Depends(get_session),
+    user: Principal = Depends(get_current_user),
+    idempotency_key: str | None = IdempotencyKeyHeader,
+):
+    banner = await _pullable_banner(banner_id)
+    user_id = user.id
+    if idempotency_key is not None:
+        return await _idempotent_pull(db, user_id, banner, 10, idempotency_key, _pull_ten_json)
 
-    results = do_multi_pull(db, user.id, banner_id, items)
-    db.commit()
+    # Held across both calls so total_pulls counts exactly up to these results
+    async with user_lock(user_id):
+        results = await do_multi_pull_async(db, user_id, banner)
+        total = await run_sync(db, get_total_pulls, user_id)
+    return _json_response(_pull_ten_json(results, total))
 
-    total = db.query(Pull).filter(Pull.user_id == user.id).count()
-    return MultiPullResponse(
-        results=[
-            PullResultResponse(item_name=i.name, rarity=i.rarity, emoji=i.emoji, is_pity=p)
-            for i, p in results
-        ],
-        total_pulls=total,
+
+def _pull_ten_json(results: list[PullResult], total: int) -> bytes:
+    return b'{"results":[' + b",".join(i.pull_json[p] for i, p, _ in results) + b'],"total_pulls":%d}' % total
+
+
+# ── Idempotent pulls ─────────────────────────────────────
+# With an Idempotency-Key the response body is built with the pulls and
+# stored atomically with them (app.idempotency), so a retry can be answered
+# with exactly what the first attempt returned.
+def _pull_one_body(results: list[PullResult], total: int) -> bytes:
+    item, is_pity, _ = results[0]
+    return item.pull_json[is_pity]
+
+
+def _replayed(body: bytes) -> Response:
+    metrics.IDEMPOTENT_REPLAYS.inc()
+    return Response(content=body, media_type="application/json", headers={"Idempotency-Replayed": "true"})
+
+
+async def _idempotent_pull(
+    db: DbSession, user_id: int, banner: BannerSnapshot, count: int, key: str, encode
+) -> Response:
+    """Pull and store the response under `key`, or replay the response already stored there."""
+    request = f"pull:{banner.id}:{count}"
+    # Under the user's lock, so a duplicate in flight waits and then finds the stored response
+    async with user_lock(user_id):
+        body = await run_sync(db, idempotency.lookup, user_id, key, request)
+        if body is not None:
+            return _replayed(body)
+        try:
+            stored = await do_idempotent_pull_async(
+                db, user_id, banner, count, idempotency.Pending(key, request, encode)
+            )
+        except IntegrityError:
+            # Another worker committed this key after our lookup; our pulls were rolled back
+            body = await run_sync(db, idempotency.lookup, user_id, key, request)
+            if body is None:
+                raise
+            return _replayed(body)
+    return _json_response(stored.body)
+
+
+def _owned_item_ids(db: Session, user_id: int) -> set[int]:
+    return set(db.scalars(select(Inventory.item_id).where(Inventory.user_id == user_id)))
+
+
+def _bulk_pull_lines(results: list[PullResult], first_pull_number: int, owned: set[int]) -> Iterator[bytes]:
+    """One NDJSON line per pull, then a summary line."""
+    for n, (item, is_pity, _) in enumerate(results):
+        yield b'{"pull_number":%d,' % (first_pull_number + n) + item.pull_json[is_pity][1:] + b"\n"
+
+    new_items = {r.item.id: r.item for r in results if r.item.id not in owned}
+    yield encode_json(
+        {
+            "summary": {
+                "count": len(results),
+                "total_pulls": first_pull_number + len(results) - 1,
+                "by_rarity": dict(Counter(r.item.rarity for r in results)),
+                "pity_pulls": sum(1 for r in results if r.is_pity),
+                "new_items": [
+                    {"item_name": i.name, "rarity": i.rarity, "emoji": i.emoji} for i in new_items.values()
+                ],
+            }
+        }
+    ) + b"\n"
+
+
+@app.post("/banners/{banner_id}/pull/bulk", tags=["Gacha"], response_class=StreamingResponse)
+async def pull_bulk(
+    banner_id: int,
+    count: int = Query(..., ge=1, le=MAX_BULK_PULLS),
+    db: DbSession = Depends(get_session),
+    user: Principal = Depends(get_current_user),
+):
+    """
+    Pull `count` times in one transaction (every complete block of 10 carries
+    the 10-pull guarantee). Streams one NDJSON line per pull, then a summary.
+    """
+    banner = await _pullable_banner(banner_id)
+    async with user_lock(user.id):
+        owned = await run_sync(db, _owned_item_ids, user.id)
+        results = await do_multi_pull_async(db, user.id, banner, count)
+        total = await run_sync(db, get_total_pulls, user.id)
+    return StreamingResponse(
+        _bulk_pull_lines(results, total - count + 1, owned),
+        media_type="application/x-ndjson",
     )
 
 
 # ── Inventory ────────────────────────────────────────────
+def _inventory(db: Session, user_id: int) -> list[tuple[int, int]]:
+    return db.execute(
+        select(Inventory.item_id, Inventory.quantity).where(Inventory.user_id == user_id).order_by(Inventory.id)
+    ).all()
+
+
 @app.get("/inventory", response_model=list[InventoryItemResponse], tags=["Collection"])
-def get_inventory(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    inv = db.query(Inventory).filter(Inventory.user_id == user.id).all()
-    return [
-        InventoryItemResponse(
-            item_name=entry.item.name,
-            rarity=entry.item.rarity,
-            emoji=entry.item.emoji,
-            quantity=entry.quantity,
+async def get_inventory(
+    request: Request,
+    response: Response,
+    db: DbSession = Depends(get_read_session),
+    user: Principal = Depends(get_current_user),
+):
+    not_modified = await _user_not_modified(request, response, db, user.id)
+    if not_modified:
+        return not_modified
+    rows = await run_sync(db, _inventory, user.id)
+    catalog = await get_catalog_async()
+    if any(item_id not in catalog.items for item_id, _ in rows):
+        # An item newer than this snapshot: reload before resolving, off the event loop
+        catalog = await newer_than_async(catalog)
+    inventory = []
+    for item_id, quantity in rows:
+        item = catalog.items[item_id]
+        inventory.append(
+            InventoryItemResponse(item_name=item.name, rarity=item.rarity, emoji=item.emoji, quantity=quantity)
         )
-        for entry in inv
-    ]
+    return inventory
 
 
 # ── Pull History ─────────────────────────────────────────
 @app.get("/history", response_model=list[PullHistoryResponse], tags=["Collection"])
-def get_history(
-    limit: int = 50,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+async def get_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_HISTORY_PAGE),
+    before: int | None = Query(None, description="Return pulls older than this pull_number"),
+    banner_id: int | None = None,
+    rarity: str | None = None,
+    db: DbSession = Depends(get_read_session),
+    user: Principal = Depends(get_current_user),
 ):
-    pulls = (
-        db.query(Pull)
-        .filter(Pull.user_id == user.id)
-        .order_by(Pull.created_at.desc())
-        .limit(limit)
-        .all()
-    )
+    if DB_MODE == "async":
+        rows = await history_page_async(db, user.id, limit, before=before, banner_id=banner_id, rarity=rarity)
+    else:
+        rows = await run_sync(db, history_page, user.id, limit, before=before, banner_id=banner_id, rarity=rarity)
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].pull_number)
     return [
         PullHistoryResponse(
-            item_name=p.item.name,
-            rarity=p.item.rarity,
-            emoji=p.item.emoji,
-            banner_name=p.banner.name,
-            pulled_at=p.created_at,
+            pull_number=row.pull_number,
+            item_name=row.item_name,
+            rarity=row.rarity,
+            emoji=row.emoji,
+            banner_name=row.banner_name,
+            pulled_at=row.created_at,
         )
-        for p in pulls
+        for row in rows
     ]
 
 
+@app.get("/history/export", tags=["Collection"], response_class=StreamingResponse)
+async def export_history(
+    banner_id: int | None = None,
+    rarity: str | None = None,
+    user: Principal = Depends(get_current_user),
+):
+    export = export_ndjson_async if DB_MODE == "async" else export_ndjson
+    return StreamingResponse(
+        export(user.id, banner_id=banner_id, rarity=rarity),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="pull-history.ndjson"'},
+    )
+
+
 # ── Stats ────────────────────────────────────────────────
 @app.get("/stats", response_model=StatsResponse, tags=["Collection"])
-def get_stats(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    pulls = db.query(Pull).filter(Pull.user_id == user.id).all()
-    total = len(pulls)
-
-    counts = {"Common": 0, "Rare": 0, "Epic": 0, "Legendary": 0}
-    for p in pulls:
-        counts[p.item.rarity] = counts.get(p.item.rarity, 0) + 1
+async def get_stats(
+    request: Request,
+    response: Response,
+    banner_id: int | None = None,
+    db: DbSession = Depends(get_read_session),
+    user: Principal = Depends(get_current_user),
+):
+    not_modified = await _user_not_modified(request, response, db, user.id)
+    if not_modified:
+        return not_modified
+    counts = await run_sync(db, get_counts, user.id, banner_id)
+    total = counts["total_pulls"]
 
     # Calculate luck rating
     if total == 0:
         luck = "No pulls yet"
     else:
-        legendary_rate = counts["Legendary"] / total
-        epic_rate = counts["Epic"] / total
+        legendary_rate = counts["legendary_count"] / total
+        epic_rate = counts["epic_count"] / total
         if legendary_rate > 0.04:
             luck = "Blessed by the Sakura Spirit"
         elif epic_rate > 0.12:
@@ -177,26 +499,32 @@ def get_stats(db: Session = Depends(get_db), user: User = Depends(get_current_us
         else:
             luck = "The blossoms will bloom soon..."
 
-    # Pity counters
-    since_epic = 0
-    since_legendary = 0
-    sorted_pulls = sorted(pulls, key=lambda p: p.pull_number, reverse=True)
-    for p in sorted_pulls:
-        if p.item.rarity in ("Epic", "Legendary"):
-            break
-        since_epic += 1
-    for p in sorted_pulls:
-        if p.item.rarity == "Legendary":
-            break
-        since_legendary += 1
+    # Pity counters for the requested banner, or the one pulled most recently
+    pity = await run_sync(db, get_pity_state, user.id, banner_id)
+    since_epic = pity.since_epic if pity else 0
+    since_legendary = pity.since_legendary if pity else 0
 
     return StatsResponse(
         total_pulls=total,
-        common_count=counts["Common"],
-        rare_count=counts["Rare"],
-        epic_count=counts["Epic"],
-        legendary_count=counts["Legendary"],
+        common_count=counts["common_count"],
+        rare_count=counts["rare_count"],
+        epic_count=counts["epic_count"],
+        legendary_count=counts["legendary_count"],
         luck_rating=luck,
         pity_counter_epic=since_epic,
         pity_counter_legendary=since_legendary,
     )
+
+
+# ── Metrics ──────────────────────────────────────────────
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    cache = principal_cache.stats()
+    return PlainTextResponse(
+        metrics.render({
+            "principal_cache_size": cache["size"],
+            "principal_cache_hits_total": cache["hits"],
+            "principal_cache_misses_total": cache["misses"],
+        }),
+        media_type="text/plain; version=0.0.4",
+    )
@@ -0,0 +1,205 @@
+"""
+Request, SQL and pull-engine metrics, served at /metrics in the Prometheus
+text format.
+
+A middleware opens a per-request record in a context variable; SQLAlchemy
+cursor events (which run in the same context, whether on the threadpool or
+through an AsyncSession) add each statement's count and duration to it.
+Set SLOW_REQUEST_MS to log the statements of any request slower than that.
+"""
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 disables the slow-request log
+SLOW_REQUEST_MAX_STATEMENTS = 50  # statements kept per request for the slow log
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+# ── Metric types ─────────────────────────────────────────
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        """Sum over every label set."""
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...], labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self._values: dict[tuple, list] = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[n] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    bucket_labels = _format_labels(self.labels, labels, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {series[-1]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route", LATENCY_BUCKETS, ("method", "route", "status")
+)
+REQUEST_STATEMENTS = Histogram(
+    "http_request_db_statements", "SQL statements executed per request", STATEMENT_BUCKETS, ("method", "route")
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent executing SQL per request", LATENCY_BUCKETS, ("method", "route")
+)
+DB_STATEMENTS = Counter("db_statements_total", "SQL statements executed, including background work")
+PULLS = Counter("gacha_pulls_total", "Pulls resolved", ("banner_id", "rarity"))
+PITY_TRIGGERS = Counter("gacha_pity_triggers_total", "Pulls forced by soft or hard pity", ("banner_id", "rarity"))
+GUARANTEE_FIXUPS = Counter(
+    "gacha_guarantee_fixups_total", "10-pulls whose last pull was upgraded to a Rare", ("banner_id",)
+)
+PULL_CONFLICTS = Counter(
+    "gacha_pull_conflicts_total", "Pull batches retried because another worker pulled for the same user first"
+)
+IDEMPOTENT_REPLAYS = Counter(
+    "gacha_idempotent_replays_total", "Pull requests answered with the stored response for their Idempotency-Key"
+)
+PASSWORD_SHED = Counter(
+    "auth_password_shed_total", "Registrations and logins refused with 503 because the password queue was full"
+)
+
+_metrics = [
+    REQUEST_LATENCY, REQUEST_STATEMENTS, REQUEST_DB_TIME, DB_STATEMENTS,
+    PULLS, PITY_TRIGGERS, GUARANTEE_FIXUPS, PULL_CONFLICTS, IDEMPOTENT_REPLAYS, PASSWORD_SHED,
+]
+
+
+# ── Per-request tracking ─────────────────────────────────
+@dataclass
+class _RequestStats:
+    statements: int = 0
+    db_time: float = 0.0
+    log: list[tuple[float, str]] = field(default_factory=list)  # (seconds, sql), only when the slow log is on
+
+
+_current: ContextVar[_RequestStats | None] = ContextVar("request_metrics", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    DB_STATEMENTS.inc()
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.db_time += elapsed
+    if SLOW_REQUEST_MS and len(stats.log) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.log.append((elapsed, statement))
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Count and time every statement run through this (sync) engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+async def metrics_middleware(request, call_next):
+    stats = _RequestStats()
+    token = _current.set(stats)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        _current.reset(token)
+        # Label by route template, not the raw path, to keep cardinality bounded
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        method = request.method
+        REQUEST_LATENCY.observe(elapsed, method, path, status)
+        REQUEST_STATEMENTS.observe(stats.statements, method, path)
+        REQUEST_DB_TIME.observe(stats.db_time, method, path)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            _log_slow_request(method, request.url.path, status, elapsed, stats)
+
+
+def _log_slow_request(method: str, path: str, status: int, elapsed: float, stats: _RequestStats) -> None:
+    lines = [
+        f"Slow request {method} {path} -> {status}: {elapsed * 1000:.1f}ms, "
+        f"{stats.statements} statements, {stats.db_time * 1000:.1f}ms in SQL"
+    ]
+    for seconds, sql in stats.log:
+        lines.append(f"  {seconds * 1000:8.2f}ms  {' '.join(sql.split())}")
+    if stats.statements > len(stats.log):
+        lines.append(f"  ... {stats.statements - len(stats.log)} more")
+    logger.warning("\n".join(lines))
+
+
+# ── Exposition ───────────────────────────────────────────
+def render(extra: dict[str, float] | None = None) -> str:
+    """All metrics in the Prometheus text format; `extra` adds plain gauges."""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for name, value in (extra or {}).items():
+        lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,124 @@
+"""
+Bring an existing database up to the current schema. Run with: python -m app.migrate
+
+create_all only adds missing tables, so columns, indexes and constraints
+added to existing tables are created here. Safe to run repeatedly.
+"""
+from sqlalchemy import text
+from app.concurrency import bump_pull_sequences
+from app.database import engine, create_schema, Base, SessionLocal
+from app.gacha import rebuild_pity_state
+from app.seed import item_key, slugify
+from app.stats import rebuild_pull_stats
+import app.models  # noqa: F401  (registers the tables)
+
+
+def _add_missing_columns(conn) -> list[str]:
+    """ALTER TABLE ADD COLUMN for model columns an older database lacks."""
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {row[1] for row in conn.execute(text(f'PRAGMA table_info("{table.name}")'))}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=conn.dialect)}'
+            if column.default is not None and column.default.is_scalar:
+                default = column.default.arg
+                ddl += f" DEFAULT {int(default) if isinstance(default, bool) else repr(default)}"
+            conn.execute(text(ddl))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _unique_key(key: str, row_id: int, taken: set[str]) -> str:
+    if key in taken:
+        key = f"{key}-{row_id}"
+    taken.add(key)
+    return key
+
+
+def _backfill_catalog_keys(conn) -> int:
+    """Give keyless banners and items the keys the catalog loader matches on."""
+    taken = {k for (k,) in conn.execute(text("SELECT key FROM banners WHERE key IS NOT NULL"))}
+    banners = [
+        {"id": row_id, "key": _unique_key(slugify(name), row_id, taken)}
+        for row_id, name in conn.execute(text("SELECT id, name FROM banners WHERE key IS NULL ORDER BY id"))
+    ]
+    if banners:
+        conn.execute(text("UPDATE banners SET key = :key WHERE id = :id"), banners)
+
+    taken = {k for (k,) in conn.execute(text("SELECT key FROM items WHERE key IS NOT NULL"))}
+    items = [
+        {"id": row_id, "key": _unique_key(item_key(banner_key, name), row_id, taken)}
+        for row_id, name, banner_key in conn.execute(text(
+            "SELECT items.id, items.name, banners.key FROM items JOIN banners ON banners.id = items.banner_id "
+            "WHERE items.key IS NULL ORDER BY items.id"
+        ))
+    ]
+    if items:
+        conn.execute(text("UPDATE items SET key = :key WHERE id = :id"), items)
+    return len(banners) + len(items)
+
+
+def _merge_duplicate_inventory(conn) -> int:
+    """Fold duplicate user+item rows into the oldest one so the unique index can be built."""
+    conn.execute(text("""
+        UPDATE inventory SET quantity = (
+            SELECT SUM(i2.quantity) FROM inventory i2
+            WHERE i2.user_id = inventory.user_id AND i2.item_id = inventory.item_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM inventory GROUP BY user_id, item_id HAVING COUNT(*) > 1
+        )
+    """))
+    return conn.execute(text("""
+        DELETE FROM inventory WHERE id NOT IN (
+            SELECT MIN(id) FROM inventory GROUP BY user_id, item_id
+        )
+    """)).rowcount
+
+
+def _rebuild_missing_counters() -> int:
+    """
+    Rebuild pity and counters for users whose history predates pity_state or
+    user_banner_stats. The pull path would do it on their next pull, but until
+    then /stats would report no pulls at all.
+    """
+    db = SessionLocal()
+    try:
+        user_ids = db.scalars(text("""
+            SELECT user_id FROM pulls UNION SELECT user_id FROM archived_pulls
+            EXCEPT SELECT user_id FROM user_banner_stats WHERE user_id IN (SELECT user_id FROM pity_state)
+        """)).all()
+        for user_id in user_ids:
+            rebuild_pity_state(db, user_id)
+            rebuild_pull_stats(db, user_id)
+        # Their /inventory and /stats ETags must not match anything served before
+        bump_pull_sequences(db, user_ids)
+        db.commit()
+    finally:
+        db.close()
+    return len(user_ids)
+
+
+def migrate():
+    create_schema()
+    with engine.begin() as conn:
+        added = _add_missing_columns(conn)
+        keyed = _backfill_catalog_keys(conn)
+        merged = _merge_duplicate_inventory(conn)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        conn.execute(text("ANALYZE"))
+    rebuilt = _rebuild_missing_counters()
+    if added:
+        print(f"Added columns: {', '.join(added)}.")
+    print(
+        f"Schema is up to date ({merged} duplicate inventory rows merged, {keyed} catalog keys backfilled, "
+        f"pity and counters rebuilt for {rebuilt} users)."
+    )
+
+
+if __name__ == "__main__":
+    migrate()
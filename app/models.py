@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -11,6 +11,8 @@ class User(Base):
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # Bumped by every pull batch; the compare-and-swap that keeps workers from racing (app.concurrency)
+    pull_sequence = Column(Integer, nullable=False, default=0)
 
     pulls = relationship("Pull", back_populates="user")
     inventory = relationship("Inventory", back_populates="user")
@@ -18,8 +20,13 @@ class User(Base):
 
 class Banner(Base):
     __tablename__ = "banners"
+    __table_args__ = (
+        # Stable identity for declarative catalog loads (python -m app.seed --catalog)
+        Index("uq_banners_key", "key", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    key = Column(String)
     name = Column(String, nullable=False)
     description = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
@@ -29,19 +36,31 @@ class Banner(Base):
 
 class Item(Base):
     __tablename__ = "items"
+    __table_args__ = (
+        Index("uq_items_key", "key", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    key = Column(String)
     name = Column(String, nullable=False)
     rarity = Column(String, nullable=False)  # Common, Rare, Epic, Legendary
     drop_rate = Column(Float, nullable=False)
     emoji = Column(String, default="🌸")
     banner_id = Column(Integer, ForeignKey("banners.id"), nullable=False)
+    # Retired items stay for history and inventory but drop out of the pool
+    is_active = Column(Boolean, default=True)
 
     banner = relationship("Banner", back_populates="items")
 
 
 class Pull(Base):
     __tablename__ = "pulls"
+    __table_args__ = (
+        # Pity/stats rebuilds and per-banner history
+        Index("ix_pulls_user_banner_number", "user_id", "banner_id", "pull_number"),
+        # /history pages and the export, newest or oldest first
+        Index("ix_pulls_user_number", "user_id", "pull_number"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -57,6 +76,10 @@ class Pull(Base):
 
 class Inventory(Base):
     __tablename__ = "inventory"
+    __table_args__ = (
+        # One row per user+item, which the pull engine's upsert relies on
+        Index("uq_inventory_user_item", "user_id", "item_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -65,3 +88,83 @@ class Inventory(Base):
 
     user = relationship("User", back_populates="inventory")
     item = relationship("Item")
+
+
+class PityState(Base):
+    __tablename__ = "pity_state"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    banner_id = Column(Integer, ForeignKey("banners.id"), primary_key=True)
+    since_epic = Column(Integer, nullable=False, default=0)
+    since_legendary = Column(Integer, nullable=False, default=0)
+    last_pull_number = Column(Integer, nullable=False, default=0)
+
+
+class AuthInvalidation(Base):
+    __tablename__ = "auth_invalidations"
+    __table_args__ = (
+        Index("ix_auth_invalidations_token", "token_digest"),
+    )
+
+    # Every worker applies new rows to its principal cache (app.coherence)
+    id = Column(Integer, primary_key=True)
+    token_digest = Column(String)  # sha256 of a revoked token
+    user_id = Column(Integer)  # or: drop every cached token of this user
+    expires_at = Column(Float, nullable=False)  # epoch seconds; the row is moot afterwards
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # The response a pull request with an Idempotency-Key produced (app.idempotency)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    key = Column(String, primary_key=True)
+    request = Column(String, nullable=False)  # what the key was first used for, e.g. "pull:1:10"
+    response = Column(LargeBinary, nullable=False)  # JSON body, replayed as is
+    expires_at = Column(Float, nullable=False, index=True)  # epoch seconds
+
+
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class UserBannerStats(Base):
+    __tablename__ = "user_banner_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    banner_id = Column(Integer, ForeignKey("banners.id"), primary_key=True)
+    total_pulls = Column(Integer, nullable=False, default=0)
+    common_count = Column(Integer, nullable=False, default=0)
+    rare_count = Column(Integer, nullable=False, default=0)
+    epic_count = Column(Integer, nullable=False, default=0)
+    legendary_count = Column(Integer, nullable=False, default=0)
+
+
+class JournalCheckpoint(Base):
+    __tablename__ = "journal_checkpoint"
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)  # last journal record applied
+
+
+class ArchivedPulls(Base):
+    __tablename__ = "archived_pulls"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # Pulls up to and including this number live in the user's segment files
+    last_pull_number = Column(Integer, nullable=False, default=0)
+    pull_count = Column(Integer, nullable=False, default=0)
+
+
+class BannerHourlyRollup(Base):
+    __tablename__ = "banner_hourly_rollup"
+
+    banner_id = Column(Integer, ForeignKey("banners.id"), primary_key=True)
+    hour = Column(DateTime, primary_key=True)  # UTC, truncated to the hour
+    item_id = Column(Integer, ForeignKey("items.id"), primary_key=True)
+    pulls = Column(Integer, nullable=False, default=0)
+    pity_hits = Column(Integer, nullable=False, default=0)  # forced by soft or hard pity
+    guarantee_hits = Column(Integer, nullable=False, default=0)  # forced by the 10-pull guarantee
@@ -0,0 +1,120 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is CPU-bound by design, so it runs in a small pool of worker
+processes rather than on the request threadpool, where a burst of logins
+would hold the GIL and the threads that pull routes need. The pool is
+bounded twice: PASSWORD_WORKERS processes (started at a lower scheduling
+priority, so the OS prefers the server process when they compete for a
+core) and at most PASSWORD_QUEUE hashes running or waiting per server
+process. Past that, register and login are shed with a 503 and a
+Retry-After instead of queueing without limit.
+
+New hashes use BCRYPT_ROUNDS. A successful login with a hash of any other
+cost gets it recomputed in the same worker call and stored, so raising or
+lowering the work factor takes effect as users sign in.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from app import metrics
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_QUEUE = int(os.getenv("PASSWORD_QUEUE", "64"))  # per server process, running + waiting
+PASSWORD_NICE = 10  # added to the workers' niceness where the OS supports it
+RETRY_AFTER = 1  # seconds, sent with the 503 when the queue is full
+
+
+class PasswordBusy(Exception):
+    """PASSWORD_QUEUE hashes are already running or waiting; shed this one."""
+
+
+# ── Hashing (runs in the worker processes) ───────────────
+# bcrypt is imported on first use, so the server process never loads it.
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    import bcrypt
+
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def verify_password(plain: str, hashed: str) -> bool:
+    import bcrypt
+
+    return bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def hash_rounds(hashed: str) -> int | None:
+    """The cost a "$2b$12$..." hash was made with, or None if it isn't one."""
+    parts = hashed.split("$")
+    return int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None
+
+
+def check_password(plain: str, hashed: str, rounds: int = BCRYPT_ROUNDS) -> tuple[bool, str | None]:
+    """(matches, replacement hash if it matched but wasn't made with `rounds`)."""
+    if not verify_password(plain, hashed):
+        return False, None
+    return True, (hash_password(plain, rounds) if hash_rounds(hashed) != rounds else None)
+
+
+def _start_worker() -> None:
+    if hasattr(os, "nice"):
+        os.nice(PASSWORD_NICE)
+    import bcrypt  # noqa: F401
+
+
+# ── Pool ─────────────────────────────────────────────────
+class PasswordPool:
+    """A process pool that refuses work instead of growing an unbounded queue."""
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0  # only touched on the event loop
+        self._executor: Executor | None = None
+        # start() runs on the threadpool while logins may already call run() on the event loop
+        self._lock = threading.Lock()
+
+    def _pool(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the server process has threads and an event loop running
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_start_worker,
+                )
+            return self._executor
+
+    async def run(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            metrics.PASSWORD_SHED.inc()
+            raise PasswordBusy(f"{self.pending} password hashes already queued")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    def start(self) -> None:
+        """Bring the worker processes up now rather than on the first login."""
+        pool = self._pool()
+        for future in [pool.submit(hash_rounds, "") for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+password_pool = PasswordPool(PASSWORD_WORKERS, PASSWORD_QUEUE)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_pool.run(hash_password, password)
+
+
+async def check_password_async(plain: str, hashed: str) -> tuple[bool, str | None]:
+    return await password_pool.run(check_password, plain, hashed)
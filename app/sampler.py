@@ -0,0 +1,49 @@
+"""Walker/Vose alias tables for constant-time weighted sampling."""
+import random
+
+
+class AliasTable:
+    """
+    Draws index i with probability weights[i] / sum(weights).
+    Built once in O(n); every draw costs one random number and one lookup.
+    """
+
+    __slots__ = ("n", "prob", "alias")
+
+    def __init__(self, weights: list[float] | tuple[float, ...]):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("AliasTable needs at least one positive weight")
+
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] += scaled[s] - 1.0
+            (small if scaled[g] < 1.0 else large).append(g)
+        # Whatever is left over is 1.0 up to rounding error and keeps prob=1.0
+
+        self.n = n
+        self.prob = tuple(prob)
+        self.alias = tuple(alias)
+
+    def draw(self, rng: random.Random = random) -> int:
+        u = rng.random() * self.n
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+    def sample(self, k: int, rng: random.Random = random) -> list[int]:
+        n, prob, alias, rand = self.n, self.prob, self.alias, rng.random
+        out = []
+        for _ in range(k):
+            u = rand() * n
+            i = int(u)
+            out.append(i if u - i < prob[i] else alias[i])
+        return out
@@ -45,6 +45,34 @@ class BannerDetailResponse(BannerResponse):
     items: list[ItemResponse]
 
 
+class ItemDropStats(BaseModel):
+    item_id: int
+    item_name: str
+    rarity: str
+    pulls: int
+    configured_rate: float
+    observed_rate: float
+
+
+class HourlyPullStats(BaseModel):
+    hour: datetime
+    pulls: int
+    pity_hits: int
+    guarantee_hits: int
+    pity_rate: float
+
+
+class BannerAnalyticsResponse(BaseModel):
+    banner_id: int
+    start: datetime
+    end: datetime
+    total_pulls: int
+    pity_hits: int
+    guarantee_hits: int
+    items: list[ItemDropStats]
+    hours: list[HourlyPullStats]
+
+
 # ── Pull ─────────────────────────────────────────────────
 class PullResultResponse(BaseModel):
     item_name: str
@@ -68,6 +96,7 @@ class InventoryItemResponse(BaseModel):
 
 # ── History ──────────────────────────────────────────────
 class PullHistoryResponse(BaseModel):
+    pull_number: int
     item_name: str
     rarity: str
     emoji: str
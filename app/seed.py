@@ -1,76 +1,268 @@
-"""Seed the database with banners and items. Run with: python -m app.seed"""
-from app.database import engine, SessionLocal, Base
+"""
+Load the banner/item catalog. Run with: python -m app.seed [--catalog catalog.json]
+
+The catalog is declarative: each banner has a stable `key`, and so does
+each item (defaulting to "<banner key>/<slugified name>"). A load diffs the
+file against the current rows by key and applies inserts, updates and
+deactivations in one transaction, so item ids under existing pulls and
+inventory never change. Banners and items missing from the file are
+deactivated, never deleted.
+
+Catalog files are either JSON ({"banners": [...]} or a bare list) or
+NDJSON with one banner per line, which is read as a stream.
+"""
+import argparse
+import json
+import re
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from app.database import SessionLocal, require_schema
 from app.models import Banner, Item
+from app.catalog import bump_catalog_version, invalidate
 
+RARITIES = ("Common", "Rare", "Epic", "Legendary")
+BANNER_FIELDS = ("name", "description", "is_active")
+ITEM_FIELDS = ("name", "rarity", "drop_rate", "emoji", "banner_id", "is_active")
 
-def seed():
-    Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
 
-    # Clear existing seed data
-    db.query(Item).delete()
-    db.query(Banner).delete()
+def slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
 
-    # ── Spring Blossom Banner ────────────────────────────
-    spring = Banner(
-        name="Spring Blossom",
-        description="Petals drift on a warm breeze. What treasures hide among the branches?",
-        is_active=True,
-    )
-    db.add(spring)
-    db.flush()
-
-    spring_items = [
-        # Common — 70% total
-        Item(name="Fallen Petal",     rarity="Common",    drop_rate=20.0, emoji="🌸", banner_id=spring.id),
-        Item(name="Cherry Leaf",      rarity="Common",    drop_rate=20.0, emoji="🍃", banner_id=spring.id),
-        Item(name="Pink Dewdrop",     rarity="Common",    drop_rate=15.0, emoji="💧", banner_id=spring.id),
-        Item(name="Blossom Seed",     rarity="Common",    drop_rate=15.0, emoji="🌱", banner_id=spring.id),
-        # Rare — 20% total
-        Item(name="Moonlit Branch",   rarity="Rare",      drop_rate=8.0,  emoji="🌙", banner_id=spring.id),
-        Item(name="Sakura Lantern",   rarity="Rare",      drop_rate=7.0,  emoji="🏮", banner_id=spring.id),
-        Item(name="Koi Pond Stone",   rarity="Rare",      drop_rate=5.0,  emoji="🪨", banner_id=spring.id),
-        # Epic — 8% total
-        Item(name="Enchanted Parasol", rarity="Epic",     drop_rate=5.0,  emoji="🌂", banner_id=spring.id),
-        Item(name="Spirit Fox Mask",   rarity="Epic",     drop_rate=3.0,  emoji="🦊", banner_id=spring.id),
-        # Legendary — 2% total
-        Item(name="Eternal Sakura Tree",    rarity="Legendary", drop_rate=1.2, emoji="🌳", banner_id=spring.id),
-        Item(name="Dragon of the Blossoms", rarity="Legendary", drop_rate=0.8, emoji="🐉", banner_id=spring.id),
+
+def item_key(banner_key: str, name: str) -> str:
+    return f"{banner_key}/{slugify(name)}"
+
+
+def _items(banner_key: str, rows: list[tuple]) -> list[dict]:
+    return [
+        {"key": item_key(banner_key, name), "name": name, "rarity": rarity, "drop_rate": rate, "emoji": emoji}
+        for name, rarity, rate, emoji in rows
     ]
-    db.add_all(spring_items)
 
+
+BUILTIN_CATALOG = [
+    # ── Spring Blossom Banner ────────────────────────────
+    {
+        "key": "spring-blossom",
+        "name": "Spring Blossom",
+        "description": "Petals drift on a warm breeze. What treasures hide among the branches?",
+        "items": _items("spring-blossom", [
+            # Common — 70% total
+            ("Fallen Petal",           "Common",    20.0, "🌸"),
+            ("Cherry Leaf",            "Common",    20.0, "🍃"),
+            ("Pink Dewdrop",           "Common",    15.0, "💧"),
+            ("Blossom Seed",           "Common",    15.0, "🌱"),
+            # Rare — 20% total
+            ("Moonlit Branch",         "Rare",      8.0,  "🌙"),
+            ("Sakura Lantern",         "Rare",      7.0,  "🏮"),
+            ("Koi Pond Stone",         "Rare",      5.0,  "🪨"),
+            # Epic — 8% total
+            ("Enchanted Parasol",      "Epic",      5.0,  "🌂"),
+            ("Spirit Fox Mask",        "Epic",      3.0,  "🦊"),
+            # Legendary — 2% total
+            ("Eternal Sakura Tree",    "Legendary", 1.2,  "🌳"),
+            ("Dragon of the Blossoms", "Legendary", 0.8,  "🐉"),
+        ]),
+    },
     # ── Midnight Garden Banner ───────────────────────────
-    midnight = Banner(
-        name="Midnight Garden",
-        description="Under a moonless sky, the garden reveals its secrets to the brave.",
-        is_active=True,
-    )
-    db.add(midnight)
-    db.flush()
-
-    midnight_items = [
-        # Common — 70%
-        Item(name="Shadow Petal",     rarity="Common",    drop_rate=18.0, emoji="🖤", banner_id=midnight.id),
-        Item(name="Night Moss",       rarity="Common",    drop_rate=18.0, emoji="🌿", banner_id=midnight.id),
-        Item(name="Firefly Jar",      rarity="Common",    drop_rate=17.0, emoji="✨", banner_id=midnight.id),
-        Item(name="Dusk Stone",       rarity="Common",    drop_rate=17.0, emoji="🪨", banner_id=midnight.id),
-        # Rare — 20%
-        Item(name="Phantom Koi",      rarity="Rare",      drop_rate=8.0,  emoji="🐟", banner_id=midnight.id),
-        Item(name="Wisteria Crown",   rarity="Rare",      drop_rate=7.0,  emoji="👑", banner_id=midnight.id),
-        Item(name="Moonstone Ring",   rarity="Rare",      drop_rate=5.0,  emoji="💍", banner_id=midnight.id),
-        # Epic — 8%
-        Item(name="Void Lantern",     rarity="Epic",      drop_rate=5.0,  emoji="🔮", banner_id=midnight.id),
-        Item(name="Oni War Fan",      rarity="Epic",      drop_rate=3.0,  emoji="🎌", banner_id=midnight.id),
-        # Legendary — 2%
-        Item(name="Celestial Moon Blade", rarity="Legendary", drop_rate=1.2, emoji="🌕", banner_id=midnight.id),
-        Item(name="The Nine-Tailed Spirit", rarity="Legendary", drop_rate=0.8, emoji="🦊", banner_id=midnight.id),
+    {
+        "key": "midnight-garden",
+        "name": "Midnight Garden",
+        "description": "Under a moonless sky, the garden reveals its secrets to the brave.",
+        "items": _items("midnight-garden", [
+            # Common — 70%
+            ("Shadow Petal",           "Common",    18.0, "🖤"),
+            ("Night Moss",             "Common",    18.0, "🌿"),
+            ("Firefly Jar",            "Common",    17.0, "✨"),
+            ("Dusk Stone",             "Common",    17.0, "🪨"),
+            # Rare — 20%
+            ("Phantom Koi",            "Rare",      8.0,  "🐟"),
+            ("Wisteria Crown",         "Rare",      7.0,  "👑"),
+            ("Moonstone Ring",         "Rare",      5.0,  "💍"),
+            # Epic — 8%
+            ("Void Lantern",           "Epic",      5.0,  "🔮"),
+            ("Oni War Fan",            "Epic",      3.0,  "🎌"),
+            # Legendary — 2%
+            ("Celestial Moon Blade",   "Legendary", 1.2,  "🌕"),
+            ("The Nine-Tailed Spirit", "Legendary", 0.8,  "🦊"),
+        ]),
+    },
+]
+
+
+class CatalogDiff(NamedTuple):
+    banners: int
+    items: int
+    inserted: int
+    updated: int
+    deactivated: int
+
+
+# ── Reading ──────────────────────────────────────────────
+def read_catalog(path: str) -> Iterator[dict]:
+    """Banner entries from a JSON or NDJSON catalog file."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".ndjson", ".jsonl")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        doc = json.load(f)
+    yield from doc["banners"] if isinstance(doc, dict) else doc
+
+
+def _banner_values(entry: dict, n: int) -> tuple[str, dict]:
+    key = entry.get("key")
+    if not key or not entry.get("name"):
+        raise ValueError(f"banner #{n} needs a key and a name")
+    return key, {
+        "name": entry["name"],
+        "description": entry.get("description", ""),
+        "is_active": bool(entry.get("is_active", True)),
+    }
+
+
+def _item_values(banner_key: str, entry: dict) -> tuple[str, dict]:
+    name = entry.get("name")
+    if not name:
+        raise ValueError(f"an item in banner {banner_key!r} has no name")
+    key = entry.get("key") or item_key(banner_key, name)
+    if entry.get("rarity") not in RARITIES:
+        raise ValueError(f"item {key!r}: rarity must be one of {', '.join(RARITIES)}")
+    drop_rate = entry.get("drop_rate")
+    if not isinstance(drop_rate, (int, float)) or drop_rate <= 0:
+        raise ValueError(f"item {key!r}: drop_rate must be a positive number")
+    return key, {
+        "name": name,
+        "rarity": entry["rarity"],
+        "drop_rate": float(drop_rate),
+        "emoji": entry.get("emoji", "🌸"),
+        "is_active": bool(entry.get("is_active", True)),
+    }
+
+
+# ── Loading ──────────────────────────────────────────────
+def load_catalog_entries(db: Session, entries: Iterable[dict]) -> CatalogDiff:
+    """
+    Diff banner entries against the current rows by key and apply the
+    changes with executemany. Does not commit.
+    """
+    banners = {
+        key: (row_id, values)
+        for row_id, key, *values in db.execute(
+            select(Banner.id, Banner.key, *[getattr(Banner, f) for f in BANNER_FIELDS])
+        )
+        if key is not None
+    }
+    items = {
+        key: (row_id, values)
+        for row_id, key, *values in db.execute(select(Item.id, Item.key, *[getattr(Item, f) for f in ITEM_FIELDS]))
+        if key is not None
+    }
+
+    new_banners, banner_updates, pending_items = [], [], []
+    seen_banners: set[str] = set()
+    for n, entry in enumerate(entries, 1):
+        key, values = _banner_values(entry, n)
+        if key in seen_banners:
+            raise ValueError(f"banner {key!r} appears twice")
+        seen_banners.add(key)
+        current = banners.get(key)
+        if current is None:
+            new_banners.append({"key": key, **values})
+        elif list(current[1]) != [values[f] for f in BANNER_FIELDS]:
+            banner_updates.append({"id": current[0], **values})
+        pending_items.extend(_item_values(key, item) + (key,) for item in entry.get("items", []))
+
+    # Banners and items dropped from the file keep their rows (and ids) but stop being offered
+    retired_banners = [
+        {"id": row_id, "is_active": False}
+        for key, (row_id, values) in banners.items()
+        if key not in seen_banners and values[BANNER_FIELDS.index("is_active")]
     ]
-    db.add_all(midnight_items)
+    if new_banners:
+        db.execute(insert(Banner), new_banners)
+    for batch in (banner_updates, retired_banners):
+        if batch:
+            db.execute(update(Banner), batch)
+    banner_ids = dict(db.execute(select(Banner.key, Banner.id)).all())
+
+    new_items, item_updates = [], []
+    seen_items: set[str] = set()
+    for key, values, banner_key in pending_items:
+        if key in seen_items:
+            raise ValueError(f"item {key!r} appears twice")
+        seen_items.add(key)
+        values["banner_id"] = banner_ids[banner_key]
+        current = items.get(key)
+        if current is None:
+            new_items.append({"key": key, **values})
+        elif list(current[1]) != [values[f] for f in ITEM_FIELDS]:
+            item_updates.append({"id": current[0], **values})
+
+    retired_items = [
+        {"id": row_id, "is_active": False}
+        for key, (row_id, values) in items.items()
+        if key not in seen_items and values[ITEM_FIELDS.index("is_active")]
+    ]
+    if new_items:
+        db.execute(insert(Item), new_items)
+    for batch in (item_updates, retired_items):
+        if batch:
+            db.execute(update(Item), batch)
+
+    diff = CatalogDiff(
+        banners=len(seen_banners),
+        items=len(seen_items),
+        inserted=len(new_banners) + len(new_items),
+        updated=len(banner_updates) + len(item_updates),
+        deactivated=len(retired_banners) + len(retired_items),
+    )
+    if diff.inserted or diff.updated or diff.deactivated:
+        bump_catalog_version(db)
+    return diff
 
-    db.commit()
-    db.close()
-    print("Database seeded with 2 banners and 22 items!")
+
+def load(entries: Iterable[dict]) -> CatalogDiff:
+    """Apply a catalog in one transaction and drop the cached snapshot."""
+    db = SessionLocal()
+    try:
+        diff = load_catalog_entries(db, entries)
+        db.commit()
+    finally:
+        db.close()
+    invalidate()
+    return diff
+
+
+def seed():
+    diff = load(BUILTIN_CATALOG)
+    print(f"Database seeded with {diff.banners} banners and {diff.items} items!")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the banner/item catalog.")
+    parser.add_argument("--catalog", help="JSON or NDJSON catalog file (default: the built-in banners)")
+    args = parser.parse_args()
+    try:
+        require_schema()
+    except RuntimeError as exc:
+        raise SystemExit(str(exc))
+
+    if args.catalog is None:
+        seed()
+        return
+    try:
+        diff = load(read_catalog(args.catalog))
+    except (OSError, ValueError, KeyError) as exc:
+        raise SystemExit(f"Catalog not loaded: {exc}")
+    print(
+        f"Loaded {diff.banners} banners and {diff.items} items "
+        f"({diff.inserted} inserted, {diff.updated} updated, {diff.deactivated} deactivated)."
+    )
 
 
 if __name__ == "__main__":
-    seed()
+    main()
@@ -0,0 +1,186 @@
+"""
+Monte Carlo simulator for banner pity economics.
+Run with: python -m app.simulate --banner 1 --players 100000 --pulls 100
+
+Every virtual player is one slot in a set of NumPy arrays, so each step
+advances all players at once using the same pity rules as app.gacha.
+"""
+import argparse
+import time
+from dataclasses import dataclass
+import numpy as np
+from app.catalog import BannerSnapshot, get_catalog
+from app.gacha import EPIC_PITY_THRESHOLD, LEGENDARY_PITY_THRESHOLD
+
+RARITIES = ("Common", "Rare", "Epic", "Legendary")
+RARE, EPIC, LEGENDARY = 1, 2, 3
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+
+@dataclass
+class SimulationResult:
+    banner: BannerSnapshot
+    players: int
+    pulls_per_player: int
+    ten_pull: bool
+    item_hits: np.ndarray        # hits per banner item, in banner.items order
+    legendary_gaps: np.ndarray   # histogram: pulls taken to reach each Legendary
+    epic_gaps: np.ndarray        # histogram: pulls taken to reach each Epic or better
+    first_legendary: np.ndarray  # per player: pull that gave the first Legendary, 0 if none
+    epic_pity: int
+    legendary_pity: int
+    guarantees: int
+    elapsed: float
+
+    @property
+    def total_pulls(self) -> int:
+        return self.players * self.pulls_per_player
+
+
+def simulate(
+    banner: BannerSnapshot,
+    players: int,
+    pulls: int,
+    ten_pull: bool = False,
+    seed: int | None = None,
+) -> SimulationResult:
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    n_items = len(banner.items)
+    prob = np.array(banner.sampler.prob)
+    alias = np.array(banner.sampler.alias)
+    item_rarity = np.array([RARITIES.index(i.rarity) for i in banner.items])
+    tier_pools = {r: np.flatnonzero(item_rarity == RARITIES.index(r)) for r in RARITIES}
+
+    since_epic = np.zeros(players, dtype=np.int32)
+    since_legendary = np.zeros(players, dtype=np.int32)
+    block_has_rare = np.zeros(players, dtype=bool)
+    first_legendary = np.zeros(players, dtype=np.int32)
+    item_hits = np.zeros(n_items, dtype=np.int64)
+    # A gap is at most `pulls` long; pity only caps it when the banner has that tier
+    legendary_gaps = np.zeros(pulls + 1, dtype=np.int64)
+    epic_gaps = np.zeros(pulls + 1, dtype=np.int64)
+    pity_fired = {"Epic": 0, "Legendary": 0}
+    guarantees = 0
+
+    def force(picks: np.ndarray, mask: np.ndarray, tier: str) -> int:
+        # Same as _pick_item: uniform within the tier, natural pick if the tier is empty
+        pool = tier_pools[tier]
+        fired = int(mask.sum())
+        if fired and len(pool):
+            picks[mask] = pool[rng.integers(0, len(pool), fired)]
+        return fired
+
+    for step in range(pulls):
+        slots = rng.integers(0, n_items, players)
+        picks = np.where(rng.random(players) < prob[slots], slots, alias[slots])
+
+        force_legendary = since_legendary >= LEGENDARY_PITY_THRESHOLD - 1
+        force_epic = ~force_legendary & (since_epic >= EPIC_PITY_THRESHOLD - 1)
+        pity_fired["Legendary"] += force(picks, force_legendary, "Legendary")
+        pity_fired["Epic"] += force(picks, force_epic, "Epic")
+        rarity = item_rarity[picks]
+
+        if ten_pull:
+            if step % 10 == 9:
+                # 10-pull guarantee: last pull of a block with nothing Rare or better
+                need = ~block_has_rare & (rarity < RARE)
+                guarantees += force(picks, need, "Rare")
+                rarity = item_rarity[picks]
+                block_has_rare[:] = False
+            else:
+                block_has_rare |= rarity >= RARE
+
+        got_legendary = rarity == LEGENDARY
+        got_epic = rarity >= EPIC
+        legendary_gaps += np.bincount(since_legendary[got_legendary] + 1, minlength=len(legendary_gaps))
+        epic_gaps += np.bincount(since_epic[got_epic] + 1, minlength=len(epic_gaps))
+        first_legendary[(first_legendary == 0) & got_legendary] = step + 1
+        item_hits += np.bincount(picks, minlength=n_items)
+
+        since_legendary = np.where(got_legendary, 0, since_legendary + 1)
+        since_epic = np.where(got_epic, 0, since_epic + 1)
+
+    return SimulationResult(
+        banner=banner,
+        players=players,
+        pulls_per_player=pulls,
+        ten_pull=ten_pull,
+        item_hits=item_hits,
+        legendary_gaps=legendary_gaps,
+        epic_gaps=epic_gaps,
+        first_legendary=first_legendary,
+        epic_pity=pity_fired["Epic"],
+        legendary_pity=pity_fired["Legendary"],
+        guarantees=guarantees,
+        elapsed=time.perf_counter() - started,
+    )
+
+
+def _histogram_percentiles(hist: np.ndarray) -> tuple[float, list[int]]:
+    total = hist.sum()
+    if total == 0:
+        return 0.0, [0] * len(PERCENTILES)
+    mean = float((np.arange(len(hist)) * hist).sum() / total)
+    cdf = np.cumsum(hist) / total
+    return mean, [int(np.searchsorted(cdf, q / 100)) for q in PERCENTILES]
+
+
+def report(result: SimulationResult, cost_per_pull: float) -> str:
+    banner = result.banner
+    total = result.total_pulls
+    lines = [
+        f"Banner: {banner.name} (id {banner.id})",
+        f"Simulated {result.players:,} players x {result.pulls_per_player} pulls = {total:,} pulls"
+        f" in {result.elapsed:.2f}s ({total / result.elapsed:,.0f} pulls/s)",
+        f"Mode: {'10-pulls' if result.ten_pull else 'single pulls'}",
+        "",
+        "Pulls needed  " + "".join(f"{'p' + str(q):>7}" for q in PERCENTILES) + f"{'mean':>9}{'spend':>12}",
+    ]
+    for label, hist in (("Legendary", result.legendary_gaps), ("Epic+", result.epic_gaps)):
+        mean, values = _histogram_percentiles(hist)
+        lines.append(
+            f"{label:<14}" + "".join(f"{v:>7}" for v in values) + f"{mean:>9.1f}{mean * cost_per_pull:>12,.0f}"
+        )
+
+    got = result.first_legendary[result.first_legendary > 0]
+    lines += [
+        "",
+        f"Players with a Legendary within {result.pulls_per_player} pulls: {len(got) / result.players:.2%}",
+        f"Epic pity fired:       {result.epic_pity / total:.3%} of pulls",
+        f"Legendary pity fired:  {result.legendary_pity / total:.3%} of pulls",
+    ]
+    if result.ten_pull:
+        blocks = result.players * (result.pulls_per_player // 10)
+        lines.append(f"10-pull guarantee:     {result.guarantees / max(blocks, 1):.3%} of 10-pulls")
+
+    weight_total = sum(i.drop_rate for i in banner.items)
+    lines += ["", f"{'Item':<26}{'Rarity':<11}{'Configured':>11}{'Observed':>11}"]
+    for item, hits in zip(banner.items, result.item_hits):
+        lines.append(
+            f"{item.name:<26}{item.rarity:<11}{item.drop_rate / weight_total:>11.3%}{hits / total:>11.3%}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate pity economics for a banner.")
+    parser.add_argument("--banner", type=int, required=True, help="banner id")
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--pulls", type=int, default=100, help="pulls per player")
+    parser.add_argument("--ten", action="store_true", help="pull in 10-pulls (applies the Rare guarantee)")
+    parser.add_argument("--cost", type=float, default=160, help="currency cost of one pull")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    banner = get_catalog().banners.get(args.banner)
+    if banner is None or not banner.items:
+        parser.error(f"banner {args.banner} not found or has no items")
+
+    result = simulate(banner, args.players, args.pulls, ten_pull=args.ten, seed=args.seed)
+    print(report(result, args.cost))
+
+
+if __name__ == "__main__":
+    main()
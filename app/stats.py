@@ -0,0 +1,126 @@
+"""
+Per-user, per-banner pull counters.
+
+`record_pulls` runs in the same transaction as every pull, so /stats is a
+single aggregate over a handful of rows instead of a scan of `pulls`.
+`rebuild_pull_stats` and `reconcile_pull_stats` recompute the counters
+from the raw pulls table (plus any archived pulls) for backfills and
+consistency checks.
+"""
+from collections import Counter
+from sqlalchemy import case, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.archive import archived_pulls
+from app.models import Item, Pull, UserBannerStats
+
+RARITY_COLUMNS = {
+    "Common": "common_count",
+    "Rare": "rare_count",
+    "Epic": "epic_count",
+    "Legendary": "legendary_count",
+}
+COUNTER_COLUMNS = ("total_pulls", *RARITY_COLUMNS.values())
+
+
+def record_pulls(db: Session, user_id: int, banner_id: int, rarities: list[str]) -> None:
+    """Add a batch of pulls to the user's counters with one upsert."""
+    counts = Counter(rarities)
+    values = {"total_pulls": len(rarities)}
+    values.update({column: counts[rarity] for rarity, column in RARITY_COLUMNS.items()})
+
+    stmt = sqlite_insert(UserBannerStats).values(user_id=user_id, banner_id=banner_id, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserBannerStats.user_id, UserBannerStats.banner_id],
+        set_={c: getattr(UserBannerStats, c) + stmt.excluded[c] for c in COUNTER_COLUMNS},
+    )
+    db.execute(stmt)
+
+
+def get_counts(db: Session, user_id: int, banner_id: int | None = None) -> dict[str, int]:
+    """Sum the user's counters across banners (or for one banner) in one query."""
+    query = select(*[func.coalesce(func.sum(getattr(UserBannerStats, c)), 0) for c in COUNTER_COLUMNS]).where(
+        UserBannerStats.user_id == user_id
+    )
+    if banner_id is not None:
+        query = query.where(UserBannerStats.banner_id == banner_id)
+    return dict(zip(COUNTER_COLUMNS, db.execute(query).one()))
+
+
+def _counts_from_pulls(user_id: int | None = None):
+    """Recompute the counters from the pulls table, grouped by user and banner."""
+    query = (
+        select(
+            Pull.user_id,
+            Pull.banner_id,
+            func.count(),
+            *[func.sum(case((Item.rarity == rarity, 1), else_=0)) for rarity in RARITY_COLUMNS],
+        )
+        .join(Item, Item.id == Pull.item_id)
+        .group_by(Pull.user_id, Pull.banner_id)
+    )
+    if user_id is not None:
+        query = query.where(Pull.user_id == user_id)
+    return query
+
+
+def _archived_counts(db: Session, user_id: int | None = None) -> dict[tuple[int, int], Counter]:
+    """Rarity counts of archived pulls, by user and banner."""
+    counts: dict[tuple[int, int], Counter] = {}
+    for uid, bid, _, rarity in archived_pulls(db, user_id):
+        counts.setdefault((uid, bid), Counter())[rarity] += 1
+    return counts
+
+
+def _counter_values(counts: Counter) -> tuple:
+    return (sum(counts.values()), *(counts[rarity] for rarity in RARITY_COLUMNS))
+
+
+def rebuild_pull_stats(db: Session, user_id: int | None = None) -> int:
+    """
+    Replace the counters with values recomputed from pulls and archived
+    pulls, for one user or everyone.
+    Returns the number of user+banner rows written.
+    """
+    stale = db.query(UserBannerStats)
+    if user_id is not None:
+        stale = stale.filter(UserBannerStats.user_id == user_id)
+    stale.delete(synchronize_session=False)
+
+    db.execute(
+        insert(UserBannerStats).from_select(
+            ["user_id", "banner_id", *COUNTER_COLUMNS], _counts_from_pulls(user_id)
+        )
+    )
+    for (uid, bid), counts in _archived_counts(db, user_id).items():
+        record_pulls(db, uid, bid, list(counts.elements()))
+    return stale.count()
+
+
+def reconcile_pull_stats(db: Session) -> list[tuple[int, int, tuple, tuple]]:
+    """
+    Compare the counters against the pulls table and archived pulls.
+    Returns (user_id, banner_id, expected, stored) for every row that differs.
+    """
+    expected = {(row[0], row[1]): tuple(row[2:]) for row in db.execute(_counts_from_pulls())}
+    for key, counts in _archived_counts(db).items():
+        hot = expected.get(key, (0,) * len(COUNTER_COLUMNS))
+        expected[key] = tuple(a + b for a, b in zip(hot, _counter_values(counts)))
+    stored = {
+        (row[0], row[1]): tuple(row[2:])
+        for row in db.execute(
+            select(
+                UserBannerStats.user_id,
+                UserBannerStats.banner_id,
+                *[getattr(UserBannerStats, c) for c in COUNTER_COLUMNS],
+            )
+        )
+    }
+    empty = (0,) * len(COUNTER_COLUMNS)
+    mismatches = []
+    for user_id, banner_id in sorted(expected.keys() | stored.keys()):
+        want = expected.get((user_id, banner_id), empty)
+        have = stored.get((user_id, banner_id), empty)
+        if want != have:
+            mismatches.append((user_id, banner_id, want, have))
+    return mismatches
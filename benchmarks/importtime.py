@@ -0,0 +1,142 @@
+"""
+Cold-start profile: import time and time to first request.
+Run with: python -m benchmarks.importtime --runs 5
+
+Each run starts a fresh interpreter. The import profile comes from
+`python -X importtime -c "import app.main"`, with each module's own time
+summed per top-level package. Time to first request is measured from
+spawning uvicorn to the first 200 from /banners, and then to the first
+authenticated request (/stats), which is the first to need the JWT
+backend. Pass --save to
+write the report as JSON and --baseline to compare against an earlier
+one; a slowdown beyond --threshold exits non-zero.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+
+def import_profile(env: dict) -> tuple[float, dict[str, float]]:
+    """(ms for `import app.main`, self ms summed per top-level package)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    packages: dict[str, float] = {}
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(own) / 1000
+        if name == "app.main":
+            total = int(cumulative) / 1000
+    return total, packages
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url: str, token: str | None = None) -> int:
+    request = urllib.request.Request(url, headers={"Authorization": f"Bearer {token}"} if token else {})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except (urllib.error.URLError, ConnectionError):
+        return 0
+
+
+def first_request(env: dict, token: str) -> tuple[float, float]:
+    """Seconds from spawning uvicorn to the first /banners 200, and to the first /stats 200."""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"], env=env,
+    )
+    try:
+        while _get(f"http://127.0.0.1:{port}/banners") != 200:
+            if server.poll() is not None or time.perf_counter() - started > 60:
+                raise RuntimeError("server did not come up")
+            time.sleep(0.005)
+        banners = time.perf_counter() - started
+        if _get(f"http://127.0.0.1:{port}/stats", token) != 200:
+            raise RuntimeError("authenticated request failed")
+        return banners, time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile cold-start import time and time to first request.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="packages to list in the import profile")
+    parser.add_argument("--save", metavar="PATH", help="write the JSON report here")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved report")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="sakura-coldstart-"), "coldstart.db")
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}", "PYTHONPATH": os.getcwd()}
+    os.environ["DATABASE_URL"] = env["DATABASE_URL"]
+    from app.auth import create_access_token
+    from benchmarks.load import seed_database
+
+    token = create_access_token(seed_database(1, 10, 0)[0])
+
+    imports, profiles, banners, stats = [], [], [], []
+    for _ in range(args.runs):
+        total, packages = import_profile(env)
+        imports.append(total)
+        profiles.append(packages)
+        first_banners, first_stats = first_request(env, token)
+        banners.append(first_banners * 1000)
+        stats.append(first_stats * 1000)
+
+    names = {name for p in profiles for name in p}
+    by_package = {name: statistics.median(p.get(name, 0.0) for p in profiles) for name in names}
+    report = {
+        "import_ms": round(statistics.median(imports), 1),
+        "first_request_ms": round(statistics.median(banners), 1),
+        "first_authenticated_request_ms": round(statistics.median(stats), 1),
+        "packages_ms": {n: round(ms, 1) for n, ms in sorted(by_package.items(), key=lambda kv: -kv[1])[:args.top]},
+    }
+    print(f"import app.main            {report['import_ms']:>8.1f} ms", file=sys.stderr)
+    for name, ms in report["packages_ms"].items():
+        print(f"  {name:<24}{ms:>8.1f} ms", file=sys.stderr)
+    print(f"first /banners response   {report['first_request_ms']:>8.1f} ms", file=sys.stderr)
+    print(f"first /stats response      {report['first_authenticated_request_ms']:>8.1f} ms", file=sys.stderr)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for key in ("import_ms", "first_request_ms", "first_authenticated_request_ms"):
+            change = report[key] / baseline[key] - 1
+            print(f"{key}: {baseline[key]} -> {report[key]} ({change:+.1%})", file=sys.stderr)
+            if change > args.threshold:
+                print(f"REGRESSION {key}", file=sys.stderr)
+                status = 1
+
+    output = json.dumps(report, indent=2)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Load and latency benchmark for the API.
+Run with: python -m benchmarks.load --users 20 --history 1000,100000
+
+For every history size a fresh SQLite database is filled with synthetic
+users and pulls (written with bulk inserts, not through the API), then each
+scenario is driven in-process over httpx's ASGI transport at each
+concurrency level. The report gives p50/p95/p99 latency, throughput and SQL
+statements per request; pass --save to write it as JSON and --baseline to
+compare against an earlier report.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+SCENARIOS = {
+    "pull": ("POST", "/banners/{banner}/pull"),
+    "pull_ten": ("POST", "/banners/{banner}/pull/ten"),
+    "stats": ("GET", "/stats"),
+    "history": ("GET", "/history"),
+    "inventory": ("GET", "/inventory"),
+    # Clients polling with the ETag of their last response
+    "stats_revalidate": ("GET", "/stats"),
+    "inventory_revalidate": ("GET", "/inventory"),
+    # Every 10-pull sent twice with the same Idempotency-Key, as a client retrying after a timeout
+    "pull_ten_retry": ("POST", "/banners/{banner}/pull/ten"),
+}
+SEED_CHUNK = 50_000  # pulls per bulk insert while seeding
+
+
+# ── Seeding ──────────────────────────────────────────────
+def seed_database(users: int, pulls_per_user: int, seed: int) -> list[int]:
+    """Recreate every table and fill it with synthetic users and history. Returns user ids."""
+    from app import auth, catalog
+    from app.passwords import hash_password
+    from app.database import Base, SessionLocal, create_schema, engine
+    from app.gacha import PullRow, resolve_pulls, write_pulls
+    from app.models import PityState, User
+    from app.seed import seed as seed_catalog
+
+    Base.metadata.drop_all(bind=engine)
+    create_schema()
+    seed_catalog()
+    auth.principal_cache.clear()
+    banners = catalog.get_catalog().active_banners()
+    rng = random.Random(seed)
+    random.seed(seed)  # the samplers draw from the module-level generator
+
+    db = SessionLocal()
+    hashed = hash_password("benchmark")
+    db.add_all(User(username=f"bench{n}", hashed_password=hashed) for n in range(users))
+    db.flush()
+    user_ids = [u.id for u in db.query(User).order_by(User.id)]
+
+    # Pulls are resolved with the real engine in 10-pull blocks on a random
+    # banner, so pity, inventory and counters look like organic history.
+    start = datetime.now(timezone.utc) - timedelta(seconds=pulls_per_user)
+    rows: list[PullRow] = []
+    for user_id in user_ids:
+        states: dict[int, PityState] = {}
+        pull_number = 0
+        while pull_number < pulls_per_user:
+            banner = rng.choice(banners)
+            state = states.setdefault(
+                banner.id,
+                PityState(user_id=user_id, banner_id=banner.id, since_epic=0, since_legendary=0, last_pull_number=0),
+            )
+            count = min(10, pulls_per_user - pull_number)
+            for n, (item, is_pity, guaranteed) in enumerate(resolve_pulls(state, banner, count, pull_number + 1)):
+                number = pull_number + 1 + n
+                rows.append(PullRow(
+                    user_id, banner.id, number, item.id, item.rarity, start + timedelta(seconds=number),
+                    pity=is_pity and not guaranteed, guaranteed=guaranteed,
+                ))
+            pull_number += count
+            if len(rows) >= SEED_CHUNK:
+                write_pulls(db, rows)
+                rows = []
+        db.add_all(states.values())
+    if rows:
+        write_pulls(db, rows)
+    db.commit()
+    db.close()
+    return user_ids
+
+
+# ── Driving requests ─────────────────────────────────────
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(
+    client, tokens: list[str], scenario: str, requests: int, concurrency: int, counter: list[int]
+) -> dict:
+    method, path = SCENARIOS[scenario]
+    revalidate = scenario.endswith("_revalidate")
+    retry = scenario.endswith("_retry")
+    key_prefix = uuid.uuid4().hex
+    etags: dict[str, str] = {}
+    latencies: list[float] = []
+    errors = 0
+    next_request = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for n in next_request:
+            slot = n // 2 if retry else n  # a retry repeats the previous request exactly
+            url = path.format(banner=1 + slot % 2)
+            token = tokens[slot % len(tokens)]
+            headers = {"Authorization": f"Bearer {token}"}
+            if revalidate and token in etags:
+                headers["If-None-Match"] = etags[token]
+            if retry:
+                headers["Idempotency-Key"] = f"{key_prefix}-{slot}"
+            started = time.perf_counter()
+            response = await client.request(method, url, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code == 200 and revalidate:
+                etags[token] = response.headers["ETag"]
+            elif response.status_code not in (200, 304):
+                errors += 1
+
+    statements_before = counter[0]
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "statements_per_request": round((counter[0] - statements_before) / requests, 2),
+    }
+
+
+async def run_suite(args, user_ids_for) -> list[dict]:
+    import httpx
+    from sqlalchemy import event
+    from app.auth import create_access_token
+    from app.database import async_engine, engine
+    from app.main import app
+
+    counter = [0]
+
+    def count_statement(*_):
+        counter[0] += 1
+
+    for eng in (engine, async_engine.sync_engine if async_engine is not None else None):
+        if eng is not None:
+            event.listen(eng, "before_cursor_execute", count_statement)
+
+    results = []
+    for history in args.history:
+        print(f"Seeding {args.users} users x {history:,} pulls...", file=sys.stderr)
+        started = time.perf_counter()
+        user_ids = user_ids_for(history)
+        print(f"  seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        tokens = [create_access_token(user_id) for user_id in user_ids]
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                # Warm the catalog and principal caches outside the measurements
+                for token in tokens:
+                    await client.get("/stats", headers={"Authorization": f"Bearer {token}"})
+                for scenario in args.scenarios:
+                    for concurrency in args.concurrency:
+                        result = await run_scenario(client, tokens, scenario, args.requests, concurrency, counter)
+                        result = {"scenario": scenario, "history": history, "concurrency": concurrency, **result}
+                        results.append(result)
+                        print(
+                            f"  {scenario:<10} history={history:<7} c={concurrency:<3} "
+                            f"p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms "
+                            f"p99={result['p99_ms']:.1f}ms {result['throughput_rps']:.0f} req/s "
+                            f"{result['statements_per_request']} stmts/req",
+                            file=sys.stderr,
+                        )
+    return results
+
+
+# ── Reporting ────────────────────────────────────────────
+def _key(result: dict) -> tuple:
+    return result["scenario"], result["history"], result["concurrency"]
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[dict]:
+    """Attach baseline deltas to each result; returns the regressions."""
+    previous = {_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        result["baseline"] = {
+            "p95_change": round(result["p95_ms"] / before["p95_ms"] - 1, 4) if before["p95_ms"] else None,
+            "throughput_change": round(result["throughput_rps"] / before["throughput_rps"] - 1, 4),
+            "statements_change": round(result["statements_per_request"] - before["statements_per_request"], 2),
+        }
+        change = result["baseline"]
+        if (
+            (change["p95_change"] or 0) > threshold
+            or change["throughput_change"] < -threshold
+            or change["statements_change"] > 0
+        ):
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API latency and throughput.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history", default="1000,100000", help="comma-separated pulls per user to seed")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario and concurrency level")
+    parser.add_argument("--concurrency", default="1,16", help="comma-separated concurrency levels")
+    parser.add_argument(
+        "--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS)
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="PATH", help="write the JSON report here")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved report")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="relative p95/throughput change that counts as a regression"
+    )
+    parser.add_argument("--database", metavar="PATH", help="SQLite file to use (default: a temporary file)")
+    args = parser.parse_args()
+    args.history = [int(h) for h in args.history.split(",")]
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    args.scenarios = args.scenarios.split(",")
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # The app reads DATABASE_URL at import time, so point it at the benchmark
+    # database before anything from app is imported.
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix="sakura-bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+
+    results = asyncio.run(run_suite(args, lambda history: seed_database(args.users, history, args.seed)))
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "users": args.users,
+            "requests": args.requests,
+            "db_mode": os.getenv("DB_MODE", "sync"),
+            "write_behind": os.getenv("WRITE_BEHIND") == "1",
+            "python": sys.version.split()[0],
+        },
+        "results": results,
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        for r in regressions:
+            change = r["baseline"]
+            print(
+                f"REGRESSION {r['scenario']} history={r['history']} c={r['concurrency']}: "
+                f"p95 {change['p95_change']:+.1%}, throughput {change['throughput_change']:+.1%}, "
+                f"statements {change['statements_change']:+}",
+                file=sys.stderr,
+            )
+        status = 1 if regressions else 0
+
+    output = json.dumps(report, indent=2)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Pull latency during a login burst.
+Run with: python -m benchmarks.logins --logins 200 --login-concurrency 64
+
+The app runs in-process over httpx's ASGI transport, with its lifespan,
+so the password worker processes are real. Single pulls are driven at a
+fixed concurrency twice, first on their own and then while a burst of
+logins runs alongside. The report gives pull p50/p95 for both runs,
+login throughput, and how many logins were shed with a 503.
+Set BCRYPT_ROUNDS, PASSWORD_WORKERS and PASSWORD_QUEUE to compare settings.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+async def run(args) -> None:
+    import httpx
+    from app.auth import create_access_token
+    from app.main import app
+    from app.passwords import BCRYPT_ROUNDS, PASSWORD_QUEUE, PASSWORD_WORKERS
+    from benchmarks.load import seed_database
+
+    user_ids = seed_database(args.users, 0, 0)
+    tokens = [create_access_token(user_id) for user_id in user_ids]
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://logins", timeout=120) as client:
+
+            async def pulls(duration: float) -> list[float]:
+                latencies: list[float] = []
+                deadline = time.perf_counter() + duration
+
+                async def worker(n: int):
+                    headers = {"Authorization": f"Bearer {tokens[n % len(tokens)]}"}
+                    while time.perf_counter() < deadline:
+                        started = time.perf_counter()
+                        response = await client.post(f"/banners/{1 + n % 2}/pull", headers=headers)
+                        response.raise_for_status()
+                        latencies.append((time.perf_counter() - started) * 1000)
+
+                await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+                return latencies
+
+            async def logins() -> tuple[dict[int, int], float]:
+                statuses: dict[int, int] = {}
+                remaining = iter(range(args.logins))
+
+                async def worker():
+                    for n in remaining:
+                        body = {"username": f"bench{n % args.users}", "password": "benchmark"}
+                        status = (await client.post("/auth/login", json=body)).status_code
+                        statuses[status] = statuses.get(status, 0) + 1
+
+                started = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(args.login_concurrency)))
+                return statuses, time.perf_counter() - started
+
+            await client.post("/auth/login", json={"username": "bench0", "password": "benchmark"})
+            quiet = await pulls(args.duration)
+            login_task = asyncio.create_task(logins())
+            busy = await pulls(args.duration)
+            statuses, elapsed = await login_task
+
+    print(
+        f"bcrypt cost {BCRYPT_ROUNDS}, {PASSWORD_WORKERS} password workers, queue {PASSWORD_QUEUE}, "
+        f"{os.cpu_count()} CPUs",
+        file=sys.stderr,
+    )
+    print(f"{'Pulls':<22}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>10}")
+    for label, samples in (("without logins", quiet), ("during login burst", busy)):
+        print(
+            f"{label:<22}{_percentile(samples, 50):>10.1f}{_percentile(samples, 95):>10.1f}"
+            f"{len(samples) / args.duration:>10.0f}"
+        )
+    ok = statuses.get(200, 0)
+    print(f"logins: {ok} ok ({ok / elapsed:.1f}/s), {statuses.get(503, 0)} shed with 503, all statuses {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure pull latency while a burst of logins runs.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight pulls")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per pull run")
+    parser.add_argument("--logins", type=int, default=200, help="logins in the burst")
+    parser.add_argument("--login-concurrency", type=int, default=64, help="in-flight logins")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="sakura-logins-"), "logins.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Read latency during a pull storm.
+Run with: python -m benchmarks.reads --history 1000 --pullers 16
+
+The app runs in-process over httpx's ASGI transport on a freshly seeded
+database. GET /stats, /inventory and /history are driven at a fixed
+concurrency twice: on their own, then while other users hammer
+/pull/ten. Reads go through the read-only pool and pulls through the
+writer pool (see app.database), so read latency should stay close to the
+quiet run; what remains is CPU shared with the pulls. Compare
+WRITE_POOL_SIZE and READ_POOL_SIZE settings with the env vars.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+READS = ("/stats", "/inventory", "/history")
+
+
+def _percentile(samples: list[float], q: int) -> float:
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else samples[0]
+
+
+async def run(args) -> None:
+    import httpx
+    from app.auth import create_access_token
+    from app.main import app
+    from benchmarks.load import seed_database
+
+    user_ids = seed_database(args.readers + args.pullers, args.history, 0)
+    readers = [create_access_token(user_id) for user_id in user_ids[:args.readers]]
+    pullers = [create_access_token(user_id) for user_id in user_ids[args.readers:]]
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://reads", timeout=120) as client:
+
+            async def reads(duration: float) -> dict[str, list[float]]:
+                latencies: dict[str, list[float]] = {path: [] for path in READS}
+                deadline = time.perf_counter() + duration
+
+                async def worker(n: int):
+                    headers = {"Authorization": f"Bearer {readers[n % len(readers)]}"}
+                    while time.perf_counter() < deadline:
+                        path = READS[n % len(READS)]
+                        n += 1
+                        started = time.perf_counter()
+                        (await client.get(path, headers=headers)).raise_for_status()
+                        latencies[path].append((time.perf_counter() - started) * 1000)
+
+                await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+                return latencies
+
+            async def storm(stop: asyncio.Event) -> int:
+                pulls = 0
+
+                async def worker(token: str):
+                    nonlocal pulls
+                    headers = {"Authorization": f"Bearer {token}"}
+                    while not stop.is_set():
+                        (await client.post(f"/banners/{1 + pulls % 2}/pull/ten", headers=headers)).raise_for_status()
+                        pulls += 10
+
+                await asyncio.gather(*(worker(token) for token in pullers))
+                return pulls
+
+            quiet = await reads(args.duration)
+            stop = asyncio.Event()
+            pulling = asyncio.create_task(storm(stop))
+            busy = await reads(args.duration)
+            stop.set()
+            pulls = await pulling
+
+    print(f"{os.cpu_count()} CPUs, {args.history} pulls of history per user", file=sys.stderr)
+    print(f"{'Route':<14}{'quiet p50':>11}{'p95':>9}{'storm p50':>11}{'p95':>9}")
+    for path in READS:
+        print(
+            f"{path:<14}{_percentile(quiet[path], 50):>11.1f}{_percentile(quiet[path], 95):>9.1f}"
+            f"{_percentile(busy[path], 50):>11.1f}{_percentile(busy[path], 95):>9.1f}"
+        )
+    print(f"pull storm: {pulls / args.duration:.0f} pulls/s from {args.pullers} users")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure read latency while other users pull.")
+    parser.add_argument("--readers", type=int, default=8, help="users whose data is read")
+    parser.add_argument("--pullers", type=int, default=16, help="users pulling, one in-flight 10-pull each")
+    parser.add_argument("--history", type=int, default=1000, help="pulls of history per user")
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight reads")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per read run")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="sakura-reads-"), "reads.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
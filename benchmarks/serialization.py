@@ -0,0 +1,71 @@
+"""
+Per-request cost of serializing pull responses.
+Run with: python -m benchmarks.serialization
+
+Compares the Pydantic path the pull routes used to take (build the response
+models, validate them against response_model, dump and JSON-encode them)
+with the pre-encoded fragments they use now, and checks both produce the
+same bytes.
+"""
+import argparse
+import random
+import timeit
+from fastapi.responses import JSONResponse, Response
+from app.catalog import get_catalog
+from app.schemas import MultiPullResponse, PullResultResponse
+
+
+def pydantic_ten(results, total: int) -> bytes:
+    model = MultiPullResponse(
+        results=[
+            PullResultResponse(item_name=i.name, rarity=i.rarity, emoji=i.emoji, is_pity=p)
+            for i, p in results
+        ],
+        total_pulls=total,
+    )
+    # What FastAPI does with a returned model: validate against response_model, then dump
+    content = MultiPullResponse.model_validate(model).model_dump(mode="json")
+    return JSONResponse(content).body
+
+
+def fragment_ten(results, total: int) -> bytes:
+    body = b'{"results":[' + b",".join(i.pull_json[p] for i, p in results) + b'],"total_pulls":%d}' % total
+    return Response(content=body, media_type="application/json").body
+
+
+def pydantic_one(item, is_pity: bool) -> bytes:
+    model = PullResultResponse(item_name=item.name, rarity=item.rarity, emoji=item.emoji, is_pity=is_pity)
+    return JSONResponse(PullResultResponse.model_validate(model).model_dump(mode="json")).body
+
+
+def fragment_one(item, is_pity: bool) -> bytes:
+    return Response(content=item.pull_json[is_pity], media_type="application/json").body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pull response serialization.")
+    parser.add_argument("--number", type=int, default=20_000, help="iterations per measurement")
+    args = parser.parse_args()
+
+    items = list(get_catalog().items.values())
+    if not items:
+        parser.error("the catalog is empty; run python -m app.seed first")
+    rng = random.Random(0)
+    ten = [(rng.choice(items), rng.random() < 0.1) for _ in range(10)]
+    one = ten[0]
+
+    assert pydantic_ten(ten, 1234) == fragment_ten(ten, 1234)
+    assert pydantic_one(*one) == fragment_one(*one)
+
+    print(f"{'Route':<12}{'Pydantic':>12}{'Fragments':>12}{'Speedup':>10}")
+    for label, slow, fast, args_ in (
+        ("pull", pydantic_one, fragment_one, one),
+        ("pull/ten", pydantic_ten, fragment_ten, (ten, 1234)),
+    ):
+        before = min(timeit.repeat(lambda: slow(*args_), number=args.number, repeat=3)) / args.number
+        after = min(timeit.repeat(lambda: fast(*args_), number=args.number, repeat=3)) / args.number
+        print(f"{label:<12}{before * 1e6:>10.1f}us{after * 1e6:>10.1f}us{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
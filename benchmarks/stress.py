@@ -0,0 +1,170 @@
+"""
+Concurrency stress test for the pull path.
+Run with: python -m benchmarks.stress --users 4 --concurrency 32 --workers 2
+
+A few users are hammered with concurrent single, ten and bulk pulls from
+one or more worker processes sharing a SQLite file (each process runs the
+app in-process over httpx's ASGI transport, like a uvicorn worker). Within
+a process the per-user locks serialize each user; across processes the
+pull_sequence check makes losers retry. Afterwards every user's history
+must be exactly 1..N with no duplicates, and inventory, counters, pity
+state and pull_sequence must all agree with the pulls the clients saw
+succeed. Exits 1 on any mismatch or unexpected error response.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import traceback
+
+REQUESTS = (  # (path, pulls per request)
+    ("/banners/{banner}/pull", 1),
+    ("/banners/{banner}/pull/ten", 10),
+    ("/banners/{banner}/pull/bulk?count=25", 25),
+)
+
+
+async def drive(user_ids: list[int], requests: int, concurrency: int, seed: int) -> dict:
+    import httpx
+    from app import metrics
+    from app.auth import create_access_token
+    from app.main import app
+
+    tokens = {user_id: create_access_token(user_id) for user_id in user_ids}
+    rng = random.Random(seed)
+    plan = [(rng.choice(user_ids), *rng.choice(REQUESTS), 1 + rng.randrange(2)) for _ in range(requests)]
+    pulls = dict.fromkeys(user_ids, 0)
+    batches = dict.fromkeys(user_ids, 0)
+    failures: dict[int, int] = {}
+    next_request = iter(plan)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=60) as client:
+
+            async def worker():
+                for user_id, path, count, banner in next_request:
+                    response = await client.post(
+                        path.format(banner=banner), headers={"Authorization": f"Bearer {tokens[user_id]}"}
+                    )
+                    if response.status_code == 200:
+                        pulls[user_id] += count
+                        batches[user_id] += 1
+                    else:
+                        failures[response.status_code] = failures.get(response.status_code, 0) + 1
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return {"pulls": pulls, "batches": batches, "failures": failures, "conflicts": metrics.PULL_CONFLICTS.total()}
+
+
+def _worker_process(database: str, user_ids: list[int], requests: int, concurrency: int, seed: int, results):
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    try:
+        results.put(asyncio.run(drive(user_ids, requests, concurrency, seed)))
+    except BaseException:
+        results.put({"error": traceback.format_exc()})
+        raise
+
+
+def verify(database: str, pulls: dict[int, int], batches: dict[int, int], check_sequence: bool) -> list[str]:
+    """Compare the database against what the clients saw. Returns the problems found."""
+    conn = sqlite3.connect(database)
+    history = {
+        uid: (count, distinct, top)
+        for uid, count, distinct, top in conn.execute(
+            "SELECT user_id, COUNT(*), COUNT(DISTINCT pull_number), MAX(pull_number) FROM pulls GROUP BY user_id"
+        )
+    }
+    inventory = dict(conn.execute("SELECT user_id, SUM(quantity) FROM inventory GROUP BY user_id"))
+    counters = dict(conn.execute("SELECT user_id, SUM(total_pulls) FROM user_banner_stats GROUP BY user_id"))
+    pity = dict(conn.execute("SELECT user_id, MAX(last_pull_number) FROM pity_state GROUP BY user_id"))
+    sequence = dict(conn.execute("SELECT id, pull_sequence FROM users"))
+    conn.close()
+
+    problems = []
+    for user_id, expected in pulls.items():
+        count, distinct, top = history.get(user_id, (0, 0, 0))
+        checks = {
+            "pulls": count,
+            "distinct pull numbers": distinct,
+            "highest pull number": top or 0,
+            "inventory quantity": inventory.get(user_id, 0),
+            "stats total_pulls": counters.get(user_id, 0),
+            "pity last_pull_number": pity.get(user_id, 0),
+        }
+        for label, value in checks.items():
+            if value != expected:
+                problems.append(f"user {user_id}: {label} is {value}, clients saw {expected} pulls")
+        if check_sequence and sequence.get(user_id) != batches[user_id]:
+            problems.append(
+                f"user {user_id}: pull_sequence is {sequence.get(user_id)}, clients saw {batches[user_id]} batches"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent pulls and check for lost updates.")
+    parser.add_argument("--users", type=int, default=4, help="users shared by every worker (fewer = more contention)")
+    parser.add_argument("--requests", type=int, default=400, help="requests per worker process")
+    parser.add_argument("--concurrency", type=int, default=32, help="in-flight requests per worker process")
+    parser.add_argument("--workers", type=int, default=2, help="processes sharing the database")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.workers > 1 and os.getenv("WRITE_BEHIND") == "1":
+        parser.error("write-behind journals are per process; use --workers 1 with WRITE_BEHIND=1")
+
+    database = os.path.join(tempfile.mkdtemp(prefix="sakura-stress-"), "stress.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    from benchmarks.load import seed_database
+
+    user_ids = seed_database(args.users, 0, args.seed)
+
+    started = time.perf_counter()
+    results = multiprocessing.get_context("spawn").Queue()
+    processes = [
+        multiprocessing.get_context("spawn").Process(
+            target=_worker_process,
+            args=(database, user_ids, args.requests, args.concurrency, args.seed + n, results),
+        )
+        for n in range(args.workers)
+    ]
+    for p in processes:
+        p.start()
+    reports = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    elapsed = time.perf_counter() - started
+    for r in reports:
+        if "error" in r:
+            sys.exit(f"A worker failed:\n{r['error']}")
+
+    pulls = {user_id: sum(r["pulls"][user_id] for r in reports) for user_id in user_ids}
+    batches = {user_id: sum(r["batches"][user_id] for r in reports) for user_id in user_ids}
+    failures: dict[int, int] = {}
+    for r in reports:
+        for code, n in r["failures"].items():
+            failures[code] = failures.get(code, 0) + n
+    requests = args.requests * args.workers
+
+    print(
+        f"{requests} requests from {args.workers} workers x {args.concurrency} in flight on {args.users} users "
+        f"in {elapsed:.1f}s ({requests / elapsed:.0f} req/s): {sum(pulls.values())} pulls, "
+        f"{sum(r['conflicts'] for r in reports):g} retried conflicts, failed responses {failures or 'none'}"
+    )
+    problems = verify(database, pulls, batches, check_sequence=os.getenv("WRITE_BEHIND") != "1")
+    for problem in problems:
+        print(f"LOST UPDATE {problem}", file=sys.stderr)
+    if not problems:
+        print("OK: every user's history, inventory, counters, pity and pull_sequence agree.")
+    # A 409 means a batch lost PULL_RETRIES races in a row and was refused, which is allowed
+    sys.exit(1 if problems or set(failures) - {409} else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Read throughput by uvicorn worker count.
+Run with: python -m benchmarks.workers --workers 1,2,4
+
+For each worker count a real `uvicorn --workers N` server is started on a
+freshly seeded database and /banners and /stats are driven over TCP. Then
+a banner is renamed from outside the server, and the benchmark measures
+how long it takes until every response shows the new name, i.e. until
+every worker has noticed the catalog change (see app.coherence).
+Scaling is bounded by the cores available; the report includes the count.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = {"banners": "/banners", "stats": "/stats"}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(client, base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(f"{base_url}/")).status_code == 200:
+                return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+        await asyncio.sleep(0.1)
+
+
+async def drive(base_url: str, path: str, tokens: list[str], requests: int, concurrency: int) -> float:
+    import httpx
+
+    next_request = iter(range(requests))
+    async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=concurrency)) as client:
+
+        async def worker():
+            for n in next_request:
+                response = await client.get(path, headers={"Authorization": f"Bearer {tokens[n % len(tokens)]}"})
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - started)
+
+
+async def propagation(base_url: str, rename, timeout: float = 30) -> float:
+    """Seconds until 50 responses in a row, each on a fresh connection, show the renamed banner."""
+    import httpx
+
+    rename()
+    started = time.perf_counter()
+    streak = 0
+    while streak < 50:
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError("catalog change never reached every worker")
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            names = [b["name"] for b in (await client.get("/banners")).json()]
+        streak = streak + 1 if any(n.endswith("(renamed)") for n in names) else 0
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark read throughput by worker count.")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated uvicorn worker counts")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="sakura-workers-"), "workers.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    from app.auth import create_access_token
+    from app.seed import BUILTIN_CATALOG, load
+    from benchmarks.load import seed_database
+
+    tokens = [create_access_token(user_id) for user_id in seed_database(args.users, 100, 0)]
+    renames = iter(range(1, 1_000_000))
+
+    def rename():
+        catalog = [dict(b) for b in BUILTIN_CATALOG]
+        catalog[0]["name"] = f"{catalog[0]['name']} {next(renames)} (renamed)"
+        load(catalog)
+
+    print(f"{os.cpu_count()} CPUs available", file=sys.stderr)
+    print(f"{'Workers':<9}" + "".join(f"{s + ' req/s':>16}" for s in SCENARIOS) + f"{'Propagation':>14}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        load(BUILTIN_CATALOG)
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers),
+             "--log-level", "warning"],
+            env=os.environ.copy(),
+        )
+        try:
+            async def run():
+                import httpx
+
+                async with httpx.AsyncClient() as client:
+                    await _wait_ready(client, base_url)
+                rates = [
+                    await drive(base_url, path, tokens, args.requests, args.concurrency)
+                    for path in SCENARIOS.values()
+                ]
+                return rates, await propagation(base_url, rename)
+
+            rates, seconds = asyncio.run(run())
+            print(f"{workers:<9}" + "".join(f"{r:>16.0f}" for r in rates) + f"{seconds:>13.2f}s")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Shared fixtures. app.database builds its engines from DATABASE_URL at
+import time, so the scratch database is configured here, before any test
+module imports the app.
+"""
+import os
+import tempfile
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix="sakura-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ["ARCHIVE_DIR"] = os.path.join(_scratch, "archive")
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+
+@pytest.fixture
+def user_ids(monkeypatch) -> list[int]:
+    """A fresh schema with the built-in catalog and four users without history."""
+    from app import concurrency, idempotency
+    from benchmarks.load import seed_database
+
+    idempotency.response_cache.clear()
+    # asyncio locks bind to the first event loop that waits on them; each test runs its own loop
+    monkeypatch.setattr(concurrency, "user_locks", concurrency.StripedLocks(concurrency.PULL_LOCK_STRIPES))
+    return seed_database(4, 0, 0)
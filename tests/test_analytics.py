@@ -0,0 +1,48 @@
+"""
+Hourly banner rollups: rebuilding them from history, archived or not, must
+reproduce what the pulls recorded as they were made.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from app import gacha
+from app.analytics import rebuild_rollups
+from app.archive import archive_user
+from app.catalog import get_catalog
+from app.database import SessionLocal
+from app.models import BannerHourlyRollup
+
+
+def _pull(user_id: int, count: int) -> None:
+    db = SessionLocal()
+    try:
+        asyncio.run(gacha.do_multi_pull_async(db, user_id, get_catalog().banners[1], count))
+    finally:
+        db.close()
+
+
+def _rollups() -> set[tuple]:
+    db = SessionLocal()
+    try:
+        return set(db.execute(select(BannerHourlyRollup.__table__)).all())
+    finally:
+        db.close()
+
+
+def test_rebuild_reproduces_recorded_rollups(user_ids):
+    _pull(user_ids[0], 60)
+    _pull(user_ids[1], 100)
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+    db = SessionLocal()
+    assert archive_user(db, user_ids[0], cutoff) == 60
+    db.close()
+    _pull(user_ids[0], 30)
+    recorded = _rollups()
+
+    db = SessionLocal()
+    assert rebuild_rollups(db) == len(recorded)
+    db.commit()
+    db.close()
+    assert _rollups() == recorded
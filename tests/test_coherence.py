@@ -0,0 +1,40 @@
+"""
+Cross-process cache coherence: what one worker commits, the others pick up
+on their next check, without taking a writer connection to do it.
+"""
+from sqlalchemy import event
+
+from app import coherence
+from app.catalog import bump_catalog_version, get_catalog
+from app.database import SessionLocal, engine
+
+
+def _writer_checkouts(fn, *args) -> int:
+    checkouts = []
+
+    def listener(*_):
+        checkouts.append(1)
+
+    event.listen(engine, "checkout", listener)
+    try:
+        fn(*args)
+    finally:
+        event.remove(engine, "checkout", listener)
+    return len(checkouts)
+
+
+def test_check_reloads_a_catalog_changed_elsewhere(user_ids):
+    before = get_catalog()
+    db = SessionLocal()
+    bump_catalog_version(db)  # another worker's reseed; this process's snapshot isn't invalidated
+    db.commit()
+    db.close()
+
+    assert _writer_checkouts(coherence.check) == 0
+    assert get_catalog().version == before.version + 1
+
+
+def test_only_pruning_takes_a_writer(user_ids):
+    get_catalog()
+    assert _writer_checkouts(coherence.check) == 0
+    assert _writer_checkouts(coherence.check, True) == 1
@@ -0,0 +1,186 @@
+"""
+The pull engine: pity, the 10-pull guarantee, pull numbering and what a
+committed batch leaves behind.
+"""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app import gacha, idempotency, metrics
+from app.auth import create_access_token
+from app.catalog import ItemSnapshot, _snapshot_banner, get_catalog
+from app.database import SessionLocal
+from app.main import app
+from app.models import IdempotencyKey, PityState, Pull
+
+
+def _pull(user_id: int, banner_id: int, count: int) -> list[gacha.PullResult]:
+    banner = get_catalog().banners[banner_id]
+    db = SessionLocal()
+    try:
+        return asyncio.run(gacha.do_multi_pull_async(db, user_id, banner, count))
+    finally:
+        db.close()
+
+
+def _banner(**weights: float | None):
+    """
+    A banner with one item per rarity: a zero weight (the default) is never
+    drawn, only forced by pity or the guarantee; None leaves the tier out.
+    """
+    weights = {"Common": 0.0, "Rare": 0.0, "Epic": 0.0, "Legendary": 0.0, **weights}
+    items = [
+        ItemSnapshot(id=n, name=rarity, rarity=rarity, drop_rate=weight, emoji="", banner_id=1)
+        for n, (rarity, weight) in enumerate(weights.items(), 1)
+        if weight is not None
+    ]
+    return _snapshot_banner(SimpleNamespace(id=1, name="Test", description="", is_active=True), items)
+
+
+def _state(since_epic: int = 0, since_legendary: int = 0) -> PityState:
+    return PityState(user_id=1, banner_id=1, since_epic=since_epic, since_legendary=since_legendary, last_pull_number=0)
+
+
+def _total_pulls(user_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return gacha.get_total_pulls(db, user_id)
+    finally:
+        db.close()
+
+
+# ── Pity ─────────────────────────────────────────────────
+def test_pity_fires_on_the_50th_and_90th_pull_without_a_drop():
+    banner, state = _banner(Common=1), _state()
+    results = [gacha.resolve_pulls(state, banner, 1, n)[0] for n in range(1, 141)]
+
+    # A Legendary resets the Epic counter too, so the next Epic is 50 pulls after it
+    forced = [(n, r.item.rarity) for n, r in enumerate(results, 1) if r.is_pity]
+    assert forced == [(50, "Epic"), (90, "Legendary"), (140, "Epic")]
+
+
+@pytest.mark.parametrize("since_epic, forced", [(48, False), (49, True)])
+def test_epic_pity_threshold(since_epic, forced):
+    state = _state(since_epic=since_epic)
+    (result,) = gacha.resolve_pulls(state, _banner(Common=1), 1, 1)
+    assert result.is_pity is forced
+    assert result.item.rarity == ("Epic" if forced else "Common")
+    assert state.since_epic == (0 if forced else since_epic + 1)
+
+
+@pytest.mark.parametrize("since_legendary, forced", [(88, False), (89, True)])
+def test_legendary_pity_threshold(since_legendary, forced):
+    # since_epic stays low so only the Legendary counter can fire
+    state = _state(since_legendary=since_legendary)
+    (result,) = gacha.resolve_pulls(state, _banner(Common=1), 1, 1)
+    assert result.is_pity is forced
+    assert result.item.rarity == ("Legendary" if forced else "Common")
+    assert (state.since_epic, state.since_legendary) == ((0, 0) if forced else (1, since_legendary + 1))
+
+
+def test_legendary_pity_wins_over_epic_pity():
+    (result,) = gacha.resolve_pulls(_state(since_epic=49, since_legendary=89), _banner(Common=1), 1, 1)
+    assert (result.item.rarity, result.is_pity) == ("Legendary", True)
+
+
+def test_pity_for_a_missing_tier_falls_back_to_a_natural_draw():
+    (result,) = gacha.resolve_pulls(_state(since_epic=49), _banner(Common=1, Epic=None), 1, 1)
+    # No Epic items: the pull is drawn normally, but still reported as pity
+    assert (result.item.rarity, result.is_pity) == ("Common", True)
+
+
+# ── 10-pull guarantee ────────────────────────────────────
+@pytest.mark.parametrize("count", [10, 25, 40])
+def test_one_guarantee_per_complete_block_of_10(count):
+    results = gacha.resolve_pulls(_state(), _banner(Common=1), count, 1)
+
+    upgraded = [n for n, r in enumerate(results) if r.guaranteed]
+    assert upgraded == [n for n in range(count) if n % 10 == 9]
+    for n in upgraded:
+        assert (results[n].item.rarity, results[n].is_pity) == ("Rare", True)
+
+
+@pytest.mark.parametrize("count", [1, 9])
+def test_no_guarantee_without_a_complete_block(count):
+    assert not any(r.guaranteed for r in gacha.resolve_pulls(_state(), _banner(Common=1), count, 1))
+
+
+def test_block_with_a_rare_or_better_is_not_upgraded():
+    assert not any(r.guaranteed for r in gacha.resolve_pulls(_state(), _banner(Rare=1), 30, 1))
+
+
+def test_pity_pull_counts_toward_its_block():
+    # The 6th pull is a forced Epic, so only the second block needs the guarantee
+    results = gacha.resolve_pulls(_state(since_epic=44), _banner(Common=1), 20, 1)
+    assert results[5].item.rarity == "Epic"
+    assert [n for n, r in enumerate(results) if r.guaranteed] == [19]
+
+
+# ── Pull numbers ─────────────────────────────────────────
+def test_pull_numbers_are_contiguous_across_batches_and_banners(user_ids):
+    user_id = user_ids[0]
+    batches = [(1, 10), (2, 1), (1, 25), (2, 10), (1, 1), (2, 37)]
+    for banner_id, count in batches:
+        _pull(user_id, banner_id, count)
+
+    db = SessionLocal()
+    try:
+        numbers = db.scalars(select(Pull.pull_number).where(Pull.user_id == user_id).order_by(Pull.pull_number)).all()
+        total = gacha.get_total_pulls(db, user_id)
+    finally:
+        db.close()
+    expected = sum(count for _, count in batches)
+    assert numbers == list(range(1, expected + 1))
+    assert total == expected
+
+
+# ── Metrics ──────────────────────────────────────────────
+def test_retried_conflict_is_counted_once(user_ids, monkeypatch):
+    stale = iter([-1])  # the first attempt reads a pull_sequence another worker has moved past
+    read = gacha.read_pull_sequence
+    monkeypatch.setattr(gacha, "read_pull_sequence", lambda db, uid: next(stale, None) or read(db, uid))
+    conflicts, pulls = metrics.PULL_CONFLICTS.total(), metrics.PULLS.total()
+
+    _pull(user_ids[0], 1, 10)
+
+    assert metrics.PULL_CONFLICTS.total() == conflicts + 1
+    assert metrics.PULLS.total() == pulls + 10
+
+
+def test_rolled_back_batch_is_not_counted(user_ids):
+    # Another worker already stored this Idempotency-Key, so the batch rolls back
+    db = SessionLocal()
+    db.add(IdempotencyKey(
+        user_id=user_ids[0], key="k", request="pull:1:10", response=b"{}", expires_at=time.time() + 60,
+    ))
+    db.commit()
+    keyed = idempotency.Pending("k", "pull:1:10", lambda results, total: b"{}")
+    pulls = metrics.PULLS.total()
+    with pytest.raises(IntegrityError):
+        asyncio.run(gacha.do_idempotent_pull_async(db, user_ids[0], get_catalog().banners[1], 10, keyed))
+    db.close()
+
+    assert metrics.PULLS.total() == pulls
+    assert _total_pulls(user_ids[0]) == 0
+
+
+def test_bulk_stream_numbers_pulls_after_earlier_batches(user_ids):
+    headers = {"Authorization": f"Bearer {create_access_token(user_ids[0])}"}
+
+    async def pull() -> list[dict]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            (await client.post("/banners/1/pull/ten", headers=headers)).raise_for_status()
+            response = await client.post("/banners/2/pull/bulk?count=25", headers=headers)
+            response.raise_for_status()
+            return [json.loads(line) for line in response.text.splitlines()]
+
+    *lines, summary = asyncio.run(pull())
+    assert [line["pull_number"] for line in lines] == list(range(11, 36))
+    assert summary["summary"]["count"] == 25
+    assert summary["summary"]["total_pulls"] == 35
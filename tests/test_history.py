@@ -0,0 +1,98 @@
+"""
+History and inventory reads: pages run into the archive, and in async mode
+nothing that touches a file or reloads the catalog runs on the event loop.
+"""
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import catalog as catalog_module, history
+from app.archive import archive_user
+from app.auth import create_access_token
+from app.catalog import get_catalog
+from app.database import SessionLocal, engine
+from app.gacha import do_multi_pull_async
+from app.main import app
+from app.models import Inventory, Item
+
+
+def _pull(user_id: int, count: int) -> None:
+    db = SessionLocal()
+    try:
+        asyncio.run(do_multi_pull_async(db, user_id, get_catalog().banners[1], count))
+    finally:
+        db.close()
+
+
+def _archive(user_id: int) -> None:
+    db = SessionLocal()
+    try:
+        archive_user(db, user_id, datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1))
+    finally:
+        db.close()
+
+
+def test_async_page_reads_the_archive_off_the_event_loop(user_ids, monkeypatch):
+    _pull(user_ids[0], 30)
+    _archive(user_ids[0])
+    _pull(user_ids[0], 10)
+
+    threads = []
+    archived_page = history.archived_page
+
+    def spy(*args):
+        threads.append(threading.current_thread())
+        return archived_page(*args)
+
+    monkeypatch.setattr(history, "archived_page", spy)
+
+    async def page() -> list:
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{engine.url.database}")
+        try:
+            async with async_sessionmaker(async_engine)() as db:
+                return await history.history_page_async(db, user_ids[0], 25)
+        finally:
+            await async_engine.dispose()
+
+    rows = asyncio.run(page())
+    assert [row.pull_number for row in rows] == list(range(40, 15, -1))
+    assert threads and threading.main_thread() not in threads
+
+    db = SessionLocal()
+    try:
+        assert history.history_page(db, user_ids[0], 25) == rows
+    finally:
+        db.close()
+
+
+def test_inventory_resolves_items_newer_than_the_catalog(user_ids, monkeypatch):
+    get_catalog()
+    threads = []
+    newer_than = catalog_module._newer_than
+
+    def spy(catalog):
+        threads.append(threading.current_thread())
+        return newer_than(catalog)
+
+    monkeypatch.setattr(catalog_module, "_newer_than", spy)
+    # Another worker adds an item and grants it; this process's snapshot predates it
+    db = SessionLocal()
+    item = Item(name="Late Bloom", rarity="Epic", drop_rate=0.0, emoji="🌺", banner_id=1, is_active=False)
+    db.add(item)
+    db.flush()
+    db.add(Inventory(user_id=user_ids[0], item_id=item.id, quantity=2))
+    db.commit()
+    db.close()
+
+    async def inventory() -> list[dict]:
+        headers = {"Authorization": f"Bearer {create_access_token(user_ids[0])}"}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/inventory", headers=headers)
+            response.raise_for_status()
+            return response.json()
+
+    assert asyncio.run(inventory()) == [{"item_name": "Late Bloom", "rarity": "Epic", "emoji": "🌺", "quantity": 2}]
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
@@ -0,0 +1,180 @@
+"""
+Write-behind journal recovery: whatever point a process dies at, a restart
+must apply every acknowledged pull exactly once.
+"""
+import os
+
+import pytest
+
+from app import idempotency, journal as journal_module
+from app.catalog import get_catalog
+from app.database import SessionLocal, engine
+from app.journal import PullJournal
+from benchmarks.stress import verify
+
+
+class Crash(Exception):
+    pass
+
+
+def _start(path: str, evict_after: float = 60) -> PullJournal:
+    # The background writer never wakes on its own; tests flush explicitly
+    journal = PullJournal(path, flush_interval=3600, evict_after=evict_after)
+    journal.start()
+    return journal
+
+
+def _crash(journal: PullJournal) -> None:
+    """Stop the journal the way a killed process would: no final flush, nothing truncated."""
+    journal.flush = lambda: 0
+    journal._stop.set()
+    journal._wake.set()
+    journal._thread.join()
+    journal._file.close()
+    if journal._owner is not None:
+        journal._owner.close()
+
+
+def _load(journal: PullJournal, user_id: int):
+    db = SessionLocal()
+    try:
+        return journal.load_user(db, user_id)
+    finally:
+        db.close()
+
+
+def _pull(journal: PullJournal, user_id: int, batches: int, count: int = 10) -> None:
+    banner = get_catalog().banners[1]
+    for _ in range(batches):
+        journal.pull(_load(journal, user_id), banner, count)
+
+
+def _lookup(user_id: int, key: str, request: str) -> bytes | None:
+    db = SessionLocal()
+    try:
+        return idempotency.lookup(db, user_id, key, request)
+    finally:
+        db.close()
+
+
+def _verify(pulls: dict[int, int]) -> None:
+    # Write-behind bumps pull_sequence per applied batch, not per request
+    assert verify(engine.url.database, pulls, dict.fromkeys(pulls, 0), check_sequence=False) == []
+
+
+@pytest.fixture
+def path(tmp_path, user_ids) -> str:
+    return str(tmp_path / "pulls.journal")
+
+
+def test_crash_before_apply_replays_everything(path, user_ids):
+    journal = _start(path)
+    _pull(journal, user_ids[0], 3)
+    _pull(journal, user_ids[1], 2)
+    _crash(journal)
+    _verify({user_ids[0]: 0, user_ids[1]: 0})
+
+    journal = _start(path)
+    _verify({user_ids[0]: 30, user_ids[1]: 20})
+    _pull(journal, user_ids[0], 1)
+    journal.stop()
+    _verify({user_ids[0]: 40, user_ids[1]: 20})
+
+
+def test_crash_after_apply_does_not_reapply(path, user_ids, monkeypatch):
+    journal = _start(path)
+    _pull(journal, user_ids[0], 3)
+    _pull(journal, user_ids[1], 2)
+
+    # The first two records commit, then the process dies before the journal is truncated
+    apply = journal_module._apply
+
+    def apply_then_crash(records):
+        apply(records[:2])
+        raise Crash
+
+    monkeypatch.setattr(journal_module, "_apply", apply_then_crash)
+    with pytest.raises(Crash):
+        journal.flush()
+    _crash(journal)
+    monkeypatch.setattr(journal_module, "_apply", apply)
+    _verify({user_ids[0]: 20, user_ids[1]: 0})
+
+    journal = _start(path)
+    _verify({user_ids[0]: 30, user_ids[1]: 20})
+    journal.stop()
+    _verify({user_ids[0]: 30, user_ids[1]: 20})
+
+
+def test_crash_after_apply_and_truncate_does_not_reapply(path, user_ids):
+    journal = _start(path)
+    _pull(journal, user_ids[0], 3)
+    assert journal.flush() == 3
+    _crash(journal)
+
+    journal = _start(path)
+    journal.stop()
+    _verify({user_ids[0]: 30})
+
+
+def test_torn_final_record_is_ignored(path, user_ids):
+    journal = _start(path)
+    _pull(journal, user_ids[0], 2)
+    _crash(journal)
+    # A write cut short by the crash: never fsynced, so never acknowledged
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"seq":3,"user_id":%d,"banner_id":1,"fi' % user_ids[0])
+
+    journal = _start(path)
+    assert os.path.getsize(path) == 0
+    _verify({user_ids[0]: 20})
+    _pull(journal, user_ids[0], 1)
+    journal.stop()
+    _verify({user_ids[0]: 30})
+
+
+def test_idle_users_are_evicted_once_applied(path, user_ids):
+    journal = _start(path, evict_after=0)
+    _pull(journal, user_ids[0], 2)
+    stale = _load(journal, user_ids[0])
+    assert journal.flush() == 2
+    assert journal.loaded(user_ids[0]) is None
+
+    # A pull holding the state from before the eviction picks up where it left off
+    journal.pull(stale, get_catalog().banners[1], 10)
+    assert journal.loaded(user_ids[0]) is stale
+    _pull(journal, user_ids[0], 1)
+    journal.stop()
+    _verify({user_ids[0]: 40})
+
+
+def test_idempotency_key_is_applied_with_its_pulls(path, user_ids):
+    keyed = idempotency.Pending("retry-1", "pull:1:10", lambda results, total: b'{"total_pulls":%d}' % total)
+    journal = _start(path)
+    _pull(journal, user_ids[0], 1)
+    user = _load(journal, user_ids[0])
+    _, stored = journal.pull(user, get_catalog().banners[1], 10, keyed)
+    assert stored.body == b'{"total_pulls":20}'
+    # Journalled but not applied: a retry is still answered, from memory
+    assert _lookup(user_ids[0], "retry-1", "pull:1:10") == stored.body
+    _crash(journal)
+
+    # A new process: nothing in memory, the key comes back with the replayed pulls
+    idempotency.response_cache.clear()
+    journal = _start(path)
+    assert _lookup(user_ids[0], "retry-1", "pull:1:10") == stored.body
+    journal.stop()
+    _verify({user_ids[0]: 20})
+
+
+def test_applied_idempotency_key_leaves_memory(path, user_ids):
+    keyed = idempotency.Pending("retry-2", "pull:1:10", lambda results, total: b"{}")
+    journal = _start(path)
+    user = _load(journal, user_ids[0])
+    journal.pull(user, get_catalog().banners[1], 10, keyed)
+    assert journal.flush() == 1
+    journal.stop()
+
+    assert idempotency.response_cache._pinned == {}
+    idempotency.response_cache.clear()
+    assert _lookup(user_ids[0], "retry-2", "pull:1:10") == b"{}"
@@ -0,0 +1,23 @@
+"""
+Schema checks: the server and the CLIs refuse an out-of-date database and
+point at app.migrate, which brings it up to date.
+"""
+import pytest
+from sqlalchemy import text
+
+from app.database import SCHEMA_HINT, engine, missing_schema, require_schema
+from app.migrate import migrate
+
+
+def test_out_of_date_schema_is_refused_until_migrated(user_ids):
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE journal_checkpoint"))
+        conn.execute(text("ALTER TABLE users DROP COLUMN pull_sequence"))
+
+    assert sorted(missing_schema()) == ["journal_checkpoint", "users.pull_sequence"]
+    with pytest.raises(RuntimeError, match=SCHEMA_HINT):
+        require_schema()
+
+    migrate()
+    assert missing_schema() == []
+    require_schema()
@@ -0,0 +1,96 @@
+"""
+Statistical checks for app.sampler: empirical draw rates must match the
+configured drop rates. Every test uses a fixed seed, so a failure is a
+real bias rather than bad luck; the tolerance is 5 standard deviations.
+"""
+import math
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from app.catalog import ItemSnapshot, _snapshot_banner
+from app.sampler import AliasTable
+from app.seed import BUILTIN_CATALOG
+
+DRAWS = 200_000
+SIGMAS = 5
+
+
+def _assert_rates(counts: Counter, weights: list[float], draws: int) -> None:
+    total = sum(weights)
+    for i, weight in enumerate(weights):
+        p = weight / total
+        tolerance = SIGMAS * math.sqrt(draws * p * (1 - p))
+        assert abs(counts[i] - draws * p) <= tolerance, (
+            f"index {i}: drawn {counts[i]} times, expected {draws * p:.0f} +/- {tolerance:.0f}"
+        )
+
+
+def _banner(n: int, entry: dict):
+    items = [
+        ItemSnapshot(
+            id=n * 100 + k, name=i["name"], rarity=i["rarity"], drop_rate=i["drop_rate"], emoji=i["emoji"], banner_id=n,
+        )
+        for k, i in enumerate(entry["items"])
+    ]
+    return _snapshot_banner(SimpleNamespace(id=n, name=entry["name"], description="", is_active=True), items)
+
+
+@pytest.mark.parametrize("entry", BUILTIN_CATALOG, ids=[b["key"] for b in BUILTIN_CATALOG])
+def test_sample_matches_seed_drop_rates(entry):
+    weights = [i["drop_rate"] for i in entry["items"]]
+    counts = Counter(AliasTable(weights).sample(DRAWS, random.Random(1)))
+    _assert_rates(counts, weights, DRAWS)
+
+
+@pytest.mark.parametrize("entry", BUILTIN_CATALOG, ids=[b["key"] for b in BUILTIN_CATALOG])
+def test_draw_matches_seed_drop_rates(entry):
+    weights = [i["drop_rate"] for i in entry["items"]]
+    table = AliasTable(weights)
+    rng = random.Random(2)
+    counts = Counter(table.draw(rng) for _ in range(DRAWS))
+    _assert_rates(counts, weights, DRAWS)
+
+
+@pytest.mark.parametrize("entry", BUILTIN_CATALOG, ids=[b["key"] for b in BUILTIN_CATALOG])
+def test_banner_samplers_match_item_drop_rates(entry):
+    banner = _banner(1, entry)
+    counts = Counter(banner.sampler.sample(DRAWS, random.Random(3)))
+    _assert_rates(counts, [i.drop_rate for i in banner.items], DRAWS)
+
+
+@pytest.mark.parametrize("entry", BUILTIN_CATALOG, ids=[b["key"] for b in BUILTIN_CATALOG])
+def test_rarity_samplers_are_uniform_within_tier(entry):
+    banner = _banner(1, entry)
+    rng = random.Random(4)
+    for rarity, pool in banner.by_rarity.items():
+        draws = 20_000 * len(pool)
+        counts = Counter(banner.rarity_samplers[rarity].draw(rng) for _ in range(draws))
+        assert set(counts) <= set(range(len(pool)))
+        _assert_rates(counts, [1.0] * len(pool), draws)
+
+
+@pytest.mark.parametrize("weights", [
+    [0.0, 5.0, 3.0, 2.0],
+    [5.0, 0.0, 3.0, 0.0, 2.0],
+    [1.0, 2.0, 0.0],
+    [0.0, 0.0, 1.0],
+])
+def test_zero_weight_is_never_drawn(weights):
+    table = AliasTable(weights)
+    rng = random.Random(5)
+    counts = Counter(table.sample(DRAWS, rng))
+    counts.update(table.draw(rng) for _ in range(DRAWS))
+    for i, weight in enumerate(weights):
+        if weight == 0:
+            assert counts[i] == 0, f"zero-weight index {i} was drawn {counts[i]} times"
+    _assert_rates(counts, weights, 2 * DRAWS)
+
+
+def test_rejects_empty_or_all_zero_weights():
+    with pytest.raises(ValueError):
+        AliasTable([])
+    with pytest.raises(ValueError):
+        AliasTable([0.0, 0.0])
@@ -0,0 +1,27 @@
+"""
+Declarative catalog loads: entries are matched on their keys, so reloading
+a file only touches what changed and keeps ids stable.
+"""
+import copy
+
+from app.catalog import get_catalog
+from app.seed import BUILTIN_CATALOG, CatalogDiff, item_key, load
+
+
+def test_reload_touches_only_what_changed(user_ids):
+    version = get_catalog().version
+    ids = {item.name: item.id for item in get_catalog().items.values()}
+    assert load(BUILTIN_CATALOG) == CatalogDiff(banners=2, items=22, inserted=0, updated=0, deactivated=0)
+    assert get_catalog().version == version
+
+    entries = copy.deepcopy(BUILTIN_CATALOG)
+    entries[0]["items"][0]["drop_rate"] *= 2
+    retired = entries[1]["items"].pop()
+    entries[1]["items"].append({**retired, "key": item_key(entries[1]["key"], "Late Bloom"), "name": "Late Bloom"})
+    assert load(entries) == CatalogDiff(banners=2, items=22, inserted=1, updated=1, deactivated=1)
+
+    catalog = get_catalog()
+    assert catalog.version == version + 1
+    assert {item.name: item.id for item in catalog.items.values() if item.name != "Late Bloom"} == ids
+    assert retired["name"] not in {item.name for item in catalog.banners[2].items}
+    assert catalog.item(ids[retired["name"]]).name == retired["name"]
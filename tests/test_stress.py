@@ -0,0 +1,59 @@
+"""
+A small run of benchmarks.stress: a few users hammered with concurrent
+single, ten and bulk pulls, then the database checked for lost updates.
+"""
+import asyncio
+import multiprocessing
+
+from app import gacha, metrics
+from app.database import engine
+from benchmarks.stress import _worker_process, drive, verify
+
+
+def _check(report: dict) -> None:
+    # A 409 means a batch lost every retry, which is allowed; nothing else is
+    assert set(report["failures"]) <= {409}
+    assert verify(engine.url.database, report["pulls"], report["batches"], check_sequence=True) == []
+
+
+def test_concurrent_pulls_lose_nothing(user_ids):
+    report = asyncio.run(drive(user_ids, requests=120, concurrency=16, seed=1))
+    assert sum(report["pulls"].values()) > 0
+    _check(report)
+
+
+def test_conflicting_pulls_are_retried_without_loss(user_ids, monkeypatch):
+    # Every 4th batch reads pity state that another worker has already moved
+    # past, as if it lost a race, so its pull_sequence claim fails
+    calls = iter(range(1_000_000))
+    read = gacha.read_pull_sequence
+    monkeypatch.setattr(gacha, "read_pull_sequence", lambda db, uid: read(db, uid) - (next(calls) % 4 == 3))
+    conflicts = metrics.PULL_CONFLICTS.total()
+
+    report = asyncio.run(drive(user_ids, requests=80, concurrency=8, seed=2))
+    assert metrics.PULL_CONFLICTS.total() > conflicts
+    _check(report)
+
+
+def test_two_processes_lose_nothing(user_ids):
+    # Separate processes don't share the per-user locks: only pull_sequence keeps them apart
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    database = engine.url.database
+    processes = [
+        context.Process(target=_worker_process, args=(database, user_ids[:2], 60, 8, n, results))
+        for n in range(2)
+    ]
+    for p in processes:
+        p.start()
+    reports = [results.get(timeout=120) for _ in processes]
+    for p in processes:
+        p.join()
+
+    assert not any("error" in r for r in reports), [r.get("error") for r in reports]
+    merged = {
+        "pulls": {uid: sum(r["pulls"][uid] for r in reports) for uid in user_ids[:2]},
+        "batches": {uid: sum(r["batches"][uid] for r in reports) for uid in user_ids[:2]},
+        "failures": {code: n for r in reports for code, n in r["failures"].items()},
+    }
+    _check(merged)